@@ -1,11 +1,14 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional, Sequence, Tuple
 import numpy as np
 
 
 class BaseVectorDB(ABC):
     """
     Vector DB interface for storing and searching embeddings.
+
+    Databases that can remove embeddings implement :class:`RemovableVectorDB`, and databases that can be saved
+    and loaded implement :class:`PersistentVectorDB`.
     """
 
     @abstractmethod
@@ -17,3 +20,81 @@ class BaseVectorDB(ABC):
     def search(self, query_embedding: np.ndarray, top_k: int) -> List[int]:
         """Return top-k most similar documents for the query embedding."""
         pass
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the scores and the positions of the top-k most similar documents for each query embedding.
+
+        The default implementation searches the query embeddings one by one with :meth:`search`, which does not
+        return the scores, so the scores of the found documents are NaN. Databases that can score several query
+        embeddings at once override it.
+
+        Args:
+            query_embeddings (np.ndarray): Query embeddings in rows.
+            top_k (int): Number of documents for each query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Query-by-top_k matrices of the similarity scores in descending order
+                and of the positions of the documents. Missing documents have the score -inf and the position -1.
+        """
+        scores = np.full((len(query_embeddings), top_k), -np.inf, dtype=np.float32)
+        positions = np.full((len(query_embeddings), top_k), -1, dtype=np.int64)
+        for number, query_embedding in enumerate(query_embeddings):
+            query_positions = self.search(query_embedding, top_k)[:top_k]
+            scores[number, :len(query_positions)] = np.nan
+            positions[number, :len(query_positions)] = query_positions
+        return scores, positions
+
+    def set_search_parameters(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Set the parameters of approximate search that trade recall for speed. Exact databases ignore them.
+
+        Args:
+            nprobe (Optional[int]): If given, the number of inverted lists visited by a search in an IVF index.
+            ef_search (Optional[int]): If given, the size of the candidate list of a search in an HNSW graph.
+        """
+        pass
+
+
+class RemovableVectorDB(BaseVectorDB):
+    """
+    Vector DB interface for databases whose embeddings can be removed.
+    """
+
+    @abstractmethod
+    def remove(self, positions: Sequence[int]):
+        """Remove the embeddings at the given positions. The positions of the following embeddings shift down."""
+        pass
+
+    @property
+    def supports_removal(self) -> bool:
+        """Whether :meth:`remove` can remove embeddings, which can depend on the configuration of the database."""
+        return True
+
+
+class PersistentVectorDB(BaseVectorDB):
+    """
+    Vector DB interface for databases that can be saved to a directory and loaded from it.
+    """
+
+    @abstractmethod
+    def save(self, path: str):
+        """Save the database to a directory, which is created if it does not exist.
+
+        Args:
+            path (str): The directory of the saved database.
+        """
+        pass
+
+    @classmethod
+    @abstractmethod
+    def load(cls, path: str, mmap: bool = True) -> 'PersistentVectorDB':
+        """Load a database saved with :meth:`save`.
+
+        Args:
+            path (str): The directory of the saved database.
+            mmap (bool): Whether the embeddings are memory-mapped from the directory rather than read into memory,
+                so that processes that load the same database share the embeddings through the page cache.
+
+        Returns:
+            PersistentVectorDB: The loaded database.
+        """
+        pass
@@ -1,23 +1,387 @@
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
 import faiss
 import numpy as np
-from .base_vector_db import BaseVectorDB
+from .base_vector_db import PersistentVectorDB, RemovableVectorDB
+from ..storage.compression import EmbeddingCompressor
+from ..storage.shards import ShardStore
+
+
+# default number of candidates retrieved from compressed embeddings for each result that is rescored
+RESCORING_FACTOR = 4
+
+FAISS_INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8')
+
+# index types whose codes lose precision, so that their candidates are rescored like compressed embeddings
+LOSSY_INDEX_TYPES = ('ivf_pq', 'sq8')
+
+# index types built on inverted files, which remove embeddings by their ids without an id map
+IVF_INDEX_TYPES = ('ivf_flat', 'ivf_pq')
+
+FAISS_SCALAR_QUANTIZERS = {
+    'float16': 'SQfp16',
+    'int8': 'SQ8',
+}
 
+# default maximum number of embeddings sampled from the first added embeddings to train an index
+TRAINING_SAMPLE_SIZE = 2 ** 18
 
-class FaissVectorDB(BaseVectorDB):
+# minimum number of training embeddings per centroid of the k-means clustering recommended by FAISS
+MIN_POINTS_PER_CENTROID = 39
+
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+INDEX_FILENAME = 'index.faiss'
+METADATA_FILENAME = 'metadata.json'
+IDS_FILENAME = 'ids.npy'
+COMPRESSOR_FILENAME = 'compressor.npz'
+EMBEDDINGS_FILENAME = 'embeddings.npy'
+
+
+class FaissVectorDB(RemovableVectorDB, PersistentVectorDB):
     """
     Vector DB implementation using FAISS for efficient similarity search.
     This class uses the FAISS library to create an index for fast nearest neighbor search.
-    It supports adding embeddings and searching for the most similar ones.
+    It supports adding embeddings, searching for the most similar ones, and removing embeddings.
+
+    Embeddings are added after the embeddings in the database, and the search returns their positions. Each
+    embedding also has an id, which stays the same when the positions shift down after a removal. The ids are
+    either given when the embeddings are added or assigned in ascending order.
+
+    The database can be saved to a directory and loaded with the index and the float32 embeddings
+    memory-mapped, so that processes that load the same database share them through the page cache. A
+    memory-mapped index is read into memory before embeddings are added to it or removed from it.
+
+    Besides the exact 'flat' index, the embeddings can be searched approximately in sub-linear time with an
+    inverted file of k-means clusters that stores the embeddings ('ivf_flat') or their product quantization
+    codes ('ivf_pq'), with a hierarchical navigable small world graph ('hnsw'), or scanned as 'sq8' scalar
+    quantization codes. The indexes are trained on a sample of the first added embeddings. Embeddings cannot
+    be removed from the 'hnsw' index.
+
+    The embeddings can be kept compressed to 'float16', to 'int8' scalar quantization per dimension fitted
+    to the first added embeddings, or to a 'pca' projection fitted to the first added embeddings. The
+    candidates retrieved from the compressed embeddings and from the 'ivf_pq' and 'sq8' indexes are then
+    rescored with the float32 embeddings, which are kept on disk and memory-mapped.
+
+    Args:
+        compression (Optional[str]): Compression of the embeddings: 'float16', 'int8', 'pca', or None.
+        num_components (Optional[int]): Number of principal components of the 'pca' compression.
+        rescoring_factor (int): Number of candidates retrieved from the compressed embeddings for each
+            result, which are rescored with the float32 embeddings. With zero, the results are not rescored
+            and the float32 embeddings are not kept, so the results are ranked by approximate scores. With
+            the 'pca' compression, these are the dot products of the projections to the principal components.
+        shard_directory (Optional[str]): Parent directory of the float32 embeddings of compressed embeddings.
+        index_type (str): Type of the index: 'flat', 'ivf_flat', 'ivf_pq', 'hnsw', or 'sq8'.
+        num_lists (Optional[int]): Number of inverted lists of the IVF indexes. If None, four times the square
+            root of the number of the first added embeddings, limited by the size of the training sample.
+        num_subquantizers (Optional[int]): Number of byte-sized codes of each embedding in the 'ivf_pq' index,
+            which must divide the dimension. If None, the largest divisor up to an eighth of the dimension.
+        num_neighbors (int): Number of neighbors of each node of the 'hnsw' graph.
+        training_sample_size (int): Maximum number of the first added embeddings that train the index.
+        nprobe (int): Number of inverted lists visited by a search in the IVF indexes.
+        ef_search (int): Size of the candidate list of a search in the 'hnsw' graph.
     """
 
-    def __init__(self):
+    def __init__(self, compression: Optional[str] = None, num_components: Optional[int] = None,
+                 rescoring_factor: int = RESCORING_FACTOR, shard_directory: Optional[str] = None,
+                 index_type: str = 'flat', num_lists: Optional[int] = None, num_subquantizers: Optional[int] = None,
+                 num_neighbors: int = 32, training_sample_size: int = TRAINING_SAMPLE_SIZE,
+                 nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
+        if index_type not in FAISS_INDEX_TYPES:
+            raise ValueError('Unknown index type {}, expected one of {}'.format(index_type, FAISS_INDEX_TYPES))
+        if compression in FAISS_SCALAR_QUANTIZERS and index_type in LOSSY_INDEX_TYPES:
+            raise ValueError('The {} index type already compresses the embeddings, it cannot be combined with '
+                             'the {} compression'.format(index_type, compression))
+
+        self.compressor = None if compression is None else EmbeddingCompressor(compression, num_components)
+        self.index_type = index_type
+        self.num_lists = num_lists
+        self.num_subquantizers = num_subquantizers
+        self.num_neighbors = num_neighbors
+        self.training_sample_size = training_sample_size
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rescoring_factor = rescoring_factor
+        lossy = compression is not None or index_type in LOSSY_INDEX_TYPES
+        self.shard_store = ShardStore(shard_directory) if lossy and rescoring_factor > 0 else None
+        self.embeddings: List[np.ndarray] = []
         self.index = None
 
-    def add(self, embeddings: np.ndarray):
-        embedding_dim = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(embedding_dim)  # Use Inner Product for cosine
-        self.index.add(embeddings)
+        # the ids of the embeddings in the order of their positions, and the positions in the order of the ids
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.id_order = np.zeros(0, dtype=np.int64)
+        self.sorted_ids = np.zeros(0, dtype=np.int64)
+        self.next_id = 0
+
+        # the file of a memory-mapped index, which is read-only
+        self.index_path: Optional[Path] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, embeddings: np.ndarray, ids: Optional[Sequence[int]] = None):
+        """Add embeddings after the embeddings in the database.
+
+        Args:
+            embeddings (np.ndarray): Embeddings in rows.
+            ids (Optional[Sequence[int]]): Unique non-negative ids of the embeddings, which can be mapped to the
+                positions of the embeddings with :meth:`get_positions` and removed with :meth:`remove_ids`. If
+                None, the ids follow the largest id in the database.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if ids is None:
+            ids = np.arange(self.next_id, self.next_id + len(embeddings), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.shape != (len(embeddings),):
+            raise ValueError('Expected {} ids, got {}'.format(len(embeddings), len(ids)))
+        if len(ids) > 0 and (ids.min() < 0 or len(np.unique(ids)) < len(ids) or (self.get_positions(ids) >= 0).any()):
+            raise ValueError('The ids must be unique, non-negative, and not in the database')
+
+        if self.index is None:
+            self.index = self._create_index(embeddings)
+        self._read_mapped_index()
+        indexed_embeddings = embeddings
+        if self.compressor is not None and self.compressor.compression == 'pca':
+            indexed_embeddings = self.compressor.compress(embeddings)
+        self.index.add_with_ids(indexed_embeddings, ids)
+        self._set_ids(np.concatenate([self.ids, ids]))
+        self.next_id = max(self.next_id, int(ids.max()) + 1) if len(ids) > 0 else self.next_id
+        if self.shard_store is not None:
+            self.embeddings.append(self.shard_store.store_array(embeddings))
+
+    def _set_ids(self, ids: np.ndarray):
+        self.ids = ids
+        self.id_order = np.argsort(ids, kind='stable')
+        self.sorted_ids = ids[self.id_order]
+
+    def get_positions(self, ids: Sequence[int]) -> np.ndarray:
+        """The positions of the embeddings with the given ids, or -1 for the ids that are not in the database."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        positions = self.id_order[np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.ids) - 1)]
+        return np.where(self.ids[positions] == ids, positions, -1)
+
+    def _create_index(self, embeddings: np.ndarray):
+        if self.compressor is not None and self.compressor.compression == 'pca':
+            # queries are projected without centering, which only shifts all scores of a query by a constant
+            self.compressor.fit(embeddings)
+            embeddings = self.compressor.compress(embeddings)
+
+        if len(embeddings) > self.training_sample_size:
+            sample = np.random.default_rng(0).choice(len(embeddings), self.training_sample_size, replace=False)
+            embeddings = embeddings[np.sort(sample)]
+
+        # the IVF indexes remove embeddings by their ids, the other indexes map the ids to their positions
+        description = self._get_index_description(embeddings)
+        if self.index_type not in IVF_INDEX_TYPES:
+            description = 'IDMap2,' + description
+        index = faiss.index_factory(embeddings.shape[1], description, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            index.train(embeddings)
+        self._set_index_parameters(index)
+        return index
+
+    def _get_index_description(self, training_embeddings: np.ndarray) -> str:
+        compression = None if self.compressor is None else self.compressor.compression
+        encoding = FAISS_SCALAR_QUANTIZERS.get(compression, 'Flat')
+        num_training_embeddings, embedding_dim = training_embeddings.shape
+        if self.index_type == 'flat':
+            return encoding
+        if self.index_type == 'sq8':
+            return 'SQ8'
+        if self.index_type == 'hnsw':
+            return 'HNSW{}'.format(self.num_neighbors) if encoding == 'Flat' else \
+                'HNSW{},{}'.format(self.num_neighbors, encoding)
+
+        num_lists = self.num_lists
+        if num_lists is None:
+            num_lists = min(int(4 * np.sqrt(num_training_embeddings)),
+                            num_training_embeddings // MIN_POINTS_PER_CENTROID)
+        num_lists = max(1, num_lists)
+        if self.index_type == 'ivf_flat':
+            return 'IVF{},{}'.format(num_lists, encoding)
+
+        num_subquantizers = self.num_subquantizers
+        if num_subquantizers is None:
+            num_subquantizers = max(divisor for divisor in range(1, max(1, embedding_dim // 8) + 1)
+                                    if embedding_dim % divisor == 0)
+        # byte-sized codes need 256 centroids per subquantizer, so small training samples use fewer bits
+        num_bits = int(min(8, max(1, np.log2(num_training_embeddings))))
+        return 'IVF{},PQ{}x{}'.format(num_lists, num_subquantizers, num_bits)
+
+    def set_search_parameters(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self.index is not None:
+            self._set_index_parameters(self.index)
+
+    def _set_index_parameters(self, index):
+        if self.index_type in IVF_INDEX_TYPES:
+            faiss.ParameterSpace().set_index_parameter(index, 'nprobe', self.nprobe)
+        elif self.index_type == 'hnsw':
+            faiss.ParameterSpace().set_index_parameter(index, 'efSearch', self.ef_search)
+
+    @property
+    def supports_removal(self) -> bool:
+        return self.index_type != 'hnsw'
+
+    def remove(self, positions: Sequence[int]):
+        if len(positions) == 0:
+            return
+        if not self.supports_removal:
+            raise NotImplementedError('The {} index of {} does not support removing embeddings'.format(
+                self.index_type, type(self).__name__))
+        positions = np.asarray(positions, dtype=np.int64)
+        self._read_mapped_index()
+        self.index.remove_ids(self.ids[positions])
+        self._set_ids(np.delete(self.ids, positions))
+        # only the shards with removed embeddings are stored again
+        offsets = np.cumsum([0] + [len(embeddings) for embeddings in self.embeddings])
+        shards = []
+        for embeddings, offset in zip(self.embeddings, offsets):
+            removed_positions = positions[(positions >= offset) & (positions < offset + len(embeddings))] - offset
+            if len(removed_positions) == 0:
+                shards.append(embeddings)
+            elif len(removed_positions) < len(embeddings):
+                shards.append(self.shard_store.store_array(np.delete(embeddings, removed_positions, axis=0)))
+        self.embeddings = shards
+
+    def remove_ids(self, ids: Sequence[int]):
+        """Remove the embeddings with the given ids. The positions of the following embeddings shift down."""
+        positions = self.get_positions(ids)
+        if (positions < 0).any():
+            raise KeyError('Ids {} are not in the database'.format(np.asarray(ids)[positions < 0].tolist()))
+        self.remove(positions)
 
     def search(self, query_embedding: np.ndarray, top_k: int):
-        _, indices = self.index.search(query_embedding.reshape(1, -1), top_k)
-        return indices[0].tolist()
+        _, positions = self.search_batch(np.reshape(query_embedding, (1, -1)), top_k)
+        return positions[0][positions[0] >= 0].tolist()
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if self.compressor is not None and self.compressor.compression == 'pca':
+            # the scores of the projected queries are shifted by a constant for each query
+            indexed_queries = np.ascontiguousarray(query_embeddings @ self.compressor.components.T)
+        else:
+            indexed_queries = query_embeddings
+        num_candidates = top_k * self.rescoring_factor if self.embeddings else top_k
+        scores, ids = self.index.search(indexed_queries, num_candidates)
+
+        # approximate indexes return fewer candidates than requested, padded with -1
+        positions = self.get_positions(ids)
+        missing = positions < 0
+        scores = np.where(missing, -np.inf, scores).astype(np.float32)
+        if not self.embeddings:
+            return scores, positions
+
+        # rescore the candidates with the float32 embeddings
+        for query_number, query_embedding in enumerate(query_embeddings):
+            found = ~missing[query_number]
+            scores[query_number, found] = self._get_embeddings(positions[query_number, found]) @ query_embedding
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(positions, order, axis=1)
+
+    def _read_mapped_index(self):
+        if self.index_path is not None:
+            self.index = faiss.read_index(str(self.index_path))
+            self._set_index_parameters(self.index)
+            self.index_path = None
+
+    def save(self, path: str):
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+        metadata = {
+            'compression': None if self.compressor is None else self.compressor.compression,
+            'num_components': None if self.compressor is None else self.compressor.num_components,
+            'rescoring_factor': self.rescoring_factor, 'index_type': self.index_type, 'num_lists': self.num_lists,
+            'num_subquantizers': self.num_subquantizers, 'num_neighbors': self.num_neighbors,
+            'training_sample_size': self.training_sample_size, 'nprobe': self.nprobe, 'ef_search': self.ef_search,
+            'next_id': self.next_id,
+        }
+
+        # the files are replaced atomically, so that processes that memory-map them keep reading the old files
+        def replace(filename: str, write):
+            temporary_path = directory / 'tmp-{}-{}'.format(os.getpid(), filename)
+            write(str(temporary_path))
+            os.replace(temporary_path, directory / filename)
+
+        if self.index is not None:
+            replace(INDEX_FILENAME, lambda filename: faiss.write_index(self.index, filename))
+        replace(IDS_FILENAME, lambda filename: np.save(filename, self.ids))
+        if self.compressor is not None and self.compressor.is_fitted:
+            arrays = {name: array for name, array in [('offset', self.compressor.offset),
+                                                      ('scale', self.compressor.scale),
+                                                      ('components', self.compressor.components)]
+                      if array is not None}
+            if arrays:
+                replace(COMPRESSOR_FILENAME, lambda filename: np.savez(filename, **arrays))
+        if self.embeddings:
+            replace(EMBEDDINGS_FILENAME, self._save_embeddings)
+        replace(METADATA_FILENAME, lambda filename: Path(filename).write_text(json.dumps(metadata)))
+
+    def _save_embeddings(self, filename: str):
+        # the shards are copied one by one, so that the memory-mapped embeddings are not read into memory at once
+        saved_embeddings = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32,
+                                                     shape=(len(self), self.embeddings[0].shape[1]))
+        offset = 0
+        for embeddings in self.embeddings:
+            saved_embeddings[offset:offset + len(embeddings)] = embeddings
+            offset += len(embeddings)
+        saved_embeddings.flush()
+        del saved_embeddings
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, shard_directory: Optional[str] = None) -> 'FaissVectorDB':
+        """Load a database saved with :meth:`save`.
+
+        Args:
+            path (str): The directory of the saved database.
+            mmap (bool): Whether the index and the float32 embeddings are memory-mapped from the directory rather
+                than read into memory.
+            shard_directory (Optional[str]): Parent directory of the float32 embeddings of compressed embeddings
+                that are added after loading.
+
+        Returns:
+            FaissVectorDB: The loaded database.
+        """
+        directory = Path(path)
+        metadata = json.loads((directory / METADATA_FILENAME).read_text())
+        next_id = metadata.pop('next_id')
+        vector_db = cls(shard_directory=shard_directory, **metadata)
+        vector_db.next_id = next_id
+        vector_db._set_ids(np.load(directory / IDS_FILENAME))
+
+        if (directory / COMPRESSOR_FILENAME).exists():
+            with np.load(directory / COMPRESSOR_FILENAME) as arrays:
+                for name, array in arrays.items():
+                    setattr(vector_db.compressor, name, array)
+
+        if (directory / EMBEDDINGS_FILENAME).exists() and vector_db.shard_store is not None:
+            vector_db.embeddings = [np.load(directory / EMBEDDINGS_FILENAME, mmap_mode='r' if mmap else None)]
+
+        if (directory / INDEX_FILENAME).exists():
+            index_path = directory / INDEX_FILENAME
+            io_flags = 0
+            if mmap:
+                # IVF indexes map their inverted lists, the other indexes map their codes
+                io_flags = faiss.IO_FLAG_MMAP if vector_db.index_type in IVF_INDEX_TYPES else faiss.IO_FLAG_MMAP_IFC
+                vector_db.index_path = index_path
+            vector_db.index = faiss.read_index(str(index_path), io_flags)
+            vector_db._set_index_parameters(vector_db.index)
+        return vector_db
+
+    def _get_embeddings(self, positions: np.ndarray) -> np.ndarray:
+        offsets = np.cumsum([0] + [len(embeddings) for embeddings in self.embeddings])
+        chunk_numbers = np.searchsorted(offsets, positions, side='right') - 1
+        result = np.empty((len(positions), self.embeddings[0].shape[1]), dtype=np.float32)
+        for chunk_number in np.unique(chunk_numbers):
+            selected = chunk_numbers == chunk_number
+            result[selected] = self.embeddings[chunk_number][positions[selected] - offsets[chunk_number]]
+        return result
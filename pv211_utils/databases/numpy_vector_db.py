@@ -0,0 +1,162 @@
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from .base_vector_db import PersistentVectorDB, RemovableVectorDB
+from ..storage.shards import ShardStore
+
+
+NUMPY_VECTOR_DB_DTYPES = ('float32', 'float16')
+
+# default number of embeddings multiplied with the queries at once
+BLOCK_SIZE = 65536
+
+EMBEDDINGS_FILENAME = 'embeddings.npy'
+METADATA_FILENAME = 'metadata.json'
+
+
+class NumpyVectorDB(RemovableVectorDB, PersistentVectorDB):
+    """
+    Vector DB implementation using NumPy for exact similarity search without FAISS.
+    The embeddings are kept on disk in memory-mapped float32 or float16 matrices. The queries are multiplied with
+    blocks of the embeddings and the top-k embeddings of each block are merged into the top-k embeddings of the
+    previous blocks, so that the memory does not grow with the number of embeddings.
+
+    Embeddings are added to a new matrix, and only the matrices with removed embeddings are rewritten. The
+    similarities are dot products in float32, and embeddings with equal similarities are ordered by position.
+
+    Args:
+        dtype (str): Data type of the stored embeddings: 'float32' or 'float16'.
+        block_size (int): Number of embeddings multiplied with the queries at once.
+        shard_directory (Optional[str]): Parent directory of the matrices of the embeddings. If None, the default
+            temporary directory is used.
+    """
+
+    def __init__(self, dtype: str = 'float32', block_size: int = BLOCK_SIZE, shard_directory: Optional[str] = None):
+        if dtype not in NUMPY_VECTOR_DB_DTYPES:
+            raise ValueError('Unknown dtype {}, expected one of {}'.format(dtype, NUMPY_VECTOR_DB_DTYPES))
+        self.dtype = dtype
+        self.block_size = block_size
+        self.shard_store = ShardStore(shard_directory)
+        self.matrices: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(matrix) for matrix in self.matrices)
+
+    def add(self, embeddings: np.ndarray):
+        if len(embeddings) > 0:
+            self.matrices.append(self.shard_store.store_array(np.asarray(embeddings, dtype=self.dtype)))
+
+    def remove(self, positions: Sequence[int]):
+        positions = np.asarray(positions, dtype=np.int64)
+        offsets = np.cumsum([0] + [len(matrix) for matrix in self.matrices])
+        matrices = []
+        for matrix, offset in zip(self.matrices, offsets):
+            removed_positions = positions[(positions >= offset) & (positions < offset + len(matrix))] - offset
+            if len(removed_positions) == 0:
+                matrices.append(matrix)
+            elif len(removed_positions) < len(matrix):
+                matrices.append(self.shard_store.store_array(np.delete(matrix, removed_positions, axis=0)))
+        self.matrices = matrices
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> List[int]:
+        _, positions = self.search_batch(np.reshape(query_embedding, (1, -1)), top_k)
+        return positions[0][positions[0] >= 0].tolist()
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if top_k < 0:
+            raise ValueError('Expected a non-negative top_k, got {}'.format(top_k))
+        num_queries = len(query_embeddings)
+        top_scores = np.full((num_queries, top_k), -np.inf, dtype=np.float32)
+        top_positions = np.full((num_queries, top_k), -1, dtype=np.int64)
+
+        # the top-k of more than the stored embeddings are all the embeddings followed by missing embeddings
+        num_selected = min(top_k, len(self))
+        if num_selected == 0:
+            return top_scores, top_positions
+        selected_scores = np.empty((num_queries, 0), dtype=np.float32)
+        selected_positions = np.empty((num_queries, 0), dtype=np.int64)
+        offset = 0
+        for matrix in self.matrices:
+            for start in range(0, len(matrix), self.block_size):
+                block = np.asarray(matrix[start:start + self.block_size], dtype=np.float32)
+                block_positions = np.arange(offset + start, offset + start + len(block))
+                scores = np.concatenate([selected_scores, query_embeddings @ block.T], axis=1)
+                positions = np.concatenate([selected_positions,
+                                            np.broadcast_to(block_positions, (num_queries, len(block)))], axis=1)
+                selected_scores, selected_positions = self._select_top_k(scores, positions, num_selected)
+            offset += len(matrix)
+        top_scores[:, :num_selected] = selected_scores
+        top_positions[:, :num_selected] = selected_positions
+        return top_scores, top_positions
+
+    @staticmethod
+    def _select_top_k(scores: np.ndarray, positions: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        num_queries, num_candidates = scores.shape
+        if 0 < top_k < num_candidates:
+            # the candidates with at least the k-th largest score of each query, including all ties
+            thresholds = -np.partition(-scores, top_k - 1, axis=1)[:, top_k - 1:top_k]
+            rows, columns = np.nonzero(scores >= thresholds)
+        else:
+            rows, columns = np.divmod(np.arange(num_queries * num_candidates), num_candidates)
+        candidate_scores, candidate_positions = scores[rows, columns], positions[rows, columns]
+
+        # missing embeddings have the largest positions, so that they follow the embeddings with the same score
+        keys = np.where(candidate_positions < 0, np.iinfo(np.int64).max, candidate_positions)
+        order = np.lexsort((keys, -candidate_scores, rows))
+        rows, candidate_scores, candidate_positions = rows[order], candidate_scores[order], candidate_positions[order]
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        selected = ranks < top_k
+
+        top_scores = np.full((num_queries, top_k), -np.inf, dtype=np.float32)
+        top_positions = np.full((num_queries, top_k), -1, dtype=np.int64)
+        top_scores[rows[selected], ranks[selected]] = candidate_scores[selected]
+        top_positions[rows[selected], ranks[selected]] = candidate_positions[selected]
+        return top_scores, top_positions
+
+    def save(self, path: str):
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+        embedding_dim = self.matrices[0].shape[1] if self.matrices else 0
+
+        # the files are replaced atomically, so that processes that memory-map them keep reading the old files
+        temporary_path = directory / 'tmp-{}-{}'.format(os.getpid(), EMBEDDINGS_FILENAME)
+        embeddings = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=self.dtype,
+                                               shape=(len(self), embedding_dim))
+        offset = 0
+        for matrix in self.matrices:
+            for start in range(0, len(matrix), self.block_size):
+                block = matrix[start:start + self.block_size]
+                embeddings[offset:offset + len(block)] = block
+                offset += len(block)
+        embeddings.flush()
+        del embeddings
+        os.replace(temporary_path, directory / EMBEDDINGS_FILENAME)
+
+        temporary_path = directory / 'tmp-{}-{}'.format(os.getpid(), METADATA_FILENAME)
+        temporary_path.write_text(json.dumps({'dtype': self.dtype, 'block_size': self.block_size}))
+        os.replace(temporary_path, directory / METADATA_FILENAME)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, shard_directory: Optional[str] = None) -> 'NumpyVectorDB':
+        """Load a database saved with :meth:`save`.
+
+        Args:
+            path (str): The directory of the saved database.
+            mmap (bool): Whether the embeddings are memory-mapped from the directory rather than read into memory.
+            shard_directory (Optional[str]): Parent directory of the matrices of the embeddings that are added
+                or rewritten after loading.
+
+        Returns:
+            NumpyVectorDB: The loaded database.
+        """
+        directory = Path(path)
+        metadata = json.loads((directory / METADATA_FILENAME).read_text())
+        vector_db = cls(shard_directory=shard_directory, **metadata)
+        embeddings = np.load(directory / EMBEDDINGS_FILENAME, mmap_mode='r' if mmap else None)
+        if len(embeddings) > 0:
+            vector_db.matrices.append(embeddings)
+        return vector_db
@@ -13,16 +13,20 @@ normalized_discounted_cumulative_gain(IRSystemBase, OrderedDict, Set[JudgementBa
 bpref(IRSystemBase, OrderedDict, Set[JudgementBase], int, int) -> float:
     Calculate mean bpref score of a system.
 """
-from .entities import JudgementBase, QueryBase
+from .entities import DocumentBase, JudgementBase, QueryBase
 from .irsystem import IRSystemBase
 
-from typing import Set, OrderedDict
-from multiprocessing import Pool, get_context
+from typing import Callable, Iterable, List, Optional, Set, OrderedDict
+from multiprocessing import cpu_count, get_context
 from functools import partial
-from math import log2
+from math import ceil, log2
 import abc
 
 
+# number of queries passed to IRSystemBase.search_batch at once, bounds the memory used by batched systems
+QUERY_BATCH_SIZE = 32
+
+
 def _judgements_obj_to_id(old_judgements: Set[JudgementBase]) -> Set:
     new_judgements = set()
     for q, d in old_judgements:
@@ -31,13 +35,69 @@ def _judgements_obj_to_id(old_judgements: Set[JudgementBase]) -> Set:
     return new_judgements
 
 
-def _calc_recall(system: IRSystemBase, judgements: Set, k: int,
-                 query: QueryBase) -> float:
+def _query_batches(queries: OrderedDict, num_processes: Optional[int]) -> List[List[QueryBase]]:
+    queries = list(queries.values())
+    # give every process at least one batch
+    num_processes = num_processes or cpu_count()
+    batch_size = max(1, min(QUERY_BATCH_SIZE, ceil(len(queries) / num_processes)))
+    return [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+
+def _defining_class(system: IRSystemBase, name: str) -> Optional[type]:
+    for cls in type(system).__mro__:
+        if name in vars(cls):
+            return cls
+    return None
+
+
+def _uses_search_batch(system: IRSystemBase) -> bool:
+    # a subclass that overrides only search must not be evaluated through the search_batch of its parent
+    search_batch_class = _defining_class(system, 'search_batch')
+    search_class = _defining_class(system, 'search')
+    return search_batch_class is not None and issubclass(search_batch_class, search_class)
+
+
+def _search_batch(system: IRSystemBase, queries: List[QueryBase],
+                  k: Optional[int]) -> Iterable[Iterable[DocumentBase]]:
+    if _uses_search_batch(system):
+        return system.search_batch(queries, k)
+    return [system.search(query) for query in queries]
+
+
+def _calc_batch(calc: Callable[[Set, int, QueryBase, Iterable[DocumentBase]], float],
+                system: IRSystemBase, judgements: Set, k: int, depth: Optional[int],
+                queries: List[QueryBase]) -> float:
+    score = 0.0
+    for query, documents in zip(queries, _search_batch(system, queries, depth)):
+        score += calc(judgements, k, query, documents)
+    return score
+
+
+def _evaluate(calc: Callable[[Set, int, QueryBase, Iterable[DocumentBase]], float],
+              system: IRSystemBase, queries: OrderedDict, judgements: Set[JudgementBase],
+              k: int, depth: Optional[int], num_processes: int) -> float:
+    query_batches = _query_batches(queries, num_processes)
+    worker = partial(_calc_batch, calc, system, _judgements_obj_to_id(judgements), k, depth)
+
+    score = 0.0
+    if num_processes == 1:
+        for query_batch in query_batches:
+            score += worker(query_batch)
+    else:
+        with get_context("fork").Pool(processes=num_processes) as process_pool:
+            for batch_score in process_pool.imap(worker, query_batches):
+                score += batch_score
+
+    return score
+
+
+def _calc_recall(judgements: Set, k: int, query: QueryBase,
+                 documents: Iterable[DocumentBase]) -> float:
     num_relevant = 0
     num_relevant_topk = 0
     current_rank = 1
 
-    for document in system.search(query):
+    for document in documents:
         if (query.query_id, document.document_id) in judgements:
             num_relevant += 1
             if current_rank <= k:
@@ -52,13 +112,13 @@ def _calc_recall(system: IRSystemBase, judgements: Set, k: int,
     return recall
 
 
-def _calc_precision(system: IRSystemBase, judgements: Set, k: int,
-                    query: QueryBase) -> float:
+def _calc_precision(judgements: Set, k: int, query: QueryBase,
+                    documents: Iterable[DocumentBase]) -> float:
     num_relevant = 0
     precision = 0.0
     current_rank = 1
 
-    for document in system.search(query):
+    for document in documents:
         if current_rank > k:
             break
         if (query.query_id, document.document_id) in judgements:
@@ -70,13 +130,13 @@ def _calc_precision(system: IRSystemBase, judgements: Set, k: int,
     return precision
 
 
-def _calc_average_precision(system: IRSystemBase, judgements: Set, k: int,
-                            query: QueryBase) -> float:
+def _calc_average_precision(judgements: Set, k: int, query: QueryBase,
+                            documents: Iterable[DocumentBase]) -> float:
     num_relevant = 0
     average_precision = 0.0
     current_rank = 1
 
-    for document in system.search(query):
+    for document in documents:
         if current_rank > k:
             break
         if (query.query_id, document.document_id) in judgements:
@@ -96,22 +156,10 @@ class calc_map(abc.ABC):
     _CURRENT_INSTANCE = None
 
     @classmethod
-    def _calc_average_precision(csl, query: QueryBase) -> float:
-        num_relevant = 0
-        average_precision = 0.0
-        current_rank = 1
-
-        for document in csl._CURRENT_INSTANCE.system.search(query):
-            if current_rank > csl._CURRENT_INSTANCE.k:
-                break
-            if (query.query_id, document.document_id) in csl._CURRENT_INSTANCE.judgements:
-                num_relevant += 1
-                average_precision += num_relevant / current_rank
-            current_rank += 1
-
-        average_precision /= num_relevant if num_relevant > 0 else 1
-
-        return average_precision
+    def _calc_average_precisions(csl, queries: List[QueryBase]) -> float:
+        instance = csl._CURRENT_INSTANCE
+        return _calc_batch(_calc_average_precision, instance.system, instance.judgements,
+                           instance.k, instance.k, queries)
 
     def mean_average_precision(self, system: IRSystemBase, queries: OrderedDict,
                                judgements: Set[JudgementBase],
@@ -144,12 +192,14 @@ class calc_map(abc.ABC):
         self.k = k
         self.__class__._CURRENT_INSTANCE = self
 
+        query_batches = _query_batches(queries, num_processes)
+
         if num_processes == 1:
-            for query in list(queries.values()):
-                map_score += self.__class__._calc_average_precision(query)
+            for query_batch in query_batches:
+                map_score += self.__class__._calc_average_precisions(query_batch)
         else:
             with get_context("fork").Pool(processes=num_processes) as process_pool:
-                for precision in process_pool.imap(self.__class__._calc_average_precision, list(queries.values())):
+                for precision in process_pool.imap(self.__class__._calc_average_precisions, query_batches):
                     map_score += precision
 
         map_score /= len(queries)
@@ -157,13 +207,13 @@ class calc_map(abc.ABC):
         return map_score
 
 
-def _calc_ndcg(system: IRSystemBase, judgements: Set, k: int,
-               query: QueryBase) -> float:
+def _calc_ndcg(judgements: Set, k: int, query: QueryBase,
+               documents: Iterable[DocumentBase]) -> float:
     num_relevant = 0
     dcg = 0.0
     current_rank = 1
 
-    for document in system.search(query):
+    for document in documents:
         if current_rank > k:
             break
         if (query.query_id, document.document_id) in judgements:
@@ -177,14 +227,14 @@ def _calc_ndcg(system: IRSystemBase, judgements: Set, k: int,
     return dcg / idcg
 
 
-def _calc_bpref(system: IRSystemBase, judgements: Set, k: int,
-                query: QueryBase) -> float:
+def _calc_bpref(judgements: Set, k: int, query: QueryBase,
+                documents: Iterable[DocumentBase]) -> float:
     num_relevant = 0
     relevant_doc_ranks = []
     current_rank = 1
     bpref = 0.0
 
-    for document in system.search(query):
+    for document in documents:
         if current_rank > k:
             break
         if (query.query_id, document.document_id) in judgements:
@@ -222,18 +272,7 @@ def mean_average_precision(system: IRSystemBase, queries: OrderedDict,
     float
         Mean average precision score from interval [0, 1].
     """
-    map_score = 0.0
-
-    if num_processes == 1:
-        for query in list(queries.values()):
-            map_score += _calc_average_precision(system, _judgements_obj_to_id(judgements), k, query)
-    else:
-        worker_avg_precision = partial(_calc_average_precision, system,
-                                       _judgements_obj_to_id(judgements), k)
-
-        with get_context("fork").Pool(processes=num_processes) as process_pool:
-            for precision in process_pool.imap(worker_avg_precision, list(queries.values())):
-                map_score += precision
+    map_score = _evaluate(_calc_average_precision, system, queries, judgements, k, k, num_processes)
 
     map_score /= len(queries)
 
@@ -263,18 +302,7 @@ def mean_precision(system: IRSystemBase, queries: OrderedDict,
     float
         Mean precision score from interval [0, 1].
     """
-    mp_score = 0
-
-    if num_processes == 1:
-        for query in list(queries.values()):
-            mp_score += _calc_precision(system, _judgements_obj_to_id(judgements), k, query)
-    else:
-        worker_precision = partial(_calc_precision, system,
-                                   _judgements_obj_to_id(judgements), k)
-
-        with Pool(processes=num_processes) as process_pool:
-            for precision in process_pool.imap(worker_precision, list(queries.values())):
-                mp_score += precision
+    mp_score = _evaluate(_calc_precision, system, queries, judgements, k, k, num_processes)
 
     return mp_score / len(queries)
 
@@ -302,17 +330,8 @@ def mean_recall(system: IRSystemBase, queries: OrderedDict,
     float
         Mean recall score from interval [0, 1].
     """
-    mr_score = 0
-    if num_processes == 1:
-        for query in list(queries.values()):
-            mr_score += _calc_recall(system, _judgements_obj_to_id(judgements), k, query)
-    else:
-        worker_recall = partial(_calc_recall, system,
-                                _judgements_obj_to_id(judgements), k)
-
-        with Pool(processes=num_processes) as process_pool:
-            for recall in process_pool.imap(worker_recall, list(queries.values())):
-                mr_score += recall
+    # recall counts the relevant documents in the whole ranking, not just in the top k
+    mr_score = _evaluate(_calc_recall, system, queries, judgements, k, None, num_processes)
 
     return mr_score / len(queries)
 
@@ -342,18 +361,7 @@ def normalized_discounted_cumulative_gain(system: IRSystemBase,
     float
         Normalized discounted cumulative gain score from interval [0, 1].
     """
-    ndcg_score = 0
-
-    if num_processes == 1:
-        for query in list(queries.values()):
-            ndcg_score += _calc_ndcg(system, _judgements_obj_to_id(judgements), k, query)
-    else:
-        worker_ndcg = partial(_calc_ndcg, system,
-                              _judgements_obj_to_id(judgements), k)
-
-        with Pool(processes=num_processes) as process_pool:
-            for dcg in process_pool.imap(worker_ndcg, list(queries.values())):
-                ndcg_score += dcg
+    ndcg_score = _evaluate(_calc_ndcg, system, queries, judgements, k, k, num_processes)
 
     return ndcg_score / len(queries)
 
@@ -390,16 +398,6 @@ def mean_bpref(system: IRSystemBase, queries: OrderedDict,
     float
         Bpref score from interval [0, 1].
     """
-    bpref_score = 0
-    if num_processes == 1:
-        for query in list(queries.values()):
-            bpref_score += _calc_bpref(system, _judgements_obj_to_id(judgements), k, query)
-    else:
-        worker_bpref = partial(_calc_bpref, system,
-                               _judgements_obj_to_id(judgements), k)
-
-        with Pool(processes=num_processes) as process_pool:
-            for bpref in process_pool.imap(worker_bpref, list(queries.values())):
-                bpref_score += bpref
+    bpref_score = _evaluate(_calc_bpref, system, queries, judgements, k, k, num_processes)
 
     return bpref_score / len(queries)
@@ -1,7 +1,8 @@
 import abc
-from typing import Iterable
+from itertools import islice
+from typing import Iterable, List, Optional
 
-from .entities import DocumentBase
+from .entities import DocumentBase, QueryBase
 
 
 class IRSystemBase(abc.ABC):
@@ -11,3 +12,25 @@ class IRSystemBase(abc.ABC):
     @abc.abstractmethod
     def search(self, query) -> Iterable[DocumentBase]:
         pass
+
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """The ranked retrieval results for several queries.
+
+        The default implementation searches the queries one at a time. Systems that can share work
+        between queries, such as encoding the queries in a single batch, override this method.
+
+        Parameters
+        ----------
+        queries : iterable of QueryBase
+            Queries.
+        k : int or None, optional
+            The number of top documents retrieved for each query. If None, all documents are retrieved.
+            Default is None.
+
+        Returns
+        -------
+        list of iterable of DocumentBase
+            The ranked retrieval results for each query in the order of the queries.
+
+        """
+        return [islice(self.search(query), k) for query in queries]
@@ -0,0 +1,2 @@
+from .compression import CompressedEmbeddings, EmbeddingCompressor  # noqa
+from .shards import ShardStore  # noqa
@@ -0,0 +1,319 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+EMBEDDING_COMPRESSIONS = ('float16', 'int8', 'pca')
+
+# number of compressed embeddings decompressed at once when they are scored
+SCORING_BLOCK_SIZE = 65536
+
+# default number of top documents of each query whose scores are recomputed from the float32 embeddings
+RESCORING_DEPTH = 100
+
+
+class EmbeddingCompressor:
+    """
+    Compresses float32 embeddings to smaller codes whose dot products with queries approximate the dot products
+    of the embeddings.
+
+    With the 'float16' compression, the embeddings are stored in half precision. With the 'int8' compression,
+    each dimension is quantized to 256 levels between its minimum and maximum in the fitted embeddings. With
+    the 'pca' compression, the embeddings are projected to their principal components. The projection drops
+    the variance of the other components, so the 'pca' scores are much coarser than the scores of the other
+    compressions and should be rescored with the float32 embeddings, see :class:`CompressedEmbeddings`.
+
+    Parameters
+    ----------
+    compression: str
+        Compression: 'float16', 'int8', or 'pca'.
+    num_components: int or None
+        The number of principal components of the 'pca' compression. If None, a quarter of the dimensions
+        of the fitted embeddings is used.
+
+    Attributes
+    ----------
+    compression: str
+        Compression: 'float16', 'int8', or 'pca'.
+    num_components: int or None
+        The number of principal components of the 'pca' compression.
+    offset: np.ndarray or None
+        The minimum of each dimension of the 'int8' compression, or the mean of the 'pca' compression.
+    scale: np.ndarray or None
+        The difference of the consecutive levels of each dimension of the 'int8' compression.
+    components: np.ndarray or None
+        The principal components of the 'pca' compression in rows.
+
+    """
+
+    def __init__(self, compression: str, num_components: Optional[int] = None):
+        if compression not in EMBEDDING_COMPRESSIONS:
+            raise ValueError('Unknown compression {}, expected one of {}'.format(compression, EMBEDDING_COMPRESSIONS))
+        self.compression = compression
+        self.num_components = num_components
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        """Whether the compressor can compress embeddings."""
+        return self.compression == 'float16' or self.offset is not None
+
+    def fit(self, embeddings: np.ndarray) -> 'EmbeddingCompressor':
+        """Fit the levels of the 'int8' compression or the principal components of the 'pca' compression.
+
+        Parameters
+        ----------
+        embeddings: np.ndarray
+            Embeddings in rows.
+
+        Returns
+        -------
+        EmbeddingCompressor
+            The fitted compressor.
+
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.compression == 'float16':
+            return self
+        if len(embeddings) == 0:
+            raise ValueError('Fitting the {} compression requires embeddings'.format(self.compression))
+
+        if self.compression == 'int8':
+            minimum, maximum = embeddings.min(axis=0), embeddings.max(axis=0)
+            self.offset = minimum
+            self.scale = np.maximum(maximum - minimum, np.finfo(np.float32).tiny) / 255
+        else:
+            num_components = embeddings.shape[1] // 4 if self.num_components is None else self.num_components
+            num_components = max(1, min(num_components, embeddings.shape[1]))
+            mean = embeddings.mean(axis=0, dtype=np.float64)
+            covariance = np.zeros((embeddings.shape[1], embeddings.shape[1]))
+            for start in range(0, len(embeddings), SCORING_BLOCK_SIZE):
+                block = embeddings[start:start + SCORING_BLOCK_SIZE] - mean
+                covariance += block.T @ block
+            _, eigenvectors = np.linalg.eigh(covariance)
+            self.offset = mean.astype(np.float32)
+            self.components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :num_components].T, dtype=np.float32)
+            self.num_components = num_components
+        return self
+
+    def compress(self, embeddings: np.ndarray) -> np.ndarray:
+        """Compress embeddings.
+
+        Parameters
+        ----------
+        embeddings: np.ndarray
+            Embeddings in rows.
+
+        Returns
+        -------
+        np.ndarray
+            The codes of the embeddings in rows.
+
+        """
+        if not self.is_fitted:
+            raise ValueError('The {} compression has not been fitted'.format(self.compression))
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.compression == 'float16':
+            return embeddings.astype(np.float16)
+        if self.compression == 'int8':
+            levels = np.rint((embeddings - self.offset) / self.scale)
+            return np.clip(levels, 0, 255).astype(np.uint8)
+        return np.ascontiguousarray((embeddings - self.offset) @ self.components.T, dtype=np.float32)
+
+    def get_scores(self, codes: np.ndarray, query_embeddings: np.ndarray) -> np.ndarray:
+        """The approximate dot products of queries and compressed embeddings.
+
+        The codes are decompressed block by block, so that the memory used does not grow with the number
+        of embeddings beyond the memory of the scores.
+
+        Parameters
+        ----------
+        codes: np.ndarray
+            The codes of embeddings in rows.
+        query_embeddings: np.ndarray
+            A query embedding, or query embeddings in rows.
+
+        Returns
+        -------
+        np.ndarray
+            The dot product of the query and each embedding, or a matrix with the dot product of each query
+            and each embedding.
+
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        queries = query_embeddings.reshape(-1, query_embeddings.shape[-1])
+
+        # the offsets of the 'int8' and 'pca' compressions add the same constant to all scores of a query
+        if self.compression == 'float16':
+            projected_queries, constants = queries, None
+        elif self.compression == 'int8':
+            projected_queries, constants = queries * self.scale, queries @ self.offset
+        else:
+            projected_queries, constants = queries @ self.components.T, queries @ self.offset
+
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORING_BLOCK_SIZE):
+            block = codes[start:start + SCORING_BLOCK_SIZE].astype(np.float32)
+            scores[:, start:start + len(block)] = projected_queries @ block.T
+        if constants is not None:
+            scores += constants[:, np.newaxis]
+        return scores.reshape(query_embeddings.shape[:-1] + (len(codes),))
+
+
+class CompressedEmbeddings:
+    """
+    Compressed embeddings, optionally with the float32 embeddings that rescore the top documents of queries.
+
+    Parameters
+    ----------
+    compressor: EmbeddingCompressor
+        A fitted compressor.
+    codes: np.ndarray
+        The codes of the embeddings in rows.
+    embeddings: np.ndarray or None
+        The float32 embeddings in rows, such as a read-only memory-mapped array produced by
+        :meth:`ShardStore.store_array`. If None, the scores are not rescored.
+
+    Attributes
+    ----------
+    compressor: EmbeddingCompressor
+        The compressor.
+    codes: np.ndarray
+        The codes of the embeddings in rows.
+    embeddings: np.ndarray or None
+        The float32 embeddings in rows.
+
+    """
+
+    def __init__(self, compressor: EmbeddingCompressor, codes: np.ndarray, embeddings: Optional[np.ndarray] = None):
+        self.compressor = compressor
+        self.codes = codes
+        self.embeddings = embeddings
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def select(self, mask: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """The codes and the float32 embeddings of the rows selected by a boolean mask."""
+        return self.codes[mask], None if self.embeddings is None else np.asarray(self.embeddings[mask])
+
+    def get_scores(self, query_embeddings: np.ndarray, rescoring_depth: int = RESCORING_DEPTH
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+        """The dot products of queries and the embeddings, exact for the top documents of each query.
+
+        The approximate dot products of the compressed embeddings select the top documents of each query,
+        whose dot products are recomputed from the float32 embeddings.
+
+        Parameters
+        ----------
+        query_embeddings: np.ndarray
+            A query embedding, or query embeddings in rows.
+        rescoring_depth: int
+            The number of top documents of each query that are rescored.
+
+        Returns
+        -------
+        tuple of (np.ndarray, np.ndarray)
+            The dot products of the queries and the embeddings in the shape of :meth:`EmbeddingCompressor.get_scores`,
+            and a boolean array of the same shape that marks the rescored top documents of each query.
+
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        queries = query_embeddings.reshape(-1, query_embeddings.shape[-1])
+        scores = self.compressor.get_scores(self.codes, queries)
+        rescored = np.zeros(scores.shape, dtype=bool)
+        depth = min(rescoring_depth, len(self))
+        if self.embeddings is not None and depth > 0:
+            top_positions = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+            np.put_along_axis(rescored, top_positions, True, axis=1)
+            positions = np.unique(top_positions)
+            scores[:, positions] = queries @ np.asarray(self.embeddings[positions]).T
+        shape = query_embeddings.shape[:-1] + (len(self),)
+        return scores.reshape(shape), rescored.reshape(shape)
+
+
+def rank_rescored_first(scores: np.ndarray, rescored: np.ndarray) -> np.ndarray:
+    """Lower the approximate scores below the rescored scores of each query.
+
+    The rescored top documents of each query then precede the other documents in the ranking, so that the
+    errors of the approximate scores cannot push documents with approximate scores above the top documents.
+
+    Parameters
+    ----------
+    scores: np.ndarray
+        The scores of the documents for a query, or a matrix with the score of each query and each document.
+    rescored: np.ndarray
+        A boolean array of the same shape that marks the rescored scores.
+
+    Returns
+    -------
+    np.ndarray
+        The scores, with the approximate scores of each query lowered below its lowest rescored score.
+
+    """
+    if not rescored.any():
+        return scores
+    lowest_rescored_scores = np.where(rescored, scores, np.inf).min(axis=-1, keepdims=True)
+    ceilings = np.nextafter(lowest_rescored_scores, -np.inf)
+    return np.where(rescored, scores, np.minimum(scores, ceilings))
+
+
+def get_compression_report(embeddings: np.ndarray, query_embeddings: np.ndarray, k: int = 10,
+                           compressions: Sequence[Union[str, Tuple[str, int]]] = ('float16', 'int8', 'pca'),
+                           rescoring_depth: int = RESCORING_DEPTH) -> List[Dict[str, Union[str, float]]]:
+    """The memory and the retrieval quality of compressed embeddings compared to float32 embeddings.
+
+    The quality is the recall of the top k documents of the float32 embeddings among the top k documents of
+    the compressed embeddings, both without rescoring and with the top documents rescored by the float32
+    embeddings.
+
+    Parameters
+    ----------
+    embeddings: np.ndarray
+        Unit-length document embeddings in rows.
+    query_embeddings: np.ndarray
+        Unit-length query embeddings in rows.
+    k: int
+        The number of top documents of each query.
+    compressions: sequence of str or (str, int)
+        The compressions, optionally with their numbers of principal components.
+    rescoring_depth: int
+        The number of top documents of each query that are rescored.
+
+    Returns
+    -------
+    list of dict
+        For each compression, its name, the number of bytes of an embedding, the fraction of the memory of
+        the float32 embeddings, and the recalls without and with rescoring.
+
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    k = min(k, len(embeddings))
+
+    def get_top_k(scores: np.ndarray) -> np.ndarray:
+        return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    def get_recall(top_k: np.ndarray) -> float:
+        return float(np.mean([len(np.intersect1d(expected, actual)) / k
+                              for expected, actual in zip(exact_top_k, top_k)]))
+
+    exact_top_k = get_top_k(query_embeddings @ embeddings.T)
+    report = [{'compression': 'float32', 'bytes_per_embedding': embeddings[:1].nbytes, 'memory': 1.0,
+               'recall': 1.0, 'rescored_recall': 1.0}]
+    for compression in compressions:
+        compression, num_components = (compression, None) if isinstance(compression, str) else compression
+        compressor = EmbeddingCompressor(compression, num_components).fit(embeddings)
+        compressed_embeddings = CompressedEmbeddings(compressor, compressor.compress(embeddings), embeddings)
+        scores, rescored = compressed_embeddings.get_scores(query_embeddings, rescoring_depth)
+        name = compression if compression != 'pca' else 'pca{}'.format(compressor.num_components)
+        report.append({
+            'compression': name,
+            'bytes_per_embedding': compressed_embeddings.codes[:1].nbytes,
+            'memory': compressed_embeddings.codes.nbytes / embeddings.nbytes,
+            'recall': get_recall(get_top_k(compressor.get_scores(compressed_embeddings.codes, query_embeddings))),
+            'rescored_recall': get_recall(get_top_k(rank_rescored_first(scores, rescored))),
+        })
+    return report
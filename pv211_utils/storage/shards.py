@@ -0,0 +1,86 @@
+import shutil
+import weakref
+from itertools import count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+# number of documents in a shard of a sharded index
+SHARD_SIZE = 100000
+
+
+class ShardStore:
+    """
+    A directory of memory-mapped matrices that keeps the shards of an index on disk.
+
+    The stored matrices are read through the page cache of the operating system, so only the posting lists
+    of the query terms need to be in memory during a search and the memory used by an index stays bounded
+    regardless of the number of documents. The files of a stored matrix are deleted once the matrix is
+    garbage-collected, and the directory is deleted with the store.
+
+    Parameters
+    ----------
+    directory: str, Path, or None
+        The parent directory of the store. If None, the default temporary directory is used.
+
+    Attributes
+    ----------
+    directory: Path
+        The directory of the store.
+
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None):
+        self._temporary_directory = TemporaryDirectory(dir=directory, prefix='pv211-shards-')
+        self._shard_numbers = count()
+        self.directory = Path(self._temporary_directory.name)
+
+    def store_matrix(self, matrix: csr_matrix) -> csr_matrix:
+        """Move a sparse matrix with sorted indices to disk.
+
+        Parameters
+        ----------
+        matrix: csr_matrix
+            A sparse matrix with sorted indices.
+
+        Returns
+        -------
+        csr_matrix
+            A read-only sparse matrix backed by memory-mapped files.
+
+        """
+        shard_directory = self.directory / 'shard-{}'.format(next(self._shard_numbers))
+        shard_directory.mkdir()
+        arrays = {}
+        for name in ('data', 'indices', 'indptr'):
+            np.save(shard_directory / '{}.npy'.format(name), getattr(matrix, name))
+            arrays[name] = np.load(shard_directory / '{}.npy'.format(name), mmap_mode='r')
+        stored_matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=matrix.shape)
+        stored_matrix.has_sorted_indices = True
+        weakref.finalize(stored_matrix, shutil.rmtree, shard_directory, ignore_errors=True)
+        return stored_matrix
+
+    def store_array(self, array: np.ndarray) -> np.ndarray:
+        """Move a dense array to disk.
+
+        Parameters
+        ----------
+        array: np.ndarray
+            A dense array, such as a matrix of embeddings.
+
+        Returns
+        -------
+        np.ndarray
+            A read-only array backed by a memory-mapped file.
+
+        """
+        shard_directory = self.directory / 'shard-{}'.format(next(self._shard_numbers))
+        shard_directory.mkdir()
+        np.save(shard_directory / 'array.npy', np.ascontiguousarray(array))
+        stored_array = np.load(shard_directory / 'array.npy', mmap_mode='r')
+        weakref.finalize(stored_array, shutil.rmtree, shard_directory, ignore_errors=True)
+        return stored_array
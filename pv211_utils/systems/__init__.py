@@ -4,3 +4,7 @@ from .reranker import RerankerSystem  # noqa
 from .retriever import RetrieverSystem  # noqa
 from .tfidf import TfidfSystem  # noqa
 from .ranker import RankerSystem  # noqa
+from .embeddings import EmbeddingStore, QueryEmbeddingCache  # noqa
+from .reranking import PretokenizedCrossEncoder, RerankScheduler, ScoreCache  # noqa
+from ..storage.compression import CompressedEmbeddings, EmbeddingCompressor, get_compression_report  # noqa
+from .quantization import quantize_model  # noqa
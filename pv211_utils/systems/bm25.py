@@ -1,10 +1,19 @@
-from typing import Iterable, OrderedDict
+from copy import copy
+from typing import Dict, Iterable, List, Optional, OrderedDict, Union
 
-from rank_bm25 import BM25Plus
+from rank_bm25 import BM25L, BM25Okapi, BM25Plus
 
 from ..entities import DocumentBase, QueryBase
 from ..irsystem import IRSystemBase
 from ..preprocessing import DocPreprocessingBase
+from .bm25_index import BM25_VARIANTS, SegmentedBM25Index
+from .index_builder import build_inverted_index
+from .inverted_index import InvertedIndex
+from .ranking import rank_documents, rank_lazily
+from .segments import SegmentedCorpus
+
+
+BM25_ENGINES = ('rank_bm25', 'native')
 
 
 class BM25PlusSystem(IRSystemBase):
@@ -23,39 +32,189 @@ class BM25PlusSystem(IRSystemBase):
         length are more amplified.
     d: float
         BM25 d parameter. Delta parameter for BM25+.
+    variant: str
+        BM25 variant: 'plus' for BM25+ (default), 'okapi' for BM25, or 'l' for BM25L.
+    engine: str
+        Ranking engine: 'rank_bm25' (default) scores every document with the rank_bm25 library,
+        'native' scores only the posting lists of the query terms in a precomputed sparse impact matrix.
+        Both engines produce identical scores.
+    k: int or None
+        If not None, only the top k documents are retrieved for each query with dynamic pruning, which
+        uses upper bounds of the term impacts to skip documents that cannot enter the top k. The top k
+        documents are identical to the top k of the exhaustive ranking. Requires the native engine.
+
+    Tuning k1, b, and d does not require indexing the documents again. Use :meth:`with_parameters` to get
+    a system with different parameters that shares the indexed documents with this system.
+
+    With the native engine, documents can be added and removed with :meth:`add_documents` and
+    :meth:`remove_documents` without indexing the other documents again.
 
     Attributes
     ----------
-    bm25: BM25PlusCore
+    bm25: BM25Okapi, BM25L, BM25Plus, or SegmentedBM25Index
         Ranking model
+    corpus: SegmentedCorpus or None
+        The indexed documents of the native engine.
     index: dict of (int, Document)
-        A mapping from indexed document numbers to documents.
+        A mapping from indexed document numbers to documents of the rank_bm25 engine.
 
     """
 
     def __init__(self, documents: OrderedDict[str, DocumentBase], preprocessing: DocPreprocessingBase,
-                 k1: float = 1.25, b: float = 0.75, d: float = 1):
+                 k1: float = 1.25, b: float = 0.75, d: float = 1, variant: str = 'plus', engine: str = 'rank_bm25',
+                 k: Optional[int] = None):
+        if variant not in BM25_VARIANTS:
+            raise ValueError('Unknown BM25 variant {}, expected one of {}'.format(variant, BM25_VARIANTS))
+        if engine not in BM25_ENGINES:
+            raise ValueError('Unknown BM25 engine {}, expected one of {}'.format(engine, BM25_ENGINES))
+        if k is not None and engine != 'native':
+            raise ValueError('Dynamic pruning of the top k documents requires the native engine')
+
         self.preprocessing = preprocessing
+        self.variant = variant
+        self.k = k
+        self.vocabulary: Dict[str, int] = {}
+        self.corpus: Optional[SegmentedCorpus[InvertedIndex]] = None
+
+        if engine == 'native':
+            self.corpus = SegmentedCorpus(documents, self._build_inverted_index, InvertedIndex.merge)
+            self._bm25 = SegmentedBM25Index(self.corpus.snapshot, variant, k1=k1, b=b, d=d)
+        else:
+            docs_values = documents.values()
 
-        docs_values = documents.values()
+            corpus = [self.preprocessing(str(document)) for document in docs_values]
+
+            if variant == 'okapi':
+                self._bm25 = BM25Okapi(corpus, k1=k1, b=b)
+            elif variant == 'l':
+                self._bm25 = BM25L(corpus, k1=k1, b=b, delta=d)
+            else:
+                self._bm25 = BM25Plus(corpus, k1=k1, b=b, delta=d)
+            self.index = dict(enumerate(docs_values))
+
+    def _build_inverted_index(self, documents: List[DocumentBase]) -> InvertedIndex:
+        return build_inverted_index(documents, self.preprocessing, self.vocabulary)
+
+    @property
+    def bm25(self) -> Union[BM25Okapi, BM25L, BM25Plus, SegmentedBM25Index]:
+        """Ranking model. The model of the native engine follows the documents added and removed from the corpus."""
+        if self.corpus is not None and self._bm25.snapshot is not self.corpus.snapshot:
+            self._bm25 = self._bm25.with_snapshot(self.corpus.snapshot)
+        return self._bm25
+
+    def add_documents(self, documents: OrderedDict[str, DocumentBase]):
+        """
+        Index new documents without indexing the existing documents again.
 
-        corpus = [self.preprocessing(str(document)) for document in docs_values]
+        Documents with the identifiers of indexed documents replace the indexed documents.
+        Requires the native engine.
+
+        Parameters
+        ----------
+        documents: OrderedDict
+            Added documents
+        """
+        self._require_corpus().add(documents)
+
+    def remove_documents(self, document_ids: Iterable[str]):
+        """
+        Remove indexed documents. Requires the native engine.
+
+        Parameters
+        ----------
+        document_ids: iterable of str
+            Identifiers of removed documents
+        """
+        self._require_corpus().remove(document_ids)
 
-        self.bm25 = BM25Plus(corpus, k1=k1, b=b, delta=d)
-        self.index = dict(enumerate(docs_values))
+    def _require_corpus(self) -> SegmentedCorpus[InvertedIndex]:
+        if self.corpus is None:
+            raise ValueError('Adding and removing documents requires the native engine')
+        return self.corpus
+
+    def with_parameters(self, k1: Optional[float] = None, b: Optional[float] = None, d: Optional[float] = None,
+                        variant: Optional[str] = None) -> 'BM25PlusSystem':
+        """
+        Create a system with different BM25 parameters that shares the indexed documents with this system.
+
+        The documents are not preprocessed again. The native engine recomputes its impacts from the stored
+        term frequencies, document lengths and document frequencies in milliseconds, and the rank_bm25 engine
+        only swaps its parameters. A grid search that builds one system and evaluates
+        `system.with_parameters(k1=k1, b=b)` for every grid point therefore costs about a single index build.
+
+        Parameters
+        ----------
+        k1: float or None
+            BM25 k1 parameter. If None, the current k1 is kept.
+        b: float or None
+            BM25 b parameter. If None, the current b is kept.
+        d: float or None
+            BM25 d parameter. If None, the current d is kept.
+        variant: str or None
+            BM25 variant. If None, the current variant is kept. Only the native engine can change the variant.
+        """
+        system = copy(self)
+
+        if self.corpus is not None:
+            system._bm25 = self.bm25.with_parameters(variant, k1=k1, b=b, d=d)
+        elif variant is not None and variant != self.variant:
+            raise ValueError('Changing the BM25 variant requires the native engine')
+        else:
+            # rank_bm25 computes the inverse document frequencies independently of k1, b, and d
+            system._bm25 = copy(self.bm25)
+            system._bm25.k1 = self.bm25.k1 if k1 is None else k1
+            system._bm25.b = self.bm25.b if b is None else b
+            if d is not None and hasattr(self.bm25, 'delta'):
+                system._bm25.delta = d
+
+        system.variant = self.variant if variant is None else variant
+        return system
 
     def search(self, query: QueryBase) -> Iterable[DocumentBase]:
         """
         yield best docs by relevace
 
+        docs with equal scores are yielded in the order in which they were indexed
+
         Parameters
         ----------
         query: QueryBase
         """
         query = self.preprocessing(str(query))
+        bm25 = self.bm25
+        documents = self.index if self.corpus is None else bm25.snapshot.live_documents
 
         # score and rank docs by their relevance
-        docs = self.bm25.get_scores(query).argsort()[::-1]
+        if self.k is not None:
+            docs = bm25.get_top_k(query, self.k)[0].tolist()
+        else:
+            docs = rank_lazily(bm25.get_scores(query))
 
         for doc in docs:
-            yield self.index[doc]
+            yield documents[doc]
+
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """
+        rank docs for several queries at once
+
+        docs with equal scores are ranked in the order in which they were indexed
+
+        Parameters
+        ----------
+        queries: iterable of QueryBase
+        k: int or None
+            number of top docs for each query, all docs if None
+        """
+        queries = [self.preprocessing(str(query)) for query in queries]
+        bm25 = self.bm25
+
+        if self.corpus is None:
+            scores = [bm25.get_scores(query) for query in queries]
+            return [rank_documents(query_scores, self.index, k) for query_scores in scores]
+
+        documents = bm25.snapshot.live_documents
+        if self.k is not None:
+            k = self.k if k is None else min(k, self.k)
+            return [[documents[doc] for doc in bm25.get_top_k(query, k)[0].tolist()] for query in queries]
+
+        return [rank_documents(query_scores, documents, k) for query_scores in bm25.get_batch_scores(queries)]
@@ -0,0 +1,494 @@
+from copy import copy
+from itertools import islice
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .inverted_index import CorpusStatistics, InvertedIndex
+from .ranking import rank_lazily
+from .segments import CorpusSnapshot, SegmentedIndex
+
+
+BM25_VARIANTS = ('okapi', 'l', 'plus')
+
+# default number of consecutive documents that share an upper bound of the impacts in the block-max metadata
+PRUNING_BLOCK_SIZE = 1024
+
+# the cost of looking a candidate document up in a posting list relative to the cost of scoring a posting or
+# ranking a document exhaustively, measured on a Zipfian corpus of 300k documents
+PRUNING_LOOKUP_COST = 8
+
+# the fixed cost of the block bounds, the binary searches and the initial blocks of dynamic pruning in the units
+# of PRUNING_LOOKUP_COST, which makes exhaustive scoring faster on small corpora
+PRUNING_OVERHEAD_COST = 150000
+
+# relative slack of the upper bounds that absorbs rounding errors of the floating-point sums
+UPPER_BOUND_SLACK = 1e-9
+
+
+class BM25Index:
+    """
+    A BM25 ranking model backed by a precomputed term-by-document matrix of impacts in the CSR format.
+
+    The impact of a term in a document is the contribution of the term to the BM25 score of the document.
+    Scoring a query therefore only touches the posting lists of the query terms instead of every document
+    in the corpus. The scores are identical to the scores of the corresponding classes from rank_bm25.
+
+    The impacts are computed from the term frequencies, document lengths and document frequencies stored
+    in the inverted index with a few vectorized operations, so a BM25 index with different parameters
+    can be derived from an existing one with :meth:`with_parameters` without preprocessing the corpus again.
+
+    Parameters
+    ----------
+    inverted_index: InvertedIndex
+        Term frequencies, document lengths and document frequencies of the corpus.
+    variant: str
+        BM25 variant: 'okapi' for BM25, 'l' for BM25L, or 'plus' for BM25+.
+    k1: float
+        BM25 k1 parameter. k1 is a variable which helps determine term frequency saturation characteristics.
+    b: float
+        BM25 b parameter. With bigger b, the effects of the length of the document compared to the average
+        length are more amplified.
+    d: float
+        BM25 d parameter. Delta parameter for BM25L and BM25+.
+    epsilon: float
+        Floor of the inverse document frequencies as a fraction of the average inverse document frequency.
+        Only used by BM25.
+    block_size: int
+        The number of consecutive documents that share an upper bound of the impacts in :meth:`get_top_k`.
+    statistics: CorpusStatistics or None
+        The number of documents, the average document length and the document frequencies used to compute
+        the impacts. If None, the statistics of the inverted index are used. The statistics of a whole
+        segmented corpus make the scores of a segment identical to the scores in an index of the whole corpus.
+
+    Attributes
+    ----------
+    inverted_index: InvertedIndex
+        Term frequencies, document lengths and document frequencies of the corpus.
+    idf: np.ndarray
+        The inverse document frequency of each term.
+    impacts: csr_matrix
+        The term-by-document matrix of impacts.
+    baseline: np.ndarray
+        The contribution of each term to the score of documents that do not contain the term.
+
+    The top k documents of a query can be retrieved with :meth:`get_top_k`, which uses upper bounds of the
+    impacts to skip documents that cannot enter the top k.
+
+    """
+
+    def __init__(self, inverted_index: InvertedIndex, variant: str = 'plus', k1: float = 1.5, b: float = 0.75,
+                 d: float = 1, epsilon: float = 0.25, block_size: int = PRUNING_BLOCK_SIZE,
+                 statistics: Optional[CorpusStatistics] = None):
+        if variant not in BM25_VARIANTS:
+            raise ValueError('Unknown BM25 variant {}, expected one of {}'.format(variant, BM25_VARIANTS))
+
+        self.inverted_index = inverted_index
+        self.variant = variant
+        self.k1, self.b, self.d, self.epsilon = k1, b, d, epsilon
+        self.block_size = block_size
+
+        statistics = CorpusStatistics([inverted_index]) if statistics is None else statistics
+        self.statistics = statistics
+        num_documents = statistics.num_documents
+        document_frequencies = statistics.document_frequencies
+        term_frequencies = inverted_index.get_term_frequencies(len(document_frequencies))
+        length_norms = 1 - b + b * inverted_index.document_lengths / statistics.average_document_length
+
+        # terms whose documents have all been removed from a segmented corpus do not contribute to the scores
+        present = document_frequencies > 0
+        idf = np.zeros(len(document_frequencies))
+        present_document_frequencies = document_frequencies[present]
+        if variant == 'okapi':
+            present_idf = np.log(num_documents - present_document_frequencies + 0.5) - \
+                np.log(present_document_frequencies + 0.5)
+            if len(present_idf) > 0:
+                present_idf[present_idf < 0] = epsilon * present_idf.mean()
+        elif variant == 'l':
+            present_idf = np.log(num_documents + 1) - np.log(present_document_frequencies + 0.5)
+        else:
+            present_idf = np.log((num_documents + 1) / present_document_frequencies)
+        idf[present] = present_idf
+
+        # expand per-term and per-document quantities to the nonzero entries of the matrix
+        tf = term_frequencies.data.astype(np.float64)
+        tf_idf = np.repeat(idf, np.diff(term_frequencies.indptr))
+        tf_length_norms = length_norms[term_frequencies.indices]
+
+        if variant == 'okapi':
+            impacts = tf_idf * tf * (k1 + 1) / (tf + k1 * tf_length_norms)
+            baseline = np.zeros_like(idf)
+        elif variant == 'l':
+            ctd = tf / tf_length_norms
+            impacts = tf_idf * tf * (k1 + 1) * (ctd + d) / (k1 + ctd + d)
+            baseline = np.zeros_like(idf)
+        else:
+            impacts = tf_idf * tf * (k1 + 1) / (k1 * tf_length_norms + tf)
+            baseline = idf * d
+
+        self.idf = idf
+        self.baseline = baseline
+        self.impacts = csr_matrix((impacts, term_frequencies.indices, term_frequencies.indptr),
+                                  shape=term_frequencies.shape)
+        self._block_max_impacts: Optional[csr_matrix] = None
+        self._max_impacts: Optional[np.ndarray] = None
+        self._has_non_positive_impacts = len(impacts) > 0 and impacts.min() <= 0
+
+    def with_parameters(self, variant: Optional[str] = None, k1: Optional[float] = None,
+                        b: Optional[float] = None, d: Optional[float] = None,
+                        epsilon: Optional[float] = None) -> 'BM25Index':
+        """A BM25 index with different parameters that shares the inverted index.
+
+        Parameters
+        ----------
+        variant: str or None
+            BM25 variant. If None, the variant of this index is used.
+        k1: float or None
+            BM25 k1 parameter. If None, k1 of this index is used.
+        b: float or None
+            BM25 b parameter. If None, b of this index is used.
+        d: float or None
+            BM25 d parameter. If None, d of this index is used.
+        epsilon: float or None
+            Floor of the inverse document frequencies for BM25. If None, epsilon of this index is used.
+
+        Returns
+        -------
+        BM25Index
+            The re-parameterized BM25 index.
+
+        """
+        return BM25Index(
+            self.inverted_index,
+            self.variant if variant is None else variant,
+            k1=self.k1 if k1 is None else k1,
+            b=self.b if b is None else b,
+            d=self.d if d is None else d,
+            epsilon=self.epsilon if epsilon is None else epsilon,
+            block_size=self.block_size,
+            statistics=self.statistics,
+        )
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """The BM25 scores of all documents for a query.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+
+        Returns
+        -------
+        np.ndarray
+            The BM25 score of each document.
+
+        """
+        return self._get_scores(*self.inverted_index.query_vector(query, len(self.idf)))
+
+    def _get_scores(self, term_ids: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        scores = self.impacts[term_ids].T.dot(counts)
+        scores += counts.dot(self.baseline[term_ids])
+        return scores
+
+    def get_batch_scores(self, queries: List[List[str]]) -> np.ndarray:
+        """The BM25 scores of all documents for several queries.
+
+        The queries are scored with a single product of a sparse query-by-term matrix and the impacts.
+
+        Parameters
+        ----------
+        queries: list of list of str
+            Tokenized queries.
+
+        Returns
+        -------
+        np.ndarray
+            A matrix with the BM25 score of each document for each query.
+
+        """
+        query_vectors = [self.inverted_index.query_vector(query, len(self.idf)) for query in queries]
+        indptr = np.cumsum([0] + [len(term_ids) for term_ids, _ in query_vectors])
+        indices = np.concatenate([term_ids for term_ids, _ in query_vectors] + [np.zeros(0, dtype=np.int64)])
+        data = np.concatenate([counts for _, counts in query_vectors] + [np.zeros(0)])
+        query_matrix = csr_matrix((data, indices, indptr), shape=(len(queries), len(self.idf)))
+
+        scores = (query_matrix @ self.impacts).toarray()
+        scores += (query_matrix @ self.baseline)[:, np.newaxis]
+        return scores
+
+    @property
+    def block_max_impacts(self) -> csr_matrix:
+        """The term-by-block matrix of the maximum impacts of terms in blocks of consecutive documents.
+
+        The i-th block contains the documents from i * block_size to (i + 1) * block_size - 1.
+        The matrix is computed on first use.
+
+        """
+        if self._block_max_impacts is None:
+            num_terms, num_documents = self.impacts.shape
+            num_blocks = -(-num_documents // self.block_size)
+            terms = np.repeat(np.arange(num_terms, dtype=np.int64), np.diff(self.impacts.indptr))
+            # the postings of a term are sorted by document, so the postings of a (term, block) pair are contiguous
+            keys = terms * num_blocks + self.impacts.indices // self.block_size
+            starts = np.flatnonzero(np.diff(keys, prepend=-1))
+            maxima = np.maximum.reduceat(self.impacts.data, starts) if len(starts) > 0 else np.zeros(0)
+            self._block_max_impacts = csr_matrix(
+                (maxima, (keys[starts] // num_blocks, keys[starts] % num_blocks)), shape=(num_terms, num_blocks))
+        return self._block_max_impacts
+
+    @property
+    def max_impacts(self) -> np.ndarray:
+        """The maximum impact of each term, computed on first use."""
+        if self._max_impacts is None:
+            self._max_impacts = self.block_max_impacts.max(axis=1).toarray().ravel()
+        return self._max_impacts
+
+    def get_top_k(self, query: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k documents with the highest BM25 scores for a query, retrieved with dynamic pruning.
+
+        The documents are split into blocks of consecutive documents and the maximum impact of every term
+        in every block is precomputed. First, the blocks with the highest upper bounds of their scores are
+        scored to obtain a lower bound on the k-th best score. Then, the query terms whose upper bounds sum
+        to less than this lower bound are marked as non-essential (MaxScore): a document that only contains
+        non-essential terms cannot enter the top k. Only the postings of the essential terms in blocks whose
+        upper bounds reach the lower bound (Block-Max) produce candidates, and the postings of non-essential
+        terms, which are the long posting lists of frequent terms, are only searched for the candidates whose
+        scores can still reach the lower bound.
+
+        Pruning only pays off when it looks up far fewer documents than exhaustive scoring reads postings, so
+        small corpora and queries whose frequent terms stay essential are scored exhaustively instead, which
+        ``script/benchmark_bm25_pruning.py`` compares on a synthetic Zipfian corpus.
+
+        The scores are summed in the same order as in :meth:`get_scores` and ties are broken by ascending
+        document number, so the result is identical to the top k of an exhaustive ranking.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+        k: int
+            The number of top documents.
+
+        Returns
+        -------
+        np.ndarray
+            The numbers of the top k documents in descending order of their BM25 scores.
+        np.ndarray
+            The BM25 scores of the top k documents.
+
+        """
+        term_ids, counts = self.inverted_index.query_vector(query, len(self.idf))
+        num_documents = self.inverted_index.num_documents
+        k = min(k, num_documents)
+        baseline = counts.dot(self.baseline[term_ids])
+
+        if self._has_non_positive_impacts or k == 0:
+            # documents without the query terms could outscore documents with them, so the bounds do not hold
+            return self._get_exhaustive_top_k(term_ids, counts, k)
+
+        # the costs are estimated in the number of postings scored and documents ranked by exhaustive scoring
+        posting_lengths = self.impacts.indptr[term_ids + 1] - self.impacts.indptr[term_ids]
+        exhaustive_cost = num_documents + posting_lengths.sum()
+        if PRUNING_OVERHEAD_COST > exhaustive_cost:
+            return self._get_exhaustive_top_k(term_ids, counts, k)
+
+        block_max_impacts = self.block_max_impacts
+        block_bounds = np.zeros(block_max_impacts.shape[1])
+        for term_id, weight in zip(term_ids, counts):
+            start, end = block_max_impacts.indptr[term_id], block_max_impacts.indptr[term_id + 1]
+            block_bounds[block_max_impacts.indices[start:end]] += block_max_impacts.data[start:end] * weight
+        block_bounds = block_bounds * (1 + UPPER_BOUND_SLACK) + baseline
+        term_bounds = self.max_impacts[term_ids] * counts * (1 + UPPER_BOUND_SLACK)
+        term_order = np.argsort(term_bounds, kind='stable')
+
+        # no threshold exceeds the highest block bound, so the terms that are essential at this bound are
+        # essential at every threshold and all their postings may have to be looked up as candidates
+        essential_terms = np.ones(len(term_ids), dtype=bool)
+        essential_terms[term_order] = np.cumsum(term_bounds[term_order]) + baseline >= block_bounds.max()
+        if PRUNING_OVERHEAD_COST + posting_lengths[essential_terms].sum() * len(term_ids) * PRUNING_LOOKUP_COST \
+                > exhaustive_cost:
+            return self._get_exhaustive_top_k(term_ids, counts, k)
+
+        postings = [(self.impacts.indices[start:end], self.impacts.data[start:end])
+                    for start, end in zip(self.impacts.indptr[term_ids], self.impacts.indptr[term_ids + 1])]
+        # the needles of the binary searches have the dtype of the posting lists, which are otherwise converted
+        block_starts = (np.arange(len(block_bounds) + 1) * self.block_size).astype(self.impacts.indices.dtype)
+        # the positions of the block starts in the posting lists, only computed for the terms that need them
+        boundaries: List[Optional[np.ndarray]] = [None] * len(postings)
+
+        # score the documents of the terms that are essential at every threshold in the blocks with the highest
+        # upper bounds until there are at least k of them, which gives a lower bound on the k-th best score
+        seed_terms = essential_terms if posting_lengths[essential_terms].sum() >= k else np.ones_like(essential_terms)
+        blocks = np.flatnonzero(block_bounds > baseline)
+        blocks = blocks[np.argsort(-block_bounds[blocks], kind='stable')]
+        num_block_documents = np.zeros(len(blocks), dtype=np.int64)
+        for term in np.flatnonzero(seed_terms):
+            boundaries[term] = np.searchsorted(postings[term][0], block_starts)
+            num_block_documents += np.diff(boundaries[term])[blocks]
+        initial_blocks = np.zeros(len(block_bounds), dtype=bool)
+        initial_blocks[blocks[:np.searchsorted(np.cumsum(num_block_documents), k) + 1]] = True
+        initial_documents = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            self._get_block_postings(postings[term][0], boundaries[term], initial_blocks)
+            for term in np.flatnonzero(seed_terms)]))
+        initial_scores = self._score_documents(postings, counts, baseline, initial_documents)
+        threshold = -np.inf
+        if len(initial_scores) >= k:
+            threshold = -np.partition(-initial_scores, k - 1)[k - 1]
+
+        # only documents with an essential term in a block that can reach the threshold are candidates
+        essential_terms[term_order] = np.cumsum(term_bounds[term_order]) + baseline >= threshold
+        candidate_blocks = block_bounds >= threshold
+        for term in np.flatnonzero(essential_terms):
+            if boundaries[term] is None:
+                boundaries[term] = np.searchsorted(postings[term][0], block_starts)
+        num_candidates = sum(np.diff(boundaries[term])[candidate_blocks].sum()
+                             for term in np.flatnonzero(essential_terms))
+        if num_candidates * len(term_ids) * PRUNING_LOOKUP_COST > exhaustive_cost:
+            # looking the candidates up would be slower than scoring the posting lists exhaustively
+            return self._get_exhaustive_top_k(term_ids, counts, k)
+
+        candidates = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            self._get_block_postings(postings[term][0], boundaries[term], candidate_blocks)
+            for term in np.flatnonzero(essential_terms)]))
+        candidates = np.setdiff1d(candidates, initial_documents, assume_unique=True)
+        if not essential_terms.all():
+            # MaxScore: the candidates whose scores of the essential terms with the upper bounds of the other terms
+            # cannot reach the threshold are discarded before they are looked up in the long posting lists
+            essential_postings = [(indices, impacts) if essential else (indices[:0], impacts[:0])
+                                  for essential, (indices, impacts) in zip(essential_terms, postings)]
+            essential_scores = self._score_documents(essential_postings, counts, baseline, candidates)
+            non_essential_bound = term_bounds[~essential_terms].sum() * (1 + UPPER_BOUND_SLACK)
+            candidates = candidates[essential_scores * (1 + UPPER_BOUND_SLACK) + non_essential_bound >= threshold]
+        candidate_scores = self._score_documents(postings, counts, baseline, candidates)
+
+        top_positions = np.concatenate([initial_documents, candidates])
+        top_scores = np.concatenate([initial_scores, candidate_scores])
+        reaching = top_scores >= threshold
+        top_positions, top_scores = top_positions[reaching], top_scores[reaching]
+        top = np.lexsort((top_positions, -top_scores))[:k]
+        top_positions, top_scores = top_positions[top], top_scores[top]
+
+        if len(top_scores) < k or top_scores[-1] <= baseline:
+            # documents without any query term score the baseline and tie by ascending document number
+            covered = np.zeros(num_documents, dtype=bool)
+            for indices, _ in postings:
+                covered[indices] = True
+            uncovered = np.flatnonzero(~covered)[:k]
+            top_positions = np.concatenate([top_positions, uncovered])
+            top_scores = np.concatenate([top_scores, np.full(len(uncovered), baseline)])
+            top = np.lexsort((top_positions, -top_scores))[:k]
+            top_positions, top_scores = top_positions[top], top_scores[top]
+
+        return top_positions, top_scores
+
+    def _get_exhaustive_top_k(self, term_ids: np.ndarray, counts: np.ndarray,
+                              k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k documents with the highest BM25 scores for a query, retrieved by scoring all documents."""
+        scores = self._get_scores(term_ids, counts)
+        positions = np.fromiter(islice(rank_lazily(scores, k), k), dtype=np.int64, count=k)
+        return positions, scores[positions]
+
+    @staticmethod
+    def _get_block_postings(indices: np.ndarray, boundaries: np.ndarray, blocks: np.ndarray) -> np.ndarray:
+        """The documents of a posting list in the selected blocks, without reading the other blocks."""
+        starts, ends = boundaries[:-1][blocks], boundaries[1:][blocks]
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return indices[offsets + np.arange(len(offsets))]
+
+    @staticmethod
+    def _score_documents(postings: List[Tuple[np.ndarray, np.ndarray]], counts: np.ndarray,
+                         baseline: float, documents: np.ndarray) -> np.ndarray:
+        """The BM25 scores of sorted documents computed from the postings of the query terms."""
+        scores = np.zeros(len(documents))
+        for weight, (indices, impacts) in zip(counts, postings):
+            if len(indices) == 0 or len(documents) == 0:
+                continue
+            found = np.minimum(np.searchsorted(indices, documents.astype(indices.dtype)), len(indices) - 1)
+            contains_term = indices[found] == documents
+            scores[contains_term] += impacts[found[contains_term]] * weight
+        scores += baseline
+        return scores
+
+
+class SegmentedBM25Index(SegmentedIndex):
+    """
+    A BM25 ranking model of a snapshot of a segmented corpus of inverted indexes.
+
+    Each segment has a BM25 index whose impacts are computed from the statistics of the documents of all
+    segments that have not been removed, so that the scores are identical to the scores of a BM25 index
+    of a single inverted index of these documents.
+
+    Parameters
+    ----------
+    snapshot: CorpusSnapshot
+        A snapshot of a segmented corpus of inverted indexes that share their vocabulary.
+    variant: str
+        BM25 variant: 'okapi' for BM25, 'l' for BM25L, or 'plus' for BM25+.
+    k1: float
+        BM25 k1 parameter.
+    b: float
+        BM25 b parameter.
+    d: float
+        BM25 d parameter.
+    epsilon: float
+        Floor of the inverse document frequencies for BM25.
+    block_size: int
+        The number of consecutive documents that share an upper bound of the impacts in :meth:`get_top_k`.
+
+    """
+
+    def __init__(self, snapshot: CorpusSnapshot, variant: str = 'plus', k1: float = 1.5, b: float = 0.75,
+                 d: float = 1, epsilon: float = 0.25, block_size: int = PRUNING_BLOCK_SIZE):
+        statistics = CorpusStatistics(snapshot.segments, snapshot.get_live_masks())
+        super().__init__(snapshot, [
+            BM25Index(segment, variant, k1=k1, b=b, d=d, epsilon=epsilon, block_size=block_size,
+                      statistics=statistics)
+            for segment in snapshot.segments])
+
+    def with_parameters(self, variant: Optional[str] = None, k1: Optional[float] = None,
+                        b: Optional[float] = None, d: Optional[float] = None,
+                        epsilon: Optional[float] = None) -> 'SegmentedBM25Index':
+        """A BM25 model with different parameters that shares the inverted indexes.
+
+        See :meth:`BM25Index.with_parameters`.
+
+        """
+        segmented_index = copy(self)
+        segmented_index.segment_indexes = [
+            index.with_parameters(variant, k1=k1, b=b, d=d, epsilon=epsilon) for index in self.segment_indexes]
+        return segmented_index
+
+    def with_snapshot(self, snapshot: CorpusSnapshot) -> 'SegmentedBM25Index':
+        """A BM25 model of another snapshot of the segmented corpus with the same parameters."""
+        index = self.segment_indexes[0]
+        return SegmentedBM25Index(snapshot, index.variant, k1=index.k1, b=index.b, d=index.d, epsilon=index.epsilon,
+                                  block_size=index.block_size)
+
+    def get_top_k(self, query: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k documents with the highest BM25 scores for a query, retrieved with dynamic pruning.
+
+        See :meth:`BM25Index.get_top_k`. Each segment retrieves enough documents to make up for its
+        removed documents.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+        k: int
+            The number of top documents.
+
+        Returns
+        -------
+        np.ndarray
+            The indices of the top k documents in :attr:`CorpusSnapshot.live_documents` in descending order
+            of their BM25 scores.
+        np.ndarray
+            The BM25 scores of the top k documents.
+
+        """
+        live_masks = self.snapshot.get_live_masks()
+        segment_top_k = [index.get_top_k(query, k + len(live_mask) - live_mask.sum())
+                         for index, live_mask in zip(self.segment_indexes, live_masks)]
+        return self.snapshot.merge_top_k(segment_top_k, k)
@@ -1,51 +1,132 @@
-from typing import Iterable, OrderedDict
+from threading import Lock
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, OrderedDict, Sequence, Union
 
-from gensim.corpora import Dictionary
-from gensim.similarities import SparseMatrixSimilarity
-from tqdm import tqdm
+import numpy as np
+from gensim.corpora import Dictionary, HashDictionary
 
 from ..entities import DocumentBase, QueryBase
 from ..irsystem import IRSystemBase
 from ..preprocessing import DocPreprocessingBase
+from ..storage.shards import ShardStore
+from .compatibility import to_gensim_dictionary, warn_deprecated
+from .cosine_index import SegmentedCosineIndex
+from .index_builder import build_inverted_index
+from .inverted_index import HashingVocabulary, InvertedIndex, Vocabulary
+from .ranking import rank_sparse_documents, rank_sparse_lazily
+from .segments import SegmentedCorpus
 
 
 class BoWSystem(IRSystemBase):
     """
     A bag-of-words system
 
+    Documents can be added and removed with :meth:`add_documents` and :meth:`remove_documents`
+    without indexing the other documents again.
+
     Parameters
     ----------
     documents: OrderedDict
         Input documents
     preprocessing: DocPreprocessingBase
         Type of preprocessing
+    shard_size: int or None
+        If not None, the index is split into shards of at most shard_size documents that are kept on disk
+        and memory-mapped, so that corpora larger than the memory can be indexed and searched. The memory
+        used by the index and by a search is then bounded by a shard and the posting lists of the query terms.
+        If None, the index is kept in memory.
+    shard_directory: str, Path, or None
+        The directory of the shards. If None, the default temporary directory is used.
+    num_buckets: int or None
+        If not None, the terms are hashed to num_buckets rows instead of being collected into a vocabulary,
+        so that the memory of the vocabulary is fixed and the documents are indexed in a single pass
+        without a global mapping of terms. Terms that share a row are indistinguishable.
+        If None, a vocabulary of all terms is collected.
 
     Attributes
     ----------
-    dictionary: Dictionary
-        The dictionary of the system.
-    index: MatrixSimilarity
+    vocabulary: dict of (str, int) or HashingVocabulary
+        The vocabulary of the system.
+    corpus: SegmentedCorpus
         The indexed documents.
+    shard_store: ShardStore or None
+        The shards of the index on disk.
+    index: SegmentedCosineIndex
+        The indexed documents as unit-length vectors of term frequencies.
+    dictionary: Dictionary or HashDictionary
+        Deprecated, use vocabulary. A gensim dictionary with the terms of the vocabulary.
     index_to_document: dict of (int, Document)
-        A mapping from indexed document numbers to documents.
+        Deprecated, use ``index.snapshot.live_documents``. A mapping from indexed document numbers to documents.
 
     """
 
-    def __init__(self, documents: OrderedDict[str, DocumentBase], preprocessing: DocPreprocessingBase):
+    def __init__(self, documents: OrderedDict[str, DocumentBase], preprocessing: DocPreprocessingBase,
+                 shard_size: Optional[int] = None, shard_directory: Optional[Union[str, Path]] = None,
+                 num_buckets: Optional[int] = None):
         self.preprocessing = preprocessing
+        self.vocabulary: Vocabulary = {} if num_buckets is None else HashingVocabulary(num_buckets)
+        self.shard_store = None if shard_size is None else ShardStore(shard_directory)
+        self._index_lock = Lock()
+        self.corpus = SegmentedCorpus(documents, self._build_inverted_index, self._merge_inverted_indexes,
+                                      max_segment_size=shard_size)
+        self._index = SegmentedCosineIndex(self.corpus.snapshot, 'bow', self.shard_store)
+
+    def _build_inverted_index(self, documents: List[DocumentBase]) -> InvertedIndex:
+        inverted_index = build_inverted_index(documents, self.preprocessing, self.vocabulary)
+        return inverted_index if self.shard_store is None else inverted_index.store(self.shard_store)
+
+    def _merge_inverted_indexes(self, inverted_indexes: Sequence[InvertedIndex],
+                                masks: Sequence[np.ndarray]) -> InvertedIndex:
+        inverted_index = InvertedIndex.merge(inverted_indexes, masks)
+        return inverted_index if self.shard_store is None else inverted_index.store(self.shard_store)
+
+    @property
+    def index(self) -> SegmentedCosineIndex:
+        """The indexed documents, following the documents added and removed from the corpus."""
+        index = self._index
+        if index.snapshot is not self.corpus.snapshot:
+            # concurrent searches wait for a single update of the index instead of each updating it
+            with self._index_lock:
+                if self._index.snapshot is not self.corpus.snapshot:
+                    self._index = self._index.with_snapshot(self.corpus.snapshot)
+                index = self._index
+        return index
+
+    @property
+    def dictionary(self) -> Union[Dictionary, HashDictionary]:
+        """Deprecated, use :attr:`vocabulary`. A gensim dictionary with the terms of the vocabulary."""
+        warn_deprecated('dictionary', 'vocabulary')
+        return to_gensim_dictionary(self.vocabulary, self.index.statistics)
+
+    @property
+    def index_to_document(self) -> Dict[int, DocumentBase]:
+        """Deprecated, use ``index.snapshot.live_documents``. A mapping from document numbers to documents."""
+        warn_deprecated('index_to_document', 'index.snapshot.live_documents')
+        return dict(enumerate(self.index.snapshot.live_documents))
+
+    def add_documents(self, documents: OrderedDict[str, DocumentBase]):
+        """Index new documents without indexing the existing documents again.
+
+        Documents with the identifiers of indexed documents replace the indexed documents.
 
-        document_bodies = (self.preprocessing(str(document)) for document in documents.values())
-        document_bodies = tqdm(document_bodies, desc='Building the dictionary', total=len(documents))
+        Parameters
+        ----------
+        documents : OrderedDict
+            Added documents.
 
-        self.dictionary = Dictionary(document_bodies)
-        document_vectors = (self._doc2bow(str(document)) for document in documents.values())
-        document_vectors = tqdm(document_vectors, desc='Building the index', total=len(documents))
+        """
+        self.corpus.add(documents)
 
-        self.index = SparseMatrixSimilarity(document_vectors, num_docs=len(documents), num_terms=len(self.dictionary))
-        self.index_to_document = dict(enumerate(documents.values()))
+    def remove_documents(self, document_ids: Iterable[str]):
+        """Remove indexed documents.
 
-    def _doc2bow(self, doc: str):
-        return self.dictionary.doc2bow(self.preprocessing(doc))
+        Parameters
+        ----------
+        document_ids : iterable of str
+            Identifiers of removed documents.
+
+        """
+        self.corpus.remove(document_ids)
 
     def search(self, query: QueryBase) -> Iterable[DocumentBase]:
         """The ranked retrieval results for a query.
@@ -61,9 +142,38 @@ class BoWSystem(IRSystemBase):
             The ranked retrieval results for a query.
 
         """
-        similarities = enumerate(self.index[self._doc2bow(str(query))])
-        sorted_similarities = sorted(similarities, key=lambda item: item[1], reverse=True)
+        index = self.index
+        similarities = index.get_sparse_batch_scores([self.preprocessing(str(query))])
+        documents = index.snapshot.live_documents
 
-        for document_number, _ in sorted_similarities:
-            document = self.index_to_document[document_number]
+        for document_number in rank_sparse_lazily(similarities.indices, similarities.data, len(documents)):
+            document = documents[document_number]
             yield document
+
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """The ranked retrieval results for several queries.
+
+        All queries are compared with the indexed documents in a single sparse matrix product, which only
+        scores the documents that share terms with the queries.
+
+        Parameters
+        ----------
+        queries : iterable of Query
+            Queries.
+        k : int or None
+            The number of top documents retrieved for each query. If None, all documents are retrieved.
+
+        Returns
+        -------
+        list of iterable of Document
+            The ranked retrieval results for each query.
+
+        """
+        index = self.index
+        similarities = index.get_sparse_batch_scores([self.preprocessing(str(query)) for query in queries])
+        documents = index.snapshot.live_documents
+
+        return [
+            rank_sparse_documents(similarities.indices[start:end], similarities.data[start:end], documents, k)
+            for start, end in zip(similarities.indptr[:-1], similarities.indptr[1:])
+        ]
@@ -0,0 +1,57 @@
+import warnings
+import zlib
+from typing import Union
+
+from gensim.corpora import Dictionary, HashDictionary
+
+from .inverted_index import CorpusStatistics, HashingVocabulary, Vocabulary
+
+
+def warn_deprecated(name: str, replacement: str):
+    """Warn that an attribute of a system is deprecated.
+
+    Parameters
+    ----------
+    name: str
+        The name of the deprecated attribute.
+    replacement: str
+        What should be used instead of the attribute.
+
+    """
+    warnings.warn('{} is deprecated and will be removed, use {} instead'.format(name, replacement),
+                  DeprecationWarning, stacklevel=3)
+
+
+def to_gensim_dictionary(vocabulary: Vocabulary,
+                         statistics: CorpusStatistics) -> Union[Dictionary, HashDictionary]:
+    """A gensim dictionary with the term ids and the document frequencies of a vocabulary.
+
+    The dictionary maps tokens to the same ids as the vocabulary, so that its bags of words index the rows
+    of the indexes built with the vocabulary.
+
+    Parameters
+    ----------
+    vocabulary: dict of (str, int) or HashingVocabulary
+        A vocabulary.
+    statistics: CorpusStatistics
+        The statistics of the indexed documents.
+
+    Returns
+    -------
+    Dictionary or HashDictionary
+        A Dictionary for a vocabulary of all terms, or a HashDictionary that hashes the terms to the same
+        rows as a HashingVocabulary.
+
+    """
+    document_frequencies = statistics.document_frequencies
+    if isinstance(vocabulary, HashingVocabulary):
+        dictionary = HashDictionary(id_range=vocabulary.num_buckets, myhash=zlib.crc32, debug=False)
+        dictionary.cfs = {}
+    else:
+        dictionary = Dictionary()
+        dictionary.token2id = dict(vocabulary)
+    dictionary.dfs = {int(term_id): int(document_frequencies[term_id])
+                      for term_id in document_frequencies.nonzero()[0]}
+    dictionary.num_docs = statistics.num_documents
+    dictionary.num_nnz = int(document_frequencies.sum())
+    return dictionary
@@ -0,0 +1,251 @@
+from copy import copy
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from ..storage.shards import ShardStore
+from .inverted_index import CorpusStatistics, InvertedIndex
+from .segments import CorpusSnapshot, SegmentedIndex
+
+
+COSINE_WEIGHTINGS = ('bow', 'tfidf')
+
+
+class CosineIndex:
+    """
+    Unit-length weighted document vectors of term frequencies stored as a term-by-document matrix in the CSR format.
+
+    The similarity of a query and a document is the cosine of the angle between their weighted vectors.
+    With the 'bow' weighting, the weights are the term frequencies. With the 'tfidf' weighting, the weights
+    are the term frequencies multiplied by the binary logarithm of the inverse document frequencies, which
+    are the defaults of gensim's TfidfModel.
+
+    Only the term frequencies and the lengths of the weighted document vectors are stored. The global term
+    weights are applied to the queries, so that new statistics only recompute the lengths, see
+    :meth:`with_statistics`.
+
+    Parameters
+    ----------
+    inverted_index: InvertedIndex
+        Term frequencies of the documents.
+    weighting: str
+        Term weighting: 'bow' or 'tfidf'.
+    statistics: CorpusStatistics or None
+        The number of documents and the document frequencies used to compute the inverse document
+        frequencies. If None, the statistics of the inverted index are used.
+    shard_store: ShardStore or None
+        If not None, the term frequencies are moved to disk and memory-mapped.
+
+    Attributes
+    ----------
+    inverted_index: InvertedIndex
+        Term frequencies of the documents.
+    term_weights: np.ndarray
+        The global weight of each term. Terms with zero weight are left out of the query vectors.
+    term_frequencies: csr_matrix
+        The term-by-document matrix of the term frequencies in float32.
+    norms: np.ndarray
+        The length of each weighted document vector.
+
+    """
+
+    def __init__(self, inverted_index: InvertedIndex, weighting: str = 'bow',
+                 statistics: Optional[CorpusStatistics] = None, shard_store: Optional[ShardStore] = None):
+        if weighting not in COSINE_WEIGHTINGS:
+            raise ValueError('Unknown weighting {}, expected one of {}'.format(weighting, COSINE_WEIGHTINGS))
+
+        term_frequencies = inverted_index.term_frequencies
+        self.inverted_index = inverted_index
+        self.weighting = weighting
+        self.term_frequencies = csr_matrix(
+            (term_frequencies.data.astype(np.float32), term_frequencies.indices, term_frequencies.indptr),
+            shape=term_frequencies.shape)
+        if shard_store is not None:
+            self.term_frequencies = shard_store.store_matrix(self.term_frequencies)
+        self.norms = None
+        self._set_statistics(CorpusStatistics([inverted_index]) if statistics is None else statistics)
+
+    def _set_statistics(self, statistics: CorpusStatistics):
+        # terms whose documents have all been removed from a segmented corpus are left out like unknown terms
+        document_frequencies = statistics.document_frequencies
+        present = document_frequencies > 0
+        term_weights = np.zeros(len(document_frequencies))
+        if self.weighting == 'tfidf':
+            term_weights[present] = np.log2(statistics.num_documents / document_frequencies[present])
+        else:
+            term_weights[present] = 1.0
+
+        self.statistics = statistics
+        self.term_weights = term_weights
+        # the weights of the terms of a document are constant with the 'bow' weighting, so its length is too
+        if self.norms is None or self.weighting == 'tfidf':
+            term_frequencies = self.term_frequencies
+            weights = term_frequencies.data * np.repeat(term_weights[:term_frequencies.shape[0]],
+                                                        np.diff(term_frequencies.indptr))
+            norms = np.sqrt(np.bincount(term_frequencies.indices, weights ** 2, minlength=term_frequencies.shape[1]))
+            norms[norms == 0] = 1.0
+            self.norms = norms.astype(np.float32)
+
+    def with_statistics(self, statistics: CorpusStatistics) -> 'CosineIndex':
+        """A cosine index of the same documents that shares the term frequencies and uses other statistics.
+
+        Only the lengths of the weighted document vectors are recomputed, and only with the 'tfidf' weighting.
+
+        Parameters
+        ----------
+        statistics: CorpusStatistics
+            The number of documents and the document frequencies used to compute the inverse document
+            frequencies.
+
+        Returns
+        -------
+        CosineIndex
+            The cosine index.
+
+        """
+        index = copy(self)
+        index._set_statistics(statistics)
+        return index
+
+    def query_vector(self, query: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """The unit-length weighted vector of a tokenized query.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+
+        Returns
+        -------
+        tuple of (np.ndarray, np.ndarray)
+            The rows of the query terms in the term-by-document matrix and their weights.
+
+        """
+        term_ids, counts = self.inverted_index.query_vector(query, len(self.term_weights))
+        weights = counts * self.term_weights[term_ids]
+        nonzero = weights != 0
+        term_ids, weights = term_ids[nonzero], weights[nonzero]
+        if len(weights) > 0:
+            weights /= np.linalg.norm(weights)
+        return term_ids, weights.astype(np.float32)
+
+    def _term_frequency_vector(self, query: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # the rows of the query terms and the weights that multiply their term frequencies
+        term_ids, weights = self.query_vector(query)
+        weights = weights * self.term_weights[term_ids].astype(np.float32)
+        # terms added to a shared vocabulary after the documents were indexed have no postings
+        indexed = term_ids < self.term_frequencies.shape[0]
+        return term_ids[indexed], weights[indexed]
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """The cosine similarities of all documents and a query.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+
+        Returns
+        -------
+        np.ndarray
+            The cosine similarity of each document and the query.
+
+        """
+        term_ids, weights = self._term_frequency_vector(query)
+        return self.term_frequencies[term_ids].T.dot(weights) / self.norms
+
+    def get_batch_scores(self, queries: List[List[str]]) -> np.ndarray:
+        """The cosine similarities of all documents and several queries.
+
+        The queries are scored with a single product of a sparse query-by-term matrix and the term frequencies.
+
+        Parameters
+        ----------
+        queries: list of list of str
+            Tokenized queries.
+
+        Returns
+        -------
+        np.ndarray
+            A matrix with the cosine similarity of each document and each query.
+
+        """
+        return self.get_sparse_batch_scores(queries).toarray()
+
+    def get_sparse_batch_scores(self, queries: List[List[str]]) -> csr_matrix:
+        """The nonzero cosine similarities of documents and several queries.
+
+        Only the documents in the posting lists of the query terms are scored, so the cost does not grow
+        with the number of documents that share no terms with the queries.
+
+        Parameters
+        ----------
+        queries: list of list of str
+            Tokenized queries.
+
+        Returns
+        -------
+        csr_matrix
+            A sparse query-by-document matrix of the cosine similarities. The missing similarities are zero.
+
+        """
+        query_vectors = [self._term_frequency_vector(query) for query in queries]
+        indptr = np.cumsum([0] + [len(term_ids) for term_ids, _ in query_vectors])
+        indices = np.concatenate([term_ids for term_ids, _ in query_vectors] + [np.zeros(0, dtype=np.int64)])
+        data = np.concatenate([weights for _, weights in query_vectors] + [np.zeros(0, dtype=np.float32)])
+        query_matrix = csr_matrix((data, indices, indptr), shape=(len(queries), self.term_frequencies.shape[0]))
+        scores = query_matrix @ self.term_frequencies
+        scores.data /= self.norms[scores.indices]
+        return scores
+
+
+class SegmentedCosineIndex(SegmentedIndex):
+    """
+    Cosine similarities of the documents of a snapshot of a segmented corpus of inverted indexes.
+
+    Each segment has a cosine index whose weights are computed from the statistics of the documents of all
+    segments that have not been removed, so that the similarities are identical to the similarities in a
+    cosine index of a single inverted index of these documents.
+
+    Parameters
+    ----------
+    snapshot: CorpusSnapshot
+        A snapshot of a segmented corpus of inverted indexes that share their vocabulary.
+    weighting: str
+        Term weighting: 'bow' or 'tfidf'.
+    shard_store: ShardStore or None
+        If not None, the term frequencies of the segments are moved to disk and memory-mapped.
+
+    Attributes
+    ----------
+    statistics: CorpusStatistics
+        The statistics of the documents that have not been removed.
+
+    """
+
+    def __init__(self, snapshot: CorpusSnapshot, weighting: str = 'bow', shard_store: Optional[ShardStore] = None):
+        statistics = CorpusStatistics(snapshot.segments, snapshot.get_live_masks())
+        super().__init__(snapshot, [CosineIndex(segment, weighting, statistics, shard_store)
+                                    for segment in snapshot.segments])
+        self.weighting = weighting
+        self.statistics = statistics
+        self.shard_store = shard_store
+
+    def with_snapshot(self, snapshot: CorpusSnapshot) -> 'SegmentedCosineIndex':
+        """A cosine index of another snapshot of the segmented corpus with the same weighting.
+
+        The cosine indexes of the segments shared with this snapshot are reused with the new statistics,
+        so that only the new segments are indexed.
+
+        """
+        statistics = CorpusStatistics(snapshot.segments, snapshot.get_live_masks())
+        segment_indexes = {id(index.inverted_index): index for index in self.segment_indexes}
+        segmented_index = copy(self)
+        segmented_index.snapshot = snapshot
+        segmented_index.statistics = statistics
+        segmented_index.segment_indexes = [
+            segment_indexes[id(segment)].with_statistics(statistics) if id(segment) in segment_indexes
+            else CosineIndex(segment, self.weighting, statistics, self.shard_store)
+            for segment in snapshot.segments]
+        return segmented_index
@@ -0,0 +1,301 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ..entities import DocumentBase
+from .quantization import QUANTIZED_MODEL_SUFFIX, is_quantized
+
+
+# number of documents looked up in the embedding store at once
+STORE_QUERY_SIZE = 400
+
+# default number of query embeddings kept in a query embedding cache
+QUERY_CACHE_SIZE = 4096
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """Scale embeddings to unit length, so that their cosine similarities are dot products.
+
+    Parameters
+    ----------
+    embeddings: np.ndarray
+        An embedding or a matrix with an embedding in each row.
+
+    Returns
+    -------
+    np.ndarray
+        The unit-length embeddings in a contiguous float32 array. Zero embeddings are kept.
+
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return np.ascontiguousarray(embeddings / np.where(norms > 0, norms, 1))
+
+
+def get_model_name(model: Any) -> str:
+    """The name and revision of a Hugging Face model, which identify the embeddings that the model produces.
+
+    Parameters
+    ----------
+    model: SentenceTransformer or CrossEncoder
+        A model loaded from the Hugging Face Hub or from a local directory.
+
+    Returns
+    -------
+    str
+        The name of the model, followed by @ and the revision of the model if it is known, and by
+        +qint8 if the model is quantized, see :func:`quantize_model`.
+
+    Raises
+    ------
+    ValueError
+        If the name of the model cannot be determined.
+
+    """
+    model_card_data = getattr(model, 'model_card_data', None)
+    name = getattr(model_card_data, 'base_model', None)
+    revision = getattr(model_card_data, 'base_model_revision', None)
+    if not name:
+        try:
+            config = model[0].auto_model.config
+        except (AttributeError, IndexError, KeyError, TypeError):
+            config = None
+        name = getattr(config, '_name_or_path', None)
+        revision = getattr(config, '_commit_hash', None)
+    if not name:
+        raise ValueError('Cannot determine the name of model {!r}'.format(model))
+    name = name if revision is None else '{}@{}'.format(name, revision)
+    return name + QUANTIZED_MODEL_SUFFIX if is_quantized(model) else name
+
+
+class EmbeddingStore:
+    """
+    A persistent store of document embeddings on disk.
+
+    The embeddings are keyed by the name of the model, the identifier of the document, and a hash of the text
+    of the document, so that they can be shared by systems in different processes and notebook sessions and
+    only new or changed documents need to be encoded. The embeddings of each model are appended to a file of
+    float32 rows that is memory-mapped for reading, and the rows of the documents are kept in an SQLite
+    database, which also serializes writers from different processes.
+
+    Parameters
+    ----------
+    directory: str, Path, or None
+        The directory of the store. If None, ~/.cache/pv211-utils/embeddings is used.
+
+    Attributes
+    ----------
+    directory: Path
+        The directory of the store.
+
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None):
+        directory = Path.home() / '.cache' / 'pv211-utils' / 'embeddings' if directory is None else Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+
+    def get_embeddings(self, model_name: str, documents: Sequence[DocumentBase],
+                       encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """The embeddings of documents, encoding only the documents that are not in the store.
+
+        Parameters
+        ----------
+        model_name: str
+            The name and revision of the model, such as the result of :func:`get_model_name`.
+        documents: sequence of DocumentBase
+            The documents.
+        encode: callable
+            Encodes a list of texts into a matrix with an embedding in each row.
+
+        Returns
+        -------
+        np.ndarray
+            A float32 matrix with the embedding of each document in each row.
+
+        """
+        model_directory = self._get_model_directory(model_name)
+        texts = [str(document) for document in documents]
+        keys = [(str(getattr(document, 'document_id', '')), hashlib.sha256(text.encode('utf-8')).hexdigest())
+                for document, text in zip(documents, texts)]
+
+        with closing(self._connect(model_directory)) as connection:
+            rows = self._find_rows(connection, keys)
+            missing = sorted({key: number for number, key in enumerate(keys) if key not in rows}.values())
+            if missing:
+                # encode without holding the write lock, so that other processes can keep reading and writing
+                embeddings = np.asarray(encode([texts[number] for number in missing]), dtype=np.float32)
+                rows.update(self._append(connection, model_directory, [keys[number] for number in missing],
+                                         embeddings))
+            dimension = self._get_dimension(connection)
+
+        if not keys:
+            # a new store does not know the dimension, and has no file of embeddings to open
+            return np.empty((0, dimension), dtype=np.float32)
+        stored_embeddings = self._open(model_directory, dimension)
+        return np.array(stored_embeddings[[rows[key] for key in keys]], dtype=np.float32).reshape(-1, dimension)
+
+    def _get_model_directory(self, model_name: str) -> Path:
+        model_directory = self.directory / hashlib.sha256(model_name.encode('utf-8')).hexdigest()[:16]
+        model_directory.mkdir(exist_ok=True)
+        (model_directory / 'model.txt').write_text(model_name)
+        return model_directory
+
+    @staticmethod
+    def _connect(model_directory: Path) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(model_directory / 'index.sqlite'), timeout=600, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS rows (document_id TEXT, text_hash TEXT, row INTEGER, '
+                           'PRIMARY KEY (document_id, text_hash))')
+        connection.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value INTEGER)')
+        return connection
+
+    @staticmethod
+    def _find_rows(connection: sqlite3.Connection, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+        rows = {}
+        for start in range(0, len(keys), STORE_QUERY_SIZE):
+            chunk = keys[start:start + STORE_QUERY_SIZE]
+            query = 'SELECT document_id, text_hash, row FROM rows WHERE (document_id, text_hash) IN (VALUES {})'
+            query = query.format(', '.join(['(?, ?)'] * len(chunk)))
+            for document_id, text_hash, row in connection.execute(query, [value for key in chunk for value in key]):
+                rows[document_id, text_hash] = row
+        return rows
+
+    @staticmethod
+    def _get_dimension(connection: sqlite3.Connection) -> int:
+        result = connection.execute("SELECT value FROM metadata WHERE key = 'dimension'").fetchone()
+        return 0 if result is None else result[0]
+
+    def _append(self, connection: sqlite3.Connection, model_directory: Path, keys: List[Tuple[str, str]],
+                embeddings: np.ndarray) -> Dict[Tuple[str, str], int]:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            dimension = self._get_dimension(connection)
+            if dimension == 0:
+                dimension = embeddings.shape[1]
+                connection.execute("INSERT INTO metadata VALUES ('dimension', ?)", (dimension,))
+            elif dimension != embeddings.shape[1]:
+                raise ValueError('Expected embeddings of dimension {}, got {}'.format(dimension, embeddings.shape[1]))
+
+            # another process may have stored some of the documents since we looked them up
+            rows = self._find_rows(connection, keys)
+            new = [number for number, key in enumerate(keys) if key not in rows]
+            with (model_directory / 'embeddings.f32').open('ab') as f:
+                row_size = dimension * np.dtype(np.float32).itemsize
+                # drop a partial row left by a writer that did not finish
+                num_rows = f.tell() // row_size
+                f.truncate(num_rows * row_size)
+                f.seek(num_rows * row_size)
+                f.write(np.ascontiguousarray(embeddings[new]).tobytes())
+            new_rows = {keys[number]: num_rows + offset for offset, number in enumerate(new)}
+            connection.executemany('INSERT INTO rows VALUES (?, ?, ?)', [key + (row,) for key, row in new_rows.items()])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        rows.update(new_rows)
+        return rows
+
+    @staticmethod
+    def _open(model_directory: Path, dimension: int) -> np.ndarray:
+        filename = model_directory / 'embeddings.f32'
+        row_size = dimension * np.dtype(np.float32).itemsize
+        num_rows = filename.stat().st_size // row_size if dimension > 0 and filename.exists() else 0
+        if num_rows == 0:
+            return np.zeros((0, dimension), dtype=np.float32)
+        return np.memmap(filename, dtype=np.float32, mode='r', shape=(num_rows, dimension))
+
+
+class QueryEmbeddingCache:
+    """
+    A bounded cache of query embeddings that evicts the least recently used embeddings.
+
+    The embeddings are keyed by the name of the model and the text of the query, so that a single cache can
+    be shared by several systems that use the same model, and a query that is searched again, such as by each
+    metric of an evaluation, is only encoded once. The cache can be used from several threads at once.
+
+    Parameters
+    ----------
+    max_size: int
+        The maximum number of cached embeddings.
+
+    Attributes
+    ----------
+    max_size: int
+        The maximum number of cached embeddings.
+    hits: int
+        The number of queries whose embeddings were found in the cache.
+    misses: int
+        The number of queries that had to be encoded.
+
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE):
+        if max_size < 1:
+            raise ValueError('Expected a positive cache size, got {}'.format(max_size))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._embeddings: OrderedDict[Tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._embeddings)
+
+    def clear(self):
+        """Remove all cached embeddings."""
+        with self._lock:
+            self._embeddings.clear()
+
+    def get_embeddings(self, model_name: str, texts: Sequence[str],
+                       encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """The embeddings of queries, encoding only the queries that are not in the cache.
+
+        Parameters
+        ----------
+        model_name: str
+            The name and revision of the model, such as the result of :func:`get_model_name`.
+        texts: sequence of str
+            The texts of the queries.
+        encode: callable
+            Encodes a list of texts into a matrix with an embedding in each row.
+
+        Returns
+        -------
+        np.ndarray
+            A float32 matrix with the embedding of each query in each row.
+
+        """
+        keys = [(model_name, text) for text in texts]
+        embeddings = {}
+        with self._lock:
+            for key in keys:
+                if key in self._embeddings:
+                    self._embeddings.move_to_end(key)
+                    embeddings[key] = self._embeddings[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        # encode without holding the lock, so that other threads can keep using the cache
+        missing = list(OrderedDict.fromkeys(key for key in keys if key not in embeddings))
+        if missing:
+            encoded_embeddings = np.asarray(encode([text for _, text in missing]), dtype=np.float32)
+            with self._lock:
+                for key, embedding in zip(missing, encoded_embeddings):
+                    embedding = embedding.copy()
+                    embedding.setflags(write=False)
+                    embeddings[key] = self._embeddings[key] = embedding
+                    self._embeddings.move_to_end(key)
+                while len(self._embeddings) > self.max_size:
+                    self._embeddings.popitem(last=False)
+
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([embeddings[key] for key in keys])
@@ -0,0 +1,204 @@
+from collections import Counter
+from functools import partial
+from itertools import islice
+from multiprocessing import get_all_start_methods, get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from tqdm import tqdm
+
+from ..entities import DocumentBase
+from ..preprocessing import DocPreprocessingBase
+from .inverted_index import InvertedIndex, Vocabulary
+
+
+# number of documents tokenized by a worker at once
+CHUNK_SIZE = 256
+
+# bytes of postings kept in memory before they are spilled to disk
+MEMORY_BUDGET = 256 * 2**20
+
+# forked workers inherit the preprocessing, so it does not need to be picklable
+START_METHOD = 'fork' if 'fork' in get_all_start_methods() else 'spawn'
+
+# bytes of a posting in memory: a term number, a document number, and a term frequency
+POSTING_SIZE = 12
+
+TokenizedChunk = Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+Run = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+_worker_preprocessing: Optional[DocPreprocessingBase] = None
+
+
+def _init_worker(preprocessing: DocPreprocessingBase):
+    global _worker_preprocessing
+    _worker_preprocessing = preprocessing
+
+
+def _tokenize_chunk(document_texts: List[str], preprocessing: Optional[DocPreprocessingBase] = None) -> TokenizedChunk:
+    preprocessing = _worker_preprocessing if preprocessing is None else preprocessing
+    # the terms of the chunk are numbered in the order of their first occurrence
+    local_vocabulary: Dict[str, int] = {}
+    document_lengths, indptr, term_ids, term_frequencies = [], [0], [], []
+    for document_text in document_texts:
+        tokens = preprocessing(document_text)
+        term_counts = Counter(tokens)
+        term_ids.extend(local_vocabulary.setdefault(term, len(local_vocabulary)) for term in term_counts)
+        term_frequencies.extend(term_counts.values())
+        document_lengths.append(len(tokens))
+        indptr.append(len(term_ids))
+    return (list(local_vocabulary), np.array(document_lengths, dtype=np.int64),
+            np.diff(np.array(indptr, dtype=np.int64)), np.array(term_ids, dtype=np.int64),
+            np.array(term_frequencies, dtype=np.int32))
+
+
+def _chunk(documents: Iterable[DocumentBase], chunk_size: int) -> Iterator[List[str]]:
+    documents = iter(documents)
+    while True:
+        chunk = [str(document) for document in islice(documents, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_inverted_index(documents: Iterable[DocumentBase], preprocessing: DocPreprocessingBase,
+                         vocabulary: Optional[Vocabulary] = None, num_workers: Optional[int] = None,
+                         memory_budget: int = MEMORY_BUDGET, temporary_directory: Optional[Union[str, Path]] = None,
+                         chunk_size: int = CHUNK_SIZE, start_method: str = START_METHOD,
+                         desc: str = 'Building the index') -> InvertedIndex:
+    """Build an inverted index with single-pass in-memory indexing (SPIMI).
+
+    The documents are tokenized in chunks by a pool of worker processes. The postings of the tokenized
+    chunks are collected in memory until they exceed the memory budget. Then, they are sorted by terms
+    and spilled to disk as a run. Finally, the runs are merged into the term-by-document matrix one at a time.
+    The resulting inverted index is identical to an :class:`InvertedIndex` of the preprocessed documents.
+
+    Parameters
+    ----------
+    documents: iterable of DocumentBase
+        The indexed documents.
+    preprocessing: DocPreprocessingBase
+        Type of preprocessing.
+    vocabulary: dict of (str, int), HashingVocabulary, or None
+        A mapping from terms to rows shared with other inverted indexes. New terms are added to the mapping.
+        If None, a new mapping is created.
+    num_workers: int or None
+        The number of worker processes. If None, all CPUs are used. If 1, or if all documents fit into
+        a single chunk, the documents are tokenized in the current process.
+    memory_budget: int
+        The number of bytes of postings kept in memory before they are spilled to disk.
+    temporary_directory: str, Path, or None
+        The directory of the spilled runs. If None, the default temporary directory is used.
+    chunk_size: int
+        The number of documents tokenized by a worker at once.
+    start_method: str
+        The start method of the worker processes. With the default 'fork' start method, the workers inherit
+        the preprocessing. With other start methods, the preprocessing must be picklable.
+    desc: str
+        The description of the progress bar.
+
+    Returns
+    -------
+    InvertedIndex
+        An inverted index of the documents.
+
+    """
+    vocabulary = {} if vocabulary is None else vocabulary
+    documents = list(documents) if not isinstance(documents, list) else documents
+    chunks = _chunk(documents, chunk_size)
+    num_workers = 1 if len(documents) <= chunk_size else num_workers
+
+    with TemporaryDirectory(dir=temporary_directory) as run_directory, \
+            tqdm(desc=desc, total=len(documents)) as progress_bar:
+        if num_workers == 1:
+            tokenized_chunks = map(partial(_tokenize_chunk, preprocessing=preprocessing), chunks)
+            runs, document_lengths = _invert(tokenized_chunks, vocabulary, memory_budget,
+                                             Path(run_directory), progress_bar)
+        else:
+            context = get_context(start_method)
+            with context.Pool(num_workers, initializer=_init_worker, initargs=(preprocessing,)) as pool:
+                runs, document_lengths = _invert(pool.imap(_tokenize_chunk, chunks), vocabulary, memory_budget,
+                                                 Path(run_directory), progress_bar)
+        term_frequencies = _merge_runs(runs, len(vocabulary), len(document_lengths))
+
+    return InvertedIndex.from_term_frequencies(term_frequencies, document_lengths, vocabulary)
+
+
+def _invert(tokenized_chunks: Iterable[TokenizedChunk], vocabulary: Vocabulary, memory_budget: int,
+            run_directory: Path, progress_bar: tqdm) -> Tuple[List[Tuple[Union[Path, Run], np.ndarray]], np.ndarray]:
+    runs: List[Tuple[Union[Path, Run], np.ndarray]] = []
+    document_lengths: List[np.ndarray] = []
+    term_ids: List[np.ndarray] = []
+    document_ids: List[np.ndarray] = []
+    term_frequencies: List[np.ndarray] = []
+    num_documents, num_postings = 0, 0
+
+    for terms, chunk_document_lengths, chunk_document_sizes, chunk_term_ids, chunk_term_frequencies in \
+            tokenized_chunks:
+        global_term_ids = np.fromiter((vocabulary.setdefault(term, len(vocabulary)) for term in terms),
+                                      dtype=np.int32, count=len(terms))
+        term_ids.append(global_term_ids[chunk_term_ids])
+        document_ids.append(np.repeat(np.arange(num_documents, num_documents + len(chunk_document_lengths),
+                                                dtype=np.int32), chunk_document_sizes))
+        term_frequencies.append(chunk_term_frequencies)
+        document_lengths.append(chunk_document_lengths)
+        num_documents += len(chunk_document_lengths)
+        num_postings += len(chunk_term_ids)
+        progress_bar.update(len(chunk_document_lengths))
+
+        if num_postings * POSTING_SIZE > memory_budget:
+            run = _sort_run(term_ids, document_ids, term_frequencies)
+            run_filename = run_directory / 'run-{}.npz'.format(len(runs))
+            np.savez(run_filename, term_ids=run[0], document_ids=run[1], term_frequencies=run[2])
+            runs.append((run_filename, np.bincount(run[0], minlength=len(vocabulary))))
+            del run
+            term_ids, document_ids, term_frequencies, num_postings = [], [], [], 0
+
+    if num_postings > 0 or not runs:
+        run = _sort_run(term_ids, document_ids, term_frequencies)
+        runs.append((run, np.bincount(run[0], minlength=len(vocabulary))))
+
+    document_lengths = np.concatenate([np.zeros(0, dtype=np.int64)] + document_lengths)
+    return runs, document_lengths
+
+
+def _sort_run(term_ids: List[np.ndarray], document_ids: List[np.ndarray], term_frequencies: List[np.ndarray]) -> Run:
+    # the documents are numbered in ascending order, so a stable sort by terms keeps the postings sorted by documents
+    term_ids = np.concatenate([np.zeros(0, dtype=np.int32)] + term_ids)
+    ordering = np.argsort(term_ids, kind='stable')
+    document_ids = np.concatenate([np.zeros(0, dtype=np.int32)] + document_ids)
+    term_frequencies = np.concatenate([np.zeros(0, dtype=np.int32)] + term_frequencies)
+    return term_ids[ordering], document_ids[ordering], term_frequencies[ordering]
+
+
+def _load_run(run: Union[Path, Run]) -> Run:
+    if isinstance(run, Path):
+        with np.load(run) as arrays:
+            return arrays['term_ids'], arrays['document_ids'], arrays['term_frequencies']
+    return run
+
+
+def _merge_runs(runs: List[Tuple[Union[Path, Run], np.ndarray]], num_terms: int, num_documents: int) -> csr_matrix:
+    # the runs cover consecutive ranges of documents, so the postings of each term are the postings
+    # of the term in the first run followed by the postings of the term in the following runs
+    run_term_counts = [np.pad(term_counts, (0, num_terms - len(term_counts))) for _, term_counts in runs]
+    indptr = np.concatenate([[0], np.cumsum(np.sum(run_term_counts, axis=0))]).astype(np.int64)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data = np.empty(indptr[-1], dtype=np.int32)
+
+    next_positions = indptr[:-1].copy()
+    for (run, _), term_counts in zip(runs, run_term_counts):
+        term_ids, document_ids, term_frequencies = _load_run(run)
+        run_indptr = np.concatenate([[0], np.cumsum(term_counts)])
+        destinations = np.repeat(next_positions - run_indptr[:-1], term_counts) + np.arange(len(term_ids))
+        indices[destinations] = document_ids
+        data[destinations] = term_frequencies
+        next_positions += term_counts
+
+    term_frequencies = csr_matrix((data, indices, indptr), shape=(num_terms, num_documents))
+    # terms that share a row of a hashing vocabulary
+    term_frequencies.sum_duplicates()
+    return term_frequencies
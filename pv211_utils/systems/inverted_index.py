@@ -0,0 +1,279 @@
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix, hstack
+
+from ..storage.shards import ShardStore
+
+
+# number of buckets of a hashing vocabulary
+NUM_BUCKETS = 2**20
+
+
+class HashingVocabulary:
+    """
+    A vocabulary that maps terms to a fixed number of rows with feature hashing instead of storing the terms.
+
+    The vocabulary can replace the dict of an :class:`InvertedIndex`. Its memory does not grow with the number
+    of distinct terms and the documents can be indexed without a global mapping, at the cost of terms that
+    share a row. The terms are hashed with CRC-32, which is stable across processes.
+
+    Parameters
+    ----------
+    num_buckets: int
+        The number of rows that the terms are hashed to.
+
+    Attributes
+    ----------
+    num_buckets: int
+        The number of rows that the terms are hashed to.
+
+    """
+
+    def __init__(self, num_buckets: int = NUM_BUCKETS):
+        if num_buckets < 1:
+            raise ValueError('The number of buckets must be positive, got {}'.format(num_buckets))
+        self.num_buckets = num_buckets
+
+    def __len__(self) -> int:
+        return self.num_buckets
+
+    def __contains__(self, term: str) -> bool:
+        return True
+
+    def __getitem__(self, term: str) -> int:
+        return zlib.crc32(term.encode('utf-8')) % self.num_buckets
+
+    def get(self, term: str, default: Optional[int] = None) -> int:
+        return self[term]
+
+    def setdefault(self, term: str, default: Optional[int] = None) -> int:
+        return self[term]
+
+
+Vocabulary = Union[Dict[str, int], HashingVocabulary]
+
+
+class InvertedIndex:
+    """
+    A term-by-document matrix of term frequencies in the compressed sparse row (CSR) format.
+
+    Each row of the matrix is the posting list of a single term: the column indices of the row are
+    the numbers of the documents that contain the term and the values are the term frequencies.
+
+    Parameters
+    ----------
+    corpus: iterable of list of str
+        Tokenized documents.
+    vocabulary: dict of (str, int), HashingVocabulary, or None
+        A mapping from terms to rows shared with other inverted indexes, such as the segments of
+        a :class:`~pv211_utils.systems.segments.SegmentedCorpus`. New terms are added to the mapping.
+        If None, a new mapping is created.
+
+    Attributes
+    ----------
+    vocabulary: dict of (str, int) or HashingVocabulary
+        A mapping from terms to rows of the term-by-document matrix.
+    term_frequencies: csr_matrix
+        The term-by-document matrix of term frequencies.
+    document_lengths: np.ndarray
+        The number of tokens in each document.
+    document_frequencies: np.ndarray
+        The number of documents that contain each term.
+
+    """
+
+    def __init__(self, corpus: Iterable[List[str]], vocabulary: Optional[Vocabulary] = None):
+        vocabulary = {} if vocabulary is None else vocabulary
+        indptr, indices, data = [0], [], []
+
+        for document in corpus:
+            term_counts = Counter(document)
+            indices.extend(vocabulary.setdefault(term, len(vocabulary)) for term in term_counts)
+            data.extend(term_counts.values())
+            indptr.append(len(indices))
+
+        document_by_term = csr_matrix(
+            (np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(indptr) - 1, len(vocabulary)))
+        # terms that share a row of a hashing vocabulary
+        document_by_term.sum_duplicates()
+
+        self.vocabulary = vocabulary
+        self.term_frequencies = document_by_term.T.tocsr()
+        self.term_frequencies.sort_indices()
+        self.document_lengths = np.asarray(document_by_term.sum(axis=1), dtype=np.int64).ravel()
+        self.document_frequencies = np.diff(self.term_frequencies.indptr)
+
+    @property
+    def num_documents(self) -> int:
+        return self.term_frequencies.shape[1]
+
+    @property
+    def num_terms(self) -> int:
+        return self.term_frequencies.shape[0]
+
+    @classmethod
+    def merge(cls, inverted_indexes: Sequence['InvertedIndex'], masks: Sequence[np.ndarray]) -> 'InvertedIndex':
+        """Merge inverted indexes with a shared vocabulary without tokenizing the documents again.
+
+        Parameters
+        ----------
+        inverted_indexes: sequence of InvertedIndex
+            Inverted indexes that share their vocabulary.
+        masks: sequence of np.ndarray
+            Boolean masks of the documents of each inverted index that are kept.
+
+        Returns
+        -------
+        InvertedIndex
+            An inverted index of the kept documents in the order of the inverted indexes.
+
+        """
+        num_terms = max(inverted_index.num_terms for inverted_index in inverted_indexes)
+        term_frequencies = hstack([
+            inverted_index.get_term_frequencies(num_terms)[:, mask]
+            for inverted_index, mask in zip(inverted_indexes, masks)], format='csr', dtype=np.int32)
+        term_frequencies.sort_indices()
+        document_lengths = np.concatenate([
+            inverted_index.document_lengths[mask] for inverted_index, mask in zip(inverted_indexes, masks)])
+        return cls.from_term_frequencies(term_frequencies, document_lengths, inverted_indexes[0].vocabulary)
+
+    @classmethod
+    def from_term_frequencies(cls, term_frequencies: csr_matrix, document_lengths: np.ndarray,
+                              vocabulary: Vocabulary) -> 'InvertedIndex':
+        """An inverted index of documents that have already been inverted.
+
+        Parameters
+        ----------
+        term_frequencies: csr_matrix
+            The term-by-document matrix of term frequencies with sorted indices.
+        document_lengths: np.ndarray
+            The number of tokens in each document.
+        vocabulary: dict of (str, int) or HashingVocabulary
+            A mapping from terms to rows of the term-by-document matrix.
+
+        Returns
+        -------
+        InvertedIndex
+            The inverted index.
+
+        """
+        inverted_index = cls.__new__(cls)
+        inverted_index.vocabulary = vocabulary
+        inverted_index.term_frequencies = term_frequencies
+        inverted_index.document_lengths = document_lengths
+        inverted_index.document_frequencies = np.diff(term_frequencies.indptr)
+        return inverted_index
+
+    def store(self, shard_store: ShardStore) -> 'InvertedIndex':
+        """Move the term frequencies to disk.
+
+        Parameters
+        ----------
+        shard_store: ShardStore
+            The store of the term frequencies.
+
+        Returns
+        -------
+        InvertedIndex
+            An inverted index whose term frequencies are backed by memory-mapped files.
+
+        """
+        return InvertedIndex.from_term_frequencies(shard_store.store_matrix(self.term_frequencies),
+                                                   self.document_lengths, self.vocabulary)
+
+    def get_term_frequencies(self, num_terms: int) -> csr_matrix:
+        """The term-by-document matrix of term frequencies with empty rows for terms added to a shared vocabulary.
+
+        Parameters
+        ----------
+        num_terms: int
+            The number of rows of the matrix, at least :attr:`num_terms`.
+
+        Returns
+        -------
+        csr_matrix
+            The term-by-document matrix of term frequencies.
+
+        """
+        if num_terms == self.num_terms:
+            return self.term_frequencies
+        indptr = self.term_frequencies.indptr
+        indptr = np.concatenate([indptr, np.full(num_terms - self.num_terms, indptr[-1], dtype=indptr.dtype)])
+        return csr_matrix((self.term_frequencies.data, self.term_frequencies.indices, indptr),
+                          shape=(num_terms, self.num_documents))
+
+    def query_vector(self, query: List[str], num_terms: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """The terms of a tokenized query that occur in the vocabulary.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+        num_terms: int or None
+            Only terms in the first num_terms rows are kept, which excludes terms added to a shared
+            vocabulary later. If None, :attr:`num_terms` is used.
+
+        Returns
+        -------
+        tuple of (np.ndarray, np.ndarray)
+            The rows of the query terms in the term-by-document matrix and the number of times each term
+            occurs in the query.
+
+        """
+        num_terms = self.num_terms if num_terms is None else num_terms
+        term_counts = Counter(self.vocabulary[term] for term in query
+                              if self.vocabulary.get(term, num_terms) < num_terms)
+        term_ids = np.fromiter(term_counts.keys(), dtype=np.int64, count=len(term_counts))
+        counts = np.fromiter(term_counts.values(), dtype=np.float64, count=len(term_counts))
+        return term_ids, counts
+
+
+class CorpusStatistics:
+    """
+    Statistics of the documents of one or more inverted indexes that share their vocabulary.
+
+    Parameters
+    ----------
+    inverted_indexes: sequence of InvertedIndex
+        Inverted indexes that share their vocabulary.
+    masks: sequence of np.ndarray or None
+        Boolean masks of the documents of each inverted index that are counted. If None, all documents
+        are counted.
+
+    Attributes
+    ----------
+    num_documents: int
+        The number of counted documents.
+    average_document_length: float
+        The average number of tokens in a counted document.
+    document_frequencies: np.ndarray
+        The number of counted documents that contain each term.
+
+    """
+
+    def __init__(self, inverted_indexes: Sequence[InvertedIndex], masks: Optional[Sequence[np.ndarray]] = None):
+        num_terms = max(inverted_index.num_terms for inverted_index in inverted_indexes)
+        num_documents, total_document_length = 0, 0
+        document_frequencies = np.zeros(num_terms, dtype=np.int64)
+
+        for number, inverted_index in enumerate(inverted_indexes):
+            term_frequencies = inverted_index.term_frequencies
+            if masks is None or masks[number].all():
+                num_documents += inverted_index.num_documents
+                total_document_length += inverted_index.document_lengths.sum()
+                document_frequencies[:inverted_index.num_terms] += inverted_index.document_frequencies
+            else:
+                mask = masks[number]
+                num_documents += mask.sum()
+                total_document_length += inverted_index.document_lengths[mask].sum()
+                # count the kept postings of each term as differences of a cumulative sum at the row boundaries
+                kept_postings = np.concatenate([[0], np.cumsum(mask[term_frequencies.indices])])
+                document_frequencies[:inverted_index.num_terms] += np.diff(kept_postings[term_frequencies.indptr])
+
+        self.num_documents = int(num_documents)
+        self.average_document_length = total_document_length / num_documents if num_documents > 0 else 1.0
+        self.document_frequencies = document_frequencies
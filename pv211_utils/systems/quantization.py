@@ -0,0 +1,40 @@
+import copy
+from typing import TypeVar
+
+import torch
+from torch.ao.nn.quantized.dynamic import Linear as QuantizedLinear
+
+
+# suffix of the names of quantized models, which keeps their embeddings and scores apart in stores and caches
+QUANTIZED_MODEL_SUFFIX = '+qint8'
+
+Model = TypeVar('Model', bound=torch.nn.Module)
+
+
+def quantize_model(model: Model) -> Model:
+    """A copy of a model for CPU inference whose linear layers are dynamically quantized to int8.
+
+    The weights of the linear layers are stored in int8 and the activations are quantized to int8 on the fly,
+    which speeds up transformers such as sentence transformers and cross-encoders on CPUs at the cost of
+    slightly different embeddings and scores. The model itself is not changed.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        A model, such as a SentenceTransformer or a CrossEncoder.
+
+    Returns
+    -------
+    torch.nn.Module
+        A quantized copy of the model on the CPU.
+
+    """
+    quantized_model = copy.deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(quantized_model, {torch.nn.Linear}, dtype=torch.qint8,
+                                                  inplace=True)
+
+
+def is_quantized(model: torch.nn.Module) -> bool:
+    """Whether a model contains dynamically quantized linear layers."""
+    return isinstance(model, torch.nn.Module) and any(isinstance(module, QuantizedLinear)
+                                                      for module in model.modules())
@@ -1,9 +1,15 @@
-from typing import Iterable, OrderedDict
+from itertools import islice
+from typing import Iterable, List, Optional, OrderedDict, Sequence, Tuple
+import numpy as np
 from sklearn.preprocessing import normalize
 import torch
 from ..entities import DocumentBase, QueryBase
 from ..irsystem import IRSystemBase
-from ..databases.base_vector_db import BaseVectorDB
+from ..databases.base_vector_db import BaseVectorDB, RemovableVectorDB
+from .embeddings import EmbeddingStore, QueryEmbeddingCache, get_model_name
+from .quantization import quantize_model
+from .reranking import MAX_CACHED_TOKENS, PretokenizedCrossEncoder, RerankScheduler, ScoreCache
+from .segments import CorpusSnapshot, SegmentedCorpus
 from sentence_transformers import CrossEncoder
 from sentence_transformers.SentenceTransformer import SentenceTransformer
 
@@ -18,44 +24,179 @@ class RankerSystem(IRSystemBase):
         no_reranks: int = 12,
         retriever_batch_size: int = 32,
         reranker_batch_size: int = 16,
-        no_returns: int = 100
+        no_returns: int = 100,
+        embedding_store: Optional[EmbeddingStore] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        score_cache: Optional[ScoreCache] = None,
+        max_rerank_delay: float = 0.0,
+        max_cached_tokens: int = MAX_CACHED_TOKENS,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        index_answers: bool = True
     ):
         """
         A hybrid ranking system that uses dense retrieval followed by cross-encoder reranking
         to return the most relevant documents from a set of answer candidates.
 
+        Answers can be added with :meth:`add_documents` without encoding the other answers again. If the vector
+        database supports removing embeddings, answers can also be removed with :meth:`remove_documents`.
+
         Args:
             retriever (SentenceTransformer): Model to encode queries and documents into dense vectors.
             reranker (CrossEncoder): Cross-encoder model to rerank top documents using deep pairwise scoring.
-            vector_db (BaseVectorDB): Database that supports vector similarity search.
+            vector_db (BaseVectorDB): Database that supports vector similarity search. Answers can only be removed
+                or replaced with a :class:`RemovableVectorDB`.
             answers (OrderedDict[str, DocumentBase]): Ordered mapping of answer IDs to documents to be indexed.
             no_reranks (int): Number of top retrieved documents to rerank using the cross-encoder.
             retriever_batch_size (int): Batch size to use during initial embedding of documents.
             reranker_batch_size (int): Batch size to use when scoring pairs with the cross-encoder.
             no_returns (int): Maximum number of documents to retrieve from the vector store per query.
+            embedding_store (Optional[EmbeddingStore]): If given, the embeddings of the answers are reused from
+                the store and only the answers that are not in the store are encoded.
+            query_cache (Optional[QueryEmbeddingCache]): If given, the embeddings of the queries are reused from
+                the cache, which can be shared with other systems.
+            score_cache (Optional[ScoreCache]): If given, the cross-encoder scores of (query, answer) pairs are reused
+                from the cache and only the pairs that are not in the cache are scored.
+            max_rerank_delay (float): Number of seconds for which the pairs of a query wait for the pairs of
+                concurrent queries when there are not enough pairs for a full batch of the cross-encoder.
+            max_cached_tokens (int): Maximum number of tokens of the answers that are tokenized once and kept for
+                the cross-encoder.
+            quantize (bool): If True, the models run on the CPU as copies whose linear layers are dynamically
+                quantized to int8, see :func:`quantize_model`.
+            num_threads (Optional[int]): If given, the number of threads that PyTorch uses for intra-op
+                parallelism on the CPU. The number is set for the whole process.
+            index_answers (bool): If False, the vector database already contains the embeddings of the answers in
+                their order, such as a database saved by a previous run and loaded with
+                :meth:`PersistentVectorDB.load`, so that the answers are not encoded again.
         """
-        self.retriever = retriever.eval()
-        self.reranker = reranker
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        self.retriever = (quantize_model(retriever) if quantize else retriever).eval()
+        self.reranker = quantize_model(reranker) if quantize else reranker
         self.vector_db = vector_db
+        self.retriever_batch_size = retriever_batch_size
         self.reranker_batch_size = reranker_batch_size
-        self.no_reranks = no_reranks if len(answers) > no_reranks else len(answers)
-        self.no_returns = no_returns if len(answers) > no_returns else len(answers)
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.no_reranks = no_reranks
+        self.no_returns = no_returns
+        self.embedding_store = embedding_store
+        self.query_cache = query_cache
+        self.score_cache = score_cache
+
+        # answers are tokenized once for all queries, so that only the queries are tokenized when reranking
+        self.pretokenized_reranker = PretokenizedCrossEncoder(self.reranker, max_cached_tokens)
+
+        # pairs of concurrent queries are reranked together in full batches of pairs with similar lengths
+        self.rerank_scheduler = RerankScheduler(self._predict_pairs, reranker_batch_size, max_rerank_delay)
+        self.device = torch.device("cuda" if torch.cuda.is_available() and not quantize else "cpu")
 
-        self.answers = list(answers.values())
-        answer_texts = [str(answer) for answer in self.answers]
+        self._answers_indexed = not index_answers
+
+        # the vector database is shared with readers, so it is only compacted under the writer lock
+        self.corpus: SegmentedCorpus[None] = SegmentedCorpus(
+            answers, self._add_answers, self._remove_embeddings, exclusive_compaction=True)
+
+    def _add_answers(self, answers: List[DocumentBase]) -> None:
+        if self._answers_indexed:
+            # the initial answers are already in the vector database
+            self._answers_indexed = False
+            if hasattr(self.vector_db, '__len__') and len(self.vector_db) != len(answers):
+                raise ValueError('The vector database contains {} embeddings, expected {}'.format(
+                    len(self.vector_db), len(answers)))
+            return
 
         # Encode and normalize all answer documents for efficient cosine similarity search
+        if self.embedding_store is None:
+            answer_embeddings = self._encode_texts([str(answer) for answer in answers])
+        else:
+            answer_embeddings = self.embedding_store.get_embeddings(
+                get_model_name(self.retriever), answers, self._encode_texts)
+
+        answer_embeddings = normalize(answer_embeddings, axis=1)
+        self.vector_db.add(answer_embeddings)
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
         with torch.no_grad():
-            answer_embeddings = self.retriever.encode(
-                answer_texts,
+            return self.retriever.encode(
+                texts,
                 convert_to_tensor=True,
-                batch_size=retriever_batch_size,
+                batch_size=self.retriever_batch_size,
                 device=self.device
             ).cpu().numpy()
 
-        answer_embeddings = normalize(answer_embeddings, axis=1)
-        self.vector_db.add(answer_embeddings)
+    def _encode_queries(self, query_texts: List[str]) -> np.ndarray:
+        if self.query_cache is None:
+            return self._encode_query_texts(query_texts)
+        return self.query_cache.get_embeddings(get_model_name(self.retriever), query_texts, self._encode_query_texts)
+
+    def _encode_query_texts(self, query_texts: List[str]) -> np.ndarray:
+        with torch.no_grad():
+            return self.retriever.encode(
+                query_texts,
+                convert_to_numpy=True,
+                batch_size=self.retriever_batch_size,
+                device=self.device
+            )
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        if self.score_cache is None:
+            return self.rerank_scheduler.get_scores(pairs)
+        return self.score_cache.get_scores(get_model_name(self.reranker), pairs, self.rerank_scheduler.get_scores)
+
+    def _predict_pairs(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        return self.pretokenized_reranker.predict(pairs, batch_size=self.reranker_batch_size)
+
+    def _remove_embeddings(self, segments: Sequence[None], masks: Sequence[np.ndarray]) -> None:
+        removed_positions = np.flatnonzero(~np.concatenate(masks))
+        if len(removed_positions) > 0:
+            self.vector_db.remove(removed_positions.tolist())
+
+    @property
+    def answers(self) -> List[DocumentBase]:
+        """The indexed answers that have not been removed."""
+        return self.corpus.snapshot.live_documents
+
+    def add_documents(self, answers: OrderedDict[str, DocumentBase]):
+        """
+        Encodes new answers and adds them to the vector database without encoding the existing answers again.
+        Answers with the identifiers of indexed answers replace the indexed answers.
+
+        Args:
+            answers (OrderedDict[str, DocumentBase]): Ordered mapping of answer IDs to added documents.
+        """
+        if any(answer_id in self.corpus for answer_id in answers):
+            self._require_removal()
+        self.corpus.add(answers)
+
+    def remove_documents(self, answer_ids: Iterable[str]):
+        """
+        Removes answers. The embeddings stay in the vector database until the next compaction of the corpus,
+        and they are skipped during the search.
+
+        Args:
+            answer_ids (Iterable[str]): IDs of the removed answers.
+        """
+        self._require_removal()
+        self.corpus.remove(answer_ids)
+
+    def _require_removal(self):
+        if not isinstance(self.vector_db, RemovableVectorDB) or not self.vector_db.supports_removal:
+            raise NotImplementedError(
+                '{} does not support removing embeddings'.format(type(self.vector_db).__name__))
+
+    def _retrieve(self, query_embeddings: np.ndarray) -> Tuple[CorpusSnapshot[None], List[List[int]]]:
+        # the positions in the vector database match the positions in the snapshot taken under the writer lock
+        with self.corpus.lock:
+            snapshot = self.corpus.snapshot
+            top_k = min(len(snapshot.removed), self.no_returns + snapshot.num_removed)
+            _, positions = self.vector_db.search_batch(query_embeddings, top_k=top_k)
+            retrieved_positions = [query_positions[query_positions >= 0].tolist() for query_positions in positions]
+
+        retrieved_positions = [
+            [position for position in query_positions if not snapshot.removed[position]][:self.no_returns]
+            for query_positions in retrieved_positions
+        ]
+        return snapshot, retrieved_positions
 
     def search(self, query: QueryBase) -> Iterable[DocumentBase]:
         """
@@ -67,34 +208,65 @@ class RankerSystem(IRSystemBase):
         Yields:
             DocumentBase: Ranked answer documents.
         """
-        with torch.no_grad():
-            query_embedding = self.retriever.encode(
-                str(query),
-                convert_to_numpy=True,
-                device=self.device
-            )
-
-        query_embedding = normalize(query_embedding.reshape(1, -1), axis=1)
+        query_embedding = normalize(self._encode_queries([str(query)]), axis=1)
 
-        retrieved_indices = self.vector_db.search(
-            query_embedding[0],
-            top_k=min(len(self.answers), self.no_returns)
-        )
+        snapshot, (retrieved_indices,) = self._retrieve(query_embedding)
 
         rerank_indices = retrieved_indices[:self.no_reranks]
-        rerank_docs = [str(self.answers[i]) for i in rerank_indices]
+        rerank_docs = [str(snapshot.get_document(i)) for i in rerank_indices]
         rerank_pairs = [(str(query), doc) for doc in rerank_docs]
 
-        scores = self.reranker.predict(rerank_pairs, batch_size=self.reranker_batch_size)
-        reranked = sorted(zip(rerank_indices, scores), key=lambda x: x[1], reverse=True)
+        scores = self._predict(rerank_pairs) if rerank_pairs else []
+
+        yield from self._rerank(snapshot, retrieved_indices, scores)
+
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """
+        Performs dense retrieval and reranking for several queries at once. The queries are encoded in a single
+        batch and the retrieved documents of all queries are reranked in a single call of the cross-encoder.
+
+        Args:
+            queries (Iterable[QueryBase]): The user queries to search against the stored answers.
+            k (Optional[int]): Number of top documents to return for each query. If None, all documents are returned.
+
+        Returns:
+            List[Iterable[DocumentBase]]: Ranked answer documents for each query.
+        """
+        query_texts = [str(query) for query in queries]
+        if not query_texts:
+            return []
+
+        query_embeddings = normalize(self._encode_queries(query_texts), axis=1)
+
+        snapshot, retrieved_indices = self._retrieve(query_embeddings)
+
+        rerank_pairs = [
+            (query_text, str(snapshot.get_document(i)))
+            for query_text, query_indices in zip(query_texts, retrieved_indices)
+            for i in query_indices[:self.no_reranks]
+        ]
+        scores = self._predict(rerank_pairs) if rerank_pairs else []
+
+        results = []
+        offset = 0
+        for query_indices in retrieved_indices:
+            num_reranks = len(query_indices[:self.no_reranks])
+            result = self._rerank(snapshot, query_indices, scores[offset:offset + num_reranks])
+            results.append(list(islice(result, k)) if k is not None else result)
+            offset += num_reranks
+        return results
+
+    def _rerank(self, snapshot: CorpusSnapshot[None], retrieved_indices: List[int],
+                scores: Iterable[float]) -> Iterable[DocumentBase]:
+        reranked = sorted(zip(retrieved_indices[:self.no_reranks], scores), key=lambda x: x[1], reverse=True)
 
         for idx, _ in reranked:
-            yield self.answers[idx]
+            yield snapshot.get_document(idx)
 
         for idx in retrieved_indices[self.no_reranks:]:
-            yield self.answers[idx]
+            yield snapshot.get_document(idx)
 
         seen = set(retrieved_indices)
-        for idx in range(len(self.answers)):
+        for idx in snapshot.live_positions.tolist():
             if idx not in seen:
-                yield self.answers[idx]
+                yield snapshot.get_document(idx)
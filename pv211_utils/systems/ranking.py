@@ -0,0 +1,147 @@
+from itertools import islice
+from typing import Iterable, Iterator, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from ..entities import DocumentBase
+
+
+def rank_lazily(scores: np.ndarray, block_size: int = 100) -> Iterator[int]:
+    """Yield the positions of scores in descending order of the scores.
+
+    Instead of sorting all scores upfront, the highest scores are selected block by block in linear time
+    and only the selected block is sorted. Further blocks, each twice as large as the previous one, are
+    selected only when the consumer keeps iterating. A consumer that stops after the first k positions
+    therefore pays O(N + k log k) instead of O(N log N). Ties are broken by ascending position.
+    NaN scores rank as -inf, so that every position is yielded.
+
+    Parameters
+    ----------
+    scores: np.ndarray
+        A one-dimensional array of scores.
+    block_size: int
+        The number of positions in the first block.
+
+    Yields
+    ------
+    int
+        Positions of scores in descending order of the scores.
+
+    """
+    scores = np.asarray(scores)
+    if np.issubdtype(scores.dtype, np.floating) and np.isnan(scores).any():
+        # NaN compares false with every score and would never be selected into a block
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+    remaining = np.arange(len(scores))
+    block_size = max(block_size, 1)
+
+    while len(remaining) > 0:
+        if len(remaining) > block_size:
+            remaining_scores = scores[remaining]
+            threshold = -np.partition(-remaining_scores, block_size - 1)[block_size - 1]
+            # split the positions tied with the lowest selected score by ascending position
+            tied = np.sort(remaining[remaining_scores == threshold])
+            above = remaining[remaining_scores > threshold]
+            below = remaining[remaining_scores < threshold]
+            num_tied = block_size - len(above)
+            block = np.concatenate([above, tied[:num_tied]])
+            remaining = np.concatenate([tied[num_tied:], below])
+        else:
+            block, remaining = remaining, remaining[:0]
+        block = block[np.lexsort((block, -scores[block]))]
+        yield from block.tolist()
+        block_size *= 2
+
+
+def rank_sparse_lazily(positions: np.ndarray, scores: np.ndarray, num_positions: int,
+                       block_size: int = 100) -> Iterator[int]:
+    """Yield positions in descending order of sparse non-negative scores.
+
+    Only the listed positions are ranked. The positions that are not listed or whose scores are zero
+    follow in ascending order, which is their order in :func:`rank_lazily` of the dense scores.
+    A consumer that stops after the first k positions therefore pays O(n + k log k) for n listed
+    positions, independently of the number of all positions.
+
+    Parameters
+    ----------
+    positions: np.ndarray
+        Distinct positions with scores, in any order.
+    scores: np.ndarray
+        The non-negative scores of the positions.
+    num_positions: int
+        The number of all positions.
+    block_size: int
+        The number of positions in the first block of :func:`rank_lazily`.
+
+    Yields
+    ------
+    int
+        Positions in descending order of the scores.
+
+    """
+    positions, scores = np.asarray(positions), np.asarray(scores)
+    positive = scores > 0
+    positions, scores = positions[positive], scores[positive]
+    ordering = np.argsort(positions, kind='stable')
+    positions, scores = positions[ordering], scores[ordering]
+
+    for number in rank_lazily(scores, block_size):
+        yield int(positions[number])
+
+    ranked = np.zeros(num_positions, dtype=bool)
+    ranked[positions] = True
+    yield from np.flatnonzero(~ranked).tolist()
+
+
+def rank_documents(scores: np.ndarray, documents: Union[Sequence[DocumentBase], Mapping[int, DocumentBase]],
+                   k: Optional[int] = None) -> Iterable[DocumentBase]:
+    """Rank documents in descending order of their scores.
+
+    Parameters
+    ----------
+    scores: np.ndarray
+        A one-dimensional array with the score of each document.
+    documents: sequence of DocumentBase or dict of (int, DocumentBase)
+        Documents indexed by their positions in scores.
+    k: int or None
+        The number of top documents to return. If None, all documents are lazily ranked.
+
+    Returns
+    -------
+    iterable of DocumentBase
+        The documents in descending order of their scores, and documents with equal scores in ascending
+        order of their positions. If k is not None, the top k documents are returned as a list, so that
+        the scores do not need to be kept around.
+
+    """
+    ranking = (documents[position] for position in islice(rank_lazily(scores, k or 100), k))
+    return list(ranking) if k is not None else ranking
+
+
+def rank_sparse_documents(positions: np.ndarray, scores: np.ndarray,
+                          documents: Union[Sequence[DocumentBase], Mapping[int, DocumentBase]],
+                          k: Optional[int] = None) -> Iterable[DocumentBase]:
+    """Rank documents in descending order of their sparse non-negative scores.
+
+    Parameters
+    ----------
+    positions: np.ndarray
+        Distinct positions of documents with scores, in any order.
+    scores: np.ndarray
+        The non-negative scores of the documents. The documents at the other positions score zero.
+    documents: sequence of DocumentBase or dict of (int, DocumentBase)
+        Documents indexed by their positions.
+    k: int or None
+        The number of top documents to return. If None, all documents are lazily ranked.
+
+    Returns
+    -------
+    iterable of DocumentBase
+        The documents in descending order of their scores, and documents with equal scores in ascending
+        order of their positions. If k is not None, the top k documents are returned as a list, so that
+        the scores do not need to be kept around.
+
+    """
+    ranking = (documents[position]
+               for position in islice(rank_sparse_lazily(positions, scores, len(documents), k or 100), k))
+    return list(ranking) if k is not None else ranking
@@ -1,4 +1,5 @@
-from typing import Iterable, OrderedDict
+from itertools import islice
+from typing import Iterable, List, Optional, OrderedDict, Tuple
 
 import numpy as np
 import torch
@@ -7,11 +8,22 @@ from sentence_transformers.SentenceTransformer import SentenceTransformer
 
 from ..entities import DocumentBase, QueryBase
 from ..irsystem import IRSystemBase
+from ..storage.compression import RESCORING_DEPTH, CompressedEmbeddings, EmbeddingCompressor, rank_rescored_first
+from ..storage.shards import ShardStore
+from .embeddings import EmbeddingStore, QueryEmbeddingCache, get_model_name, normalize_embeddings
+from .quantization import quantize_model
+from .ranking import rank_lazily
+from .reranking import MAX_CACHED_TOKENS, PretokenizedCrossEncoder, RerankScheduler, ScoreCache
 
 
 class RerankerSystem(IRSystemBase):
     def __init__(self, retriever: SentenceTransformer, reranker: CrossEncoder, answers: OrderedDict,
-                 no_reranks: int = 16, retriever_batch_size: int = 32, reranker_batch_size: int = 8):
+                 no_reranks: int = 16, retriever_batch_size: int = 32, reranker_batch_size: int = 8,
+                 embedding_store: Optional[EmbeddingStore] = None, query_cache: Optional[QueryEmbeddingCache] = None,
+                 score_cache: Optional[ScoreCache] = None, max_rerank_delay: float = 0.0,
+                 max_cached_tokens: int = MAX_CACHED_TOKENS, compression: Optional[str] = None,
+                 num_components: Optional[int] = None, rescoring_depth: int = RESCORING_DEPTH,
+                 shard_directory: Optional[str] = None, quantize: bool = False, num_threads: Optional[int] = None):
         """
         A system that returns documents ordered by decreasing cosine similarity.
 
@@ -29,59 +41,183 @@ class RerankerSystem(IRSystemBase):
             The retriever batch size for encoding
         reranker_batch_size: int
             The reranker batch size for prediction
+        embedding_store: EmbeddingStore or None
+            If not None, the embeddings of the answers are reused from the store and only the answers
+            that are not in the store are encoded.
+        query_cache: QueryEmbeddingCache or None
+            If not None, the embeddings of the queries are reused from the cache, which can be shared
+            with other systems.
+        score_cache: ScoreCache or None
+            If not None, the reranker scores of (query, answer) pairs are reused from the cache and only the pairs
+            that are not in the cache are scored.
+        max_rerank_delay: float
+            The number of seconds for which the pairs of a query wait for the pairs of concurrent queries
+            when there are not enough pairs for a full batch of the reranker.
+        max_cached_tokens: int
+            The maximum number of tokens of the answers that are tokenized once and kept for the reranker.
+        compression: str or None
+            If not None, the embeddings of the answers are kept in memory compressed to 'float16', 'int8'
+            or 'pca', see :class:`EmbeddingCompressor`.
+        num_components: int or None
+            The number of principal components of the 'pca' compression.
+        rescoring_depth: int
+            The number of top answers of each query whose similarities are recomputed from the float32
+            embeddings, which are kept on disk and memory-mapped. With zero, the float32 embeddings are not kept
+            and all similarities are approximate. With the 'pca' compression, they are the dot products of the
+            projections to the principal components.
+        shard_directory: str or None
+            The parent directory of the float32 embeddings of compressed answers. If None, the default
+            temporary directory is used.
+        quantize: bool
+            If True, the retriever and the reranker run on the CPU as copies of the models whose linear layers
+            are dynamically quantized to int8, see :func:`quantize_model`.
+        num_threads: int or None
+            If not None, the number of threads that PyTorch uses for intra-op parallelism on the CPU. The number
+            is set for the whole process.
         """
 
-        answers_bodies = [str(answer) for _, answer in answers.items()]
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
 
         self.answers = list(answers.values())
 
+        self.retriever_batch_size = retriever_batch_size
         self.reranker_batch_size = reranker_batch_size
         self.no_reranks = no_reranks if len(answers) > no_reranks else len(answers)
 
-        self.retriever = retriever
+        self.retriever = quantize_model(retriever) if quantize else retriever
         self.retriever.eval()
 
-        self.reranker = reranker
+        self.reranker = quantize_model(reranker) if quantize else reranker
+        self.embedding_store = embedding_store
+        self.query_cache = query_cache
+        self.score_cache = score_cache
 
+        # answers are tokenized once for all queries, so that only the queries are tokenized when reranking
+        self.pretokenized_reranker = PretokenizedCrossEncoder(self.reranker, max_cached_tokens)
+
+        # pairs of concurrent queries are reranked together in full batches of pairs with similar lengths
+        self.rerank_scheduler = RerankScheduler(self._predict_pairs, reranker_batch_size, max_rerank_delay)
+
+        if embedding_store is None:
+            self.answers_embeddings = self._encode_texts([str(answer) for answer in self.answers])
+        else:
+            self.answers_embeddings = embedding_store.get_embeddings(
+                get_model_name(self.retriever), self.answers, self._encode_texts)
+
+        # unit-length rows turn cosine similarities into a single matrix-vector product
+        self.answers_embeddings = normalize_embeddings(self.answers_embeddings)
+
+        self.rescoring_depth = rescoring_depth
+        self.shard_store = ShardStore(shard_directory) if compression is not None and rescoring_depth > 0 else None
+        if compression is not None:
+            compressor = EmbeddingCompressor(compression, num_components).fit(self.answers_embeddings)
+            stored_embeddings = None if self.shard_store is None else \
+                self.shard_store.store_array(self.answers_embeddings)
+            self.answers_embeddings = CompressedEmbeddings(
+                compressor, compressor.compress(self.answers_embeddings), stored_embeddings)
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
         with torch.no_grad():
-            self.answers_embeddings = self.retriever.encode(
-                answers_bodies, convert_to_tensor='pt', batch_size=retriever_batch_size)
+            embeddings = self.retriever.encode(texts, convert_to_tensor='pt', batch_size=self.retriever_batch_size)
+        return embeddings.detach().cpu().numpy()
+
+    def _encode_queries(self, query_texts: List[str]) -> np.ndarray:
+        if self.query_cache is None:
+            return self._encode_query_texts(query_texts)
+        return self.query_cache.get_embeddings(get_model_name(self.retriever), query_texts, self._encode_query_texts)
+
+    def _encode_query_texts(self, query_texts: List[str]) -> np.ndarray:
+        with torch.no_grad():
+            return self.retriever.encode(query_texts, batch_size=self.retriever_batch_size)
+
+    def _compute_similarities(self, query_embeddings: np.ndarray) -> np.ndarray:
+        if isinstance(self.answers_embeddings, np.ndarray):
+            return query_embeddings @ self.answers_embeddings.T
+
+        # the approximate similarities of the compressed answers are exact for the top answers of each query
+        return rank_rescored_first(*self.answers_embeddings.get_scores(query_embeddings, self.rescoring_depth))
 
-        self.answers_embeddings = self.answers_embeddings.detach().cpu().numpy()
+    def _predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        if self.score_cache is None:
+            return self.rerank_scheduler.get_scores(pairs)
+        return self.score_cache.get_scores(get_model_name(self.reranker), pairs, self.rerank_scheduler.get_scores)
 
-        self.answers_embedding_norm = [np.linalg.norm(embedding) for embedding in self.answers_embeddings]
+    def _predict_pairs(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        return self.pretokenized_reranker.predict(pairs, batch_size=self.reranker_batch_size)
 
     def search(self, query: QueryBase) -> Iterable[DocumentBase]:
         """The ranked retrieval results for a query.
 
+        Documents with equal similarities to the query are retrieved in the order in which they were indexed.
+
         Parameters
         ----------
         query: QueryBase
             A query.
         """
+        query_embedding = normalize_embeddings(self._encode_queries([str(query)])[0])
 
-        def _compute_similarity(i: int) -> float:
-            # compute similarity between query and answer on index i
-            dt = np.dot(query_embedding, self.answers_embeddings[i])
-            return dt / (query_embedding_norm * self.answers_embedding_norm[i])
-
-        query_embedding = self.retriever.encode(str(query))
-        query_embedding_norm = np.linalg.norm(query_embedding)
-
-        similarities = [_compute_similarity(i) for i in range(len(self.answers_embeddings))]
-        sorted_similarities = np.array(similarities).argsort()[::-1]
+        similarities = self._compute_similarities(query_embedding)
+        sorted_similarities = rank_lazily(similarities, self.no_reranks)
+        top_similarities = list(islice(sorted_similarities, self.no_reranks))
 
         # rerank top documents returned by retriever
         retriever_top = []
         for i in range(self.no_reranks):
-            retriever_top.append([str(query), str(self.answers[sorted_similarities[i]])])
+            retriever_top.append([str(query), str(self.answers[top_similarities[i]])])
+
+        rerank_predictions = self._predict(retriever_top)
+
+        yield from self._rerank(top_similarities, rerank_predictions, sorted_similarities)
 
-        rerank_predictions = self.reranker.predict(retriever_top, batch_size=self.reranker_batch_size)
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """The ranked retrieval results for several queries.
+
+        The queries are encoded in a single batch and compared with all answers in a single matrix
+        product. The top documents of all queries are then reranked in a single call of the reranker.
+        Documents with equal similarities to a query are retrieved in the order in which they were indexed.
+
+        Parameters
+        ----------
+        queries: iterable of QueryBase
+            Queries.
+        k: int or None
+            The number of top documents retrieved for each query. If None, all documents are retrieved.
+        """
+        query_texts = [str(query) for query in queries]
+        if not query_texts:
+            return []
+
+        query_embeddings = self._encode_queries(query_texts)
+
+        similarities = self._compute_similarities(normalize_embeddings(query_embeddings))
+
+        sorted_similarities = [rank_lazily(query_similarities, self.no_reranks) for query_similarities in similarities]
+        top_similarities = [list(islice(ranking, self.no_reranks)) for ranking in sorted_similarities]
+
+        # rerank top documents of all queries at once
+        retriever_top = [
+            [query_text, str(self.answers[doc])]
+            for query_text, query_top in zip(query_texts, top_similarities)
+            for doc in query_top
+        ]
+        rerank_predictions = self._predict(retriever_top) if retriever_top else []
+
+        results = []
+        for query_number, (query_top, ranking) in enumerate(zip(top_similarities, sorted_similarities)):
+            query_predictions = rerank_predictions[query_number * self.no_reranks:(query_number + 1) * self.no_reranks]
+            result = self._rerank(query_top, query_predictions, ranking)
+            results.append(list(islice(result, k)) if k is not None else result)
+        return results
+
+    def _rerank(self, top_similarities: List[int], rerank_predictions: Iterable[float],
+                sorted_similarities: Iterable[int]) -> Iterable[DocumentBase]:
         rerank_predictions = np.array(rerank_predictions).argsort()[::-1]
 
         # return documents in reranked order
         for doc in rerank_predictions:
-            yield self.answers[sorted_similarities[doc]]
+            yield self.answers[top_similarities[doc]]
 
-        for doc in sorted_similarities[self.no_reranks:]:
+        for doc in sorted_similarities:
             yield self.answers[doc]
@@ -0,0 +1,485 @@
+import hashlib
+import os
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import closing
+from pathlib import Path
+from threading import Condition, Lock, Thread, current_thread
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from weakref import WeakSet, ref
+
+import numpy as np
+import torch
+
+
+# number of pairs looked up in the score cache at once
+SCORE_QUERY_SIZE = 900
+
+# default number of document tokens kept by a cache of tokenized documents, about 64 MiB
+MAX_CACHED_TOKENS = 2 ** 24
+
+# number of seconds after which an idle worker of a scheduler checks whether the scheduler is still used
+WORKER_IDLE_TIMEOUT = 1.0
+
+# a pair whose tokenization reveals the special tokens that a tokenizer adds around a query and a document
+PROBE_PAIR = ('query', 'document')
+
+Pair = Tuple[str, str]
+
+# the values of an input of a cross-encoder before, between, and after the query and the document,
+# and the values of the query and the document tokens, which are None for the token ids
+InputTemplate = Tuple[List[int], Optional[int], List[int], Optional[int], List[int]]
+
+
+def get_pair_length(pair: Pair) -> int:
+    """The number of characters of the texts of a (query, document) pair."""
+    query_text, document_text = pair
+    return len(query_text) + len(document_text)
+
+
+class RerankScheduler:
+    """
+    Scores (query, document) pairs of many queries in full batches of a cross-encoder.
+
+    The pairs submitted by concurrent callers, such as threads that search different queries, are collected
+    and scored together by a worker thread. While a batch is being scored, further pairs wait and are scored
+    together in the next round. The collected pairs are sorted by their lengths before they are split into
+    batches, so that each batch contains pairs of similar lengths with little padding.
+
+    Without a delay, a caller that finds no other pairs waiting or being scored scores its pairs in its own
+    thread. The worker is a single daemon thread that is started by the first pairs it has to collect and
+    stops once the scheduler is no longer used. Child processes forked from the current process, such as
+    the workers of a multiprocessing pool, start with no pending pairs and start their own worker.
+
+    Parameters
+    ----------
+    predict: callable
+        Predicts the scores of a list of at most batch_size pairs.
+    batch_size: int
+        The number of pairs in a batch.
+    max_delay: float
+        The number of seconds for which pairs wait for other pairs when there are not enough pairs
+        for a full batch. With zero, the pairs only wait while the previous round is being scored.
+    get_length: callable
+        The length of a pair, such as its number of tokens or characters.
+
+    """
+
+    def __init__(self, predict: Callable[[List[Pair]], np.ndarray], batch_size: int = 32, max_delay: float = 0.0,
+                 get_length: Callable[[Pair], int] = get_pair_length):
+        if batch_size < 1:
+            raise ValueError('Expected a positive batch size, got {}'.format(batch_size))
+        self.predict = predict
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.get_length = get_length
+        self._reset()
+        _SCHEDULERS.add(self)
+
+    def _reset(self):
+        # the threads of the parent process that held the condition or waited for the worker do not exist in a
+        # forked child, so the child starts with a new condition and without the worker and the pending pairs
+        self._requests: List[Tuple[List[Pair], Future]] = []
+        self._num_pending_pairs = 0
+        self._first_request_time = 0.0
+        self._is_scoring = False
+        self._worker: Optional[Thread] = None
+        self._condition = Condition()
+
+    def get_scores(self, pairs: Sequence[Pair]) -> np.ndarray:
+        """The scores of (query, document) pairs, scored together with the pairs of concurrent callers.
+
+        Parameters
+        ----------
+        pairs: sequence of (str, str)
+            The texts of the queries and the documents.
+
+        Returns
+        -------
+        np.ndarray
+            The score of each pair.
+
+        """
+        pairs = [(str(query_text), str(document_text)) for query_text, document_text in pairs]
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+
+        future: Future = Future()
+        with self._condition:
+            if self.max_delay <= 0 and not self._requests and not self._is_scoring:
+                # pairs that would be scored alone right away skip the handoff to the worker
+                self._is_scoring = True
+                future = None
+            else:
+                if not self._requests:
+                    self._first_request_time = monotonic()
+                self._requests.append((pairs, future))
+                self._num_pending_pairs += len(pairs)
+                if self._worker is None:
+                    self._worker = Thread(target=self._score_requests, args=(ref(self),), daemon=True)
+                    self._worker.start()
+                self._condition.notify()
+
+        if future is None:
+            try:
+                return self._predict_by_length(pairs)
+            finally:
+                self._finish_scoring()
+        return future.result()
+
+    @staticmethod
+    def _score_requests(scheduler_ref: 'ref[RerankScheduler]'):
+        # the worker only references its scheduler while it collects and scores pairs, so that an unused
+        # scheduler and its cross-encoder can be garbage collected, which stops the worker
+        while True:
+            scheduler = scheduler_ref()
+            if scheduler is None or scheduler._worker is not current_thread():
+                return
+            requests = scheduler._collect_requests()
+            if requests is not None:
+                scheduler._score(requests)
+            del scheduler
+
+    def _collect_requests(self) -> Optional[List[Tuple[List[Pair], Future]]]:
+        with self._condition:
+            while True:
+                if self._requests and not self._is_scoring:
+                    remaining_delay = self._first_request_time + self.max_delay - monotonic()
+                    if self._num_pending_pairs >= self.batch_size or remaining_delay <= 0:
+                        break
+                    self._condition.wait(remaining_delay)
+                elif not self._condition.wait(WORKER_IDLE_TIMEOUT) and not self._requests:
+                    return None
+            requests, self._requests, self._num_pending_pairs = self._requests, [], 0
+            self._is_scoring = True
+            return requests
+
+    def _score(self, requests: List[Tuple[List[Pair], Future]]):
+        pairs = [pair for request_pairs, _ in requests for pair in request_pairs]
+        try:
+            scores = self._predict_by_length(pairs)
+        except BaseException as exception:
+            for _, future in requests:
+                future.set_exception(exception)
+            return
+        finally:
+            self._finish_scoring()
+
+        offset = 0
+        for request_pairs, future in requests:
+            future.set_result(scores[offset:offset + len(request_pairs)])
+            offset += len(request_pairs)
+
+    def _finish_scoring(self):
+        with self._condition:
+            self._is_scoring = False
+            # the pairs that arrived while scoring form the next round
+            self._condition.notify()
+
+    def _predict_by_length(self, pairs: List[Pair]) -> np.ndarray:
+        order = np.argsort([-self.get_length(pair) for pair in pairs], kind='stable')
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            scores[batch] = np.asarray(self.predict([pairs[number] for number in batch]), dtype=np.float32)
+        return scores
+
+
+# the schedulers whose state is reset in forked child processes
+_SCHEDULERS: 'WeakSet[RerankScheduler]' = WeakSet()
+
+
+def _reset_schedulers():
+    for scheduler in list(_SCHEDULERS):
+        scheduler._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_schedulers)
+
+
+class ScoreCache:
+    """
+    A persistent cache of the scores of (query, document) pairs predicted by cross-encoders.
+
+    The scores are keyed by the name of the cross-encoder and a hash of the texts of the query and the document,
+    so that they can be shared by systems in different processes and notebook sessions, and only the pairs that
+    have not been scored before are predicted. Reranking more documents for the same queries, such as when
+    tuning the number of reranked documents, therefore only scores the additional pairs. The scores are kept
+    in an SQLite database, which serializes writers from different processes.
+
+    Parameters
+    ----------
+    directory: str, Path, or None
+        The directory of the cache. If None, ~/.cache/pv211-utils/scores is used.
+
+    Attributes
+    ----------
+    directory: Path
+        The directory of the cache.
+    hits: int
+        The number of pairs whose scores were found in the cache.
+    misses: int
+        The number of pairs that had to be scored.
+
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None):
+        directory = Path.home() / '.cache' / 'pv211-utils' / 'scores' if directory is None else Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get_scores(self, model_name: str, pairs: Sequence[Pair],
+                   predict: Callable[[List[Pair]], np.ndarray]) -> np.ndarray:
+        """The scores of (query, document) pairs, predicting only the pairs that are not in the cache.
+
+        Parameters
+        ----------
+        model_name: str
+            The name and revision of the cross-encoder, such as the result of :func:`get_model_name`.
+        pairs: sequence of (str, str)
+            The texts of the queries and the documents.
+        predict: callable
+            Predicts the scores of a list of pairs.
+
+        Returns
+        -------
+        np.ndarray
+            The score of each pair.
+
+        """
+        pairs = [(str(query_text), str(document_text)) for query_text, document_text in pairs]
+        pair_hashes = [self._hash_pair(pair) for pair in pairs]
+
+        with closing(self._connect()) as connection:
+            scores = self._find_scores(connection, model_name, pair_hashes)
+            missing = list({pair_hash: number for number, pair_hash in enumerate(pair_hashes)
+                            if pair_hash not in scores}.values())
+            num_missing = sum(1 for pair_hash in pair_hashes if pair_hash not in scores)
+            with self._lock:
+                self.hits += len(pairs) - num_missing
+                self.misses += num_missing
+            if missing:
+                predicted_scores = np.asarray(predict([pairs[number] for number in missing]), dtype=np.float32)
+                new_scores = {pair_hashes[number]: float(score) for number, score in zip(missing, predicted_scores)}
+                with connection:
+                    connection.executemany('INSERT OR IGNORE INTO scores VALUES (?, ?, ?)',
+                                           [(model_name, pair_hash, score) for pair_hash, score in new_scores.items()])
+                scores.update(new_scores)
+
+        return np.array([scores[pair_hash] for pair_hash in pair_hashes], dtype=np.float32)
+
+    @staticmethod
+    def _hash_pair(pair: Pair) -> str:
+        query_text, document_text = pair
+        pair_hash = hashlib.sha256(query_text.encode('utf-8'))
+        pair_hash.update(b'\0')
+        pair_hash.update(document_text.encode('utf-8'))
+        return pair_hash.hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(self.directory / 'scores.sqlite'), timeout=600)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS scores (model_name TEXT, pair_hash TEXT, score REAL, '
+                           'PRIMARY KEY (model_name, pair_hash))')
+        return connection
+
+    @staticmethod
+    def _find_scores(connection: sqlite3.Connection, model_name: str, pair_hashes: List[str]) -> Dict[str, float]:
+        scores = {}
+        for start in range(0, len(pair_hashes), SCORE_QUERY_SIZE):
+            chunk = pair_hashes[start:start + SCORE_QUERY_SIZE]
+            query = 'SELECT pair_hash, score FROM scores WHERE model_name = ? AND pair_hash IN ({})'
+            query = query.format(', '.join(['?'] * len(chunk)))
+            scores.update(connection.execute(query, [model_name] + chunk))
+        return scores
+
+
+class PretokenizedCrossEncoder:
+    """
+    Scores (query, document) pairs by a cross-encoder from cached token ids of the documents.
+
+    The documents are tokenized and truncated once for each maximum length of the cross-encoder and kept in a
+    cache bounded by the number of tokens, which evicts the least recently used documents, and each query is
+    tokenized once for all its documents. The inputs of the cross-encoder are built by concatenating the token
+    ids with the special tokens that the tokenizer adds to a probe pair. The truncation is identical to the
+    truncation of the longest sequence first by :meth:`CrossEncoder.predict` as long as the query takes at most
+    half of the maximum length. Longer queries and cross-encoders whose inputs cannot be built this way are
+    scored by :meth:`CrossEncoder.predict`.
+
+    Parameters
+    ----------
+    reranker: CrossEncoder
+        A cross-encoder with a Hugging Face tokenizer and a single label.
+    max_cached_tokens: int
+        The maximum number of cached document tokens.
+
+    Attributes
+    ----------
+    reranker: CrossEncoder
+        The cross-encoder.
+    max_cached_tokens: int
+        The maximum number of cached document tokens.
+
+    """
+
+    def __init__(self, reranker: Any, max_cached_tokens: int = MAX_CACHED_TOKENS):
+        self.reranker = reranker
+        self.max_cached_tokens = max_cached_tokens
+        self._documents: OrderedDict[Tuple[str, int], np.ndarray] = OrderedDict()
+        self._num_cached_tokens = 0
+        self._lock = Lock()
+        self._template = self._get_template()
+
+    def _get_template(self) -> Optional[Dict[str, InputTemplate]]:
+        tokenizer = getattr(self.reranker, 'tokenizer', None)
+        model = getattr(self.reranker, 'model', None)
+        num_labels = getattr(self.reranker, 'num_labels', 1)
+        if tokenizer is None or not isinstance(model, torch.nn.Module) or num_labels != 1:
+            return None
+        if getattr(tokenizer, 'truncation_side', 'right') != 'right':
+            return None
+        if isinstance(self.reranker, torch.nn.Sequential) and len(self.reranker) != 1:
+            return None
+
+        query_text, document_text = PROBE_PAIR
+        try:
+            query_ids, document_ids = self._tokenize(query_text), self._tokenize(document_text)
+            probe = dict(tokenizer(query_text, document_text))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+        input_ids = list(probe['input_ids'])
+        for query_start in range(len(input_ids)):
+            if input_ids[query_start:query_start + len(query_ids)] == query_ids:
+                break
+        else:
+            return None
+        query_end = query_start + len(query_ids)
+        for document_start in range(query_end, len(input_ids)):
+            if input_ids[document_start:document_start + len(document_ids)] == document_ids:
+                break
+        else:
+            return None
+        document_end = document_start + len(document_ids)
+
+        template = {}
+        for name, values in probe.items():
+            if name == 'attention_mask':
+                continue
+            values = list(values)
+            if name == 'input_ids':
+                query_value, document_value = None, None
+            else:
+                query_values = set(values[query_start:query_end])
+                document_values = set(values[document_start:document_end])
+                if len(query_values) != 1 or len(document_values) != 1:
+                    return None
+                query_value, document_value = query_values.pop(), document_values.pop()
+            template[name] = (values[:query_start], query_value, values[query_end:document_start], document_value,
+                              values[document_end:])
+        return template
+
+    def _get_max_length(self) -> Optional[int]:
+        # max_seq_length replaced the deprecated max_length of older cross-encoders and can be changed at any time
+        if hasattr(self.reranker, 'max_seq_length'):
+            max_length = self.reranker.max_seq_length
+        else:
+            max_length = getattr(self.reranker, 'max_length', None)
+        if max_length is None:
+            # without a maximum length of the cross-encoder, its tokenizer truncates to the length of the model
+            max_length = getattr(self.reranker.tokenizer, 'model_max_length', None)
+        return max_length
+
+    def _tokenize(self, text: str, max_length: Optional[int] = None) -> List[int]:
+        truncation = {} if max_length is None else {'truncation': True, 'max_length': max_length}
+        return list(self.reranker.tokenizer(text, add_special_tokens=False, **truncation)['input_ids'])
+
+    def _get_document_ids(self, document_text: str, max_length: int) -> np.ndarray:
+        # the ids are truncated to the maximum length, which changes with the max_seq_length of the cross-encoder
+        key = (document_text, max_length)
+        with self._lock:
+            document_ids = self._documents.get(key)
+            if document_ids is not None:
+                self._documents.move_to_end(key)
+                return document_ids
+
+        document_ids = np.array(self._tokenize(document_text, max_length), dtype=np.int32)
+        with self._lock:
+            if key not in self._documents:
+                self._documents[key] = document_ids
+                self._num_cached_tokens += len(document_ids)
+            while self._num_cached_tokens > self.max_cached_tokens and self._documents:
+                _, evicted_ids = self._documents.popitem(last=False)
+                self._num_cached_tokens -= len(evicted_ids)
+        return document_ids
+
+    def predict(self, pairs: Sequence[Pair], batch_size: int = 32) -> np.ndarray:
+        """The scores of (query, document) pairs.
+
+        Parameters
+        ----------
+        pairs: sequence of (str, str)
+            The texts of the queries and the documents.
+        batch_size: int
+            The number of pairs in a batch of the cross-encoder.
+
+        Returns
+        -------
+        np.ndarray
+            The score of each pair.
+
+        """
+        pairs = [(str(query_text), str(document_text)) for query_text, document_text in pairs]
+        max_length = None if self._template is None else self._get_max_length()
+        if max_length is None:
+            return np.asarray(self.reranker.predict(pairs, batch_size=batch_size), dtype=np.float32)
+
+        prefix, _, middle, _, suffix = self._template['input_ids']
+        max_length -= len(prefix) + len(middle) + len(suffix)
+        query_ids = {query_text: self._tokenize(query_text) for query_text, _ in pairs}
+
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        inputs, fallback_numbers = [], []
+        for number, (query_text, document_text) in enumerate(pairs):
+            # a shorter sequence that fits in half of the maximum length is never truncated
+            if 2 * len(query_ids[query_text]) > max_length:
+                fallback_numbers.append(number)
+                continue
+            document_ids = self._get_document_ids(document_text, max_length)
+            document_ids = document_ids[:max_length - len(query_ids[query_text])]
+            inputs.append((number, self._build_input(query_ids[query_text], document_ids)))
+
+        if fallback_numbers:
+            fallback_pairs = [pairs[number] for number in fallback_numbers]
+            scores[fallback_numbers] = self.reranker.predict(fallback_pairs, batch_size=batch_size)
+        for start in range(0, len(inputs), batch_size):
+            batch = inputs[start:start + batch_size]
+            scores[[number for number, _ in batch]] = self._forward([features for _, features in batch])
+        return scores
+
+    def _build_input(self, query_ids: List[int], document_ids: np.ndarray) -> Dict[str, List[int]]:
+        features = {}
+        for name, (prefix, query_value, middle, document_value, suffix) in self._template.items():
+            query_values = query_ids if query_value is None else [query_value] * len(query_ids)
+            document_values = document_ids.tolist() if document_value is None else [document_value] * len(document_ids)
+            features[name] = prefix + query_values + middle + document_values + suffix
+        return features
+
+    def _forward(self, inputs: List[Dict[str, List[int]]]) -> np.ndarray:
+        model = self.reranker.model
+        features = self.reranker.tokenizer.pad(inputs, return_tensors='pt')
+        features = {name: values.to(model.device) for name, values in features.items()}
+        model.eval()
+        with torch.no_grad():
+            scores = model(**features).logits.float()
+        activation_function = getattr(self.reranker, 'activation_fn', None) or \
+            getattr(self.reranker, 'default_activation_function', None)
+        if activation_function is not None:
+            scores = activation_function(scores)
+        return scores.reshape(len(inputs)).cpu().numpy()
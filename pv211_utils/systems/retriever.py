@@ -1,11 +1,23 @@
-from typing import Iterable, OrderedDict
+from threading import Lock
+from typing import Iterable, List, Optional, OrderedDict, Sequence, Union
 import numpy as np
 import torch
 from sentence_transformers.SentenceTransformer import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
 
 from ..entities import DocumentBase, QueryBase
 from ..irsystem import IRSystemBase
+from ..storage.compression import RESCORING_DEPTH, CompressedEmbeddings, EmbeddingCompressor, rank_rescored_first
+from ..storage.shards import ShardStore
+from .compatibility import warn_deprecated
+from .embeddings import EmbeddingStore, QueryEmbeddingCache, get_model_name, normalize_embeddings
+from .quantization import quantize_model
+from .ranking import rank_documents, rank_lazily
+from .segments import CorpusSnapshot, SegmentedCorpus
+from .sentences import SentenceVectors
+
+
+# maximum number of documents whose sentence vectors are kept for query expansion
+SENTENCE_CACHE_SIZE = 1024
 
 
 class RetrieverSystem(IRSystemBase):
@@ -16,10 +28,21 @@ class RetrieverSystem(IRSystemBase):
         batch_size: int = 32,
         no_query_expansion: int = 0,
         top_k_sentences: int = 3,
+        embedding_store: Optional[EmbeddingStore] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        compression: Optional[str] = None,
+        num_components: Optional[int] = None,
+        rescoring_depth: int = RESCORING_DEPTH,
+        shard_directory: Optional[str] = None,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
     ):
         """
         A system that returns documents ordered by decreasing cosine similarity.
 
+        Answers can be added and removed with :meth:`add_documents` and :meth:`remove_documents`
+        without encoding the other answers again.
+
         Parameters
         ----------
         retriever: SentenceTransformer
@@ -32,87 +55,236 @@ class RetrieverSystem(IRSystemBase):
             Number of query expansion iterations.
         top_k_sentences : int
             Number of top-relevant sentences to extract for query expansion.
+        embedding_store : EmbeddingStore or None
+            If not None, the embeddings of the answers are reused from the store and only the answers
+            that are not in the store are encoded.
+        query_cache : QueryEmbeddingCache or None
+            If not None, the embeddings of the queries are reused from the cache, which can be shared
+            with other systems.
+        compression : str or None
+            If not None, the embeddings of the answers are kept in memory compressed to 'float16', 'int8'
+            or 'pca', see :class:`EmbeddingCompressor`. The compression is fitted to the initial answers.
+        num_components : int or None
+            The number of principal components of the 'pca' compression.
+        rescoring_depth : int
+            The number of top answers of each query whose similarities are recomputed from the float32
+            embeddings, which are kept on disk and memory-mapped. With zero, the float32 embeddings are not kept
+            and all similarities are approximate. With the 'pca' compression, they are the dot products of the
+            projections to the principal components.
+        shard_directory : str or None
+            The parent directory of the float32 embeddings of compressed answers. If None, the default
+            temporary directory is used.
+        quantize : bool
+            If True, the answers and the queries are encoded on the CPU by a copy of the retriever model whose
+            linear layers are dynamically quantized to int8, see :func:`quantize_model`.
+        num_threads : int or None
+            If not None, the number of threads that PyTorch uses for intra-op parallelism on the CPU. The number
+            is set for the whole process.
         """
 
-        answers_bodies = [str(answer) for _, answer in answers.items()]
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
 
-        self.answers = list(answers.values())
+        self.batch_size = batch_size
         self.no_query_expansion = no_query_expansion
         self.top_k_sentences = top_k_sentences
-        self.retriever = retriever
+        self.retriever = quantize_model(retriever) if quantize else retriever
         self.retriever.eval()
+        self.embedding_store = embedding_store
+        self.query_cache = query_cache
+        self._sentence_vectors: OrderedDict[str, SentenceVectors] = OrderedDict()
+        self._sentence_vectors_lock = Lock()
+        self.compressor = None if compression is None else EmbeddingCompressor(compression, num_components)
+        self.rescoring_depth = rescoring_depth
+        self.shard_store = ShardStore(shard_directory) if compression is not None and rescoring_depth > 0 else None
+        self.corpus: SegmentedCorpus[Union[np.ndarray, CompressedEmbeddings]] = SegmentedCorpus(
+            answers, self._encode_answers, self._merge_embeddings)
+
+    def _encode_answers(self, answers: List[DocumentBase]) -> Union[np.ndarray, CompressedEmbeddings]:
+        if self.embedding_store is None:
+            answers_embeddings = self._encode_texts([str(answer) for answer in answers])
+        else:
+            answers_embeddings = self.embedding_store.get_embeddings(
+                get_model_name(self.retriever), answers, self._encode_texts)
+
+        # unit-length rows turn cosine similarities into a single matrix product
+        return self._compress(normalize_embeddings(answers_embeddings))
+
+    def _compress(self, answers_embeddings: np.ndarray) -> Union[np.ndarray, CompressedEmbeddings]:
+        if self.compressor is None:
+            return answers_embeddings
+        if not self.compressor.is_fitted:
+            self.compressor.fit(answers_embeddings)
+        stored_embeddings = None if self.shard_store is None else self.shard_store.store_array(answers_embeddings)
+        return CompressedEmbeddings(self.compressor, self.compressor.compress(answers_embeddings), stored_embeddings)
 
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
         with torch.no_grad():
-            self.answers_embeddings = self.retriever.encode(
-                answers_bodies, convert_to_tensor="pt", batch_size=batch_size
-            )
+            embeddings = self.retriever.encode(texts, convert_to_tensor="pt", batch_size=self.batch_size)
+        return embeddings.detach().cpu().numpy()
+
+    def _encode_queries(self, query_texts: List[str]) -> np.ndarray:
+        if self.query_cache is None:
+            return self._encode_query_texts(query_texts)
+        return self.query_cache.get_embeddings(get_model_name(self.retriever), query_texts, self._encode_query_texts)
+
+    def _encode_query_texts(self, query_texts: List[str]) -> np.ndarray:
+        with torch.no_grad():
+            return self.retriever.encode(query_texts, batch_size=self.batch_size)
+
+    def _merge_embeddings(self, segments: Sequence[Union[np.ndarray, CompressedEmbeddings]],
+                          masks: Sequence[np.ndarray]) -> Union[np.ndarray, CompressedEmbeddings]:
+        if self.compressor is None:
+            return np.vstack([embeddings[mask] for embeddings, mask in zip(segments, masks)])
+        codes, embeddings = zip(*[segment.select(mask) for segment, mask in zip(segments, masks)])
+        stored_embeddings = None if self.shard_store is None else self.shard_store.store_array(np.vstack(embeddings))
+        return CompressedEmbeddings(self.compressor, np.concatenate(codes), stored_embeddings)
+
+    @property
+    def answers(self) -> List[DocumentBase]:
+        """The indexed answers that have not been removed."""
+        return self.corpus.snapshot.live_documents
+
+    @property
+    def answers_embeddings(self) -> np.ndarray:
+        """Deprecated, use :attr:`corpus`. The unit-length float32 embeddings of the indexed answers in rows.
+
+        With compression, the embeddings are read from the float32 embeddings kept for rescoring.
+        """
+        warn_deprecated('answers_embeddings', 'corpus')
+        snapshot = self.corpus.snapshot
+        if self.compressor is not None and self.shard_store is None:
+            raise AttributeError('The float32 embeddings of compressed answers are only kept with rescoring_depth > 0')
+        segments = [segment if self.compressor is None else segment.embeddings for segment in snapshot.segments]
+        masks = snapshot.get_live_masks()
+        live_embeddings = [np.asarray(embeddings)[mask] for embeddings, mask in zip(segments, masks)]
+        if not live_embeddings:
+            return np.zeros((0, self.retriever.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.concatenate(live_embeddings)
+
+    def add_documents(self, answers: OrderedDict):
+        """Encode new answers without encoding the existing answers again.
+
+        Answers with the identifiers of indexed answers replace the indexed answers.
+
+        Parameters
+        ----------
+        answers: OrderedDict
+            Added answers
+        """
+        self.corpus.add(answers)
 
-        self.answers_embeddings = self.answers_embeddings.detach().cpu().numpy()
+    def remove_documents(self, answer_ids: Iterable[str]):
+        """Remove indexed answers.
 
-        self.answers_embedding_norm = [
-            np.linalg.norm(embedding) for embedding in self.answers_embeddings
-        ]
+        Parameters
+        ----------
+        answer_ids: iterable of str
+            Identifiers of removed answers
+        """
+        self.corpus.remove(answer_ids)
+
+    def _compute_similarities(self, snapshot: CorpusSnapshot[Union[np.ndarray, CompressedEmbeddings]],
+                              query_embeddings: np.ndarray) -> np.ndarray:
+        # cosine similarities between the queries and the answers that have not been removed
+        query_embeddings = normalize_embeddings(query_embeddings)
+        if self.compressor is None:
+            return snapshot.select_live([
+                query_embeddings @ answers_embeddings.T for answers_embeddings in snapshot.segments
+            ])
+
+        # the approximate similarities of the compressed answers are exact for the top answers of each query
+        similarities, rescored = zip(*[answers_embeddings.get_scores(query_embeddings, self.rescoring_depth)
+                                       for answers_embeddings in snapshot.segments])
+        return rank_rescored_first(snapshot.select_live(similarities), snapshot.select_live(rescored))
+
+    def _get_sentence_vectors(self, text: str) -> SentenceVectors:
+        # the sentences of a recently used document are split and counted once for all queries it expands
+        with self._sentence_vectors_lock:
+            sentence_vectors = self._sentence_vectors.get(text)
+            if sentence_vectors is not None:
+                self._sentence_vectors.move_to_end(text)
+                return sentence_vectors
+
+        # split without holding the lock, so that other threads can keep using the cache
+        sentence_vectors = SentenceVectors(text)
+        with self._sentence_vectors_lock:
+            self._sentence_vectors[text] = sentence_vectors
+            self._sentence_vectors.move_to_end(text)
+            while len(self._sentence_vectors) > SENTENCE_CACHE_SIZE:
+                self._sentence_vectors.popitem(last=False)
+        return sentence_vectors
 
     def search(self, query: QueryBase) -> Iterable[DocumentBase]:
         """Recursively refine the query and retrieve documents.
 
+        Each refinement encodes the query once and compares it with all documents in a single matrix-vector
+        product. The top sentences of the documents used to refine the queries are selected by
+        :class:`SentenceVectors`, which splits and counts the sentences of each document only once.
+        Documents with equal similarities are yielded in the order in which they were indexed.
+
         Parameters
         ----------
         query: QueryBase
             The initial user query.
         """
 
-        def _compute_similarity(i: int) -> float:
-            # compute similarity between query and answer on index i
-            dt = np.dot(query_embedding, self.answers_embeddings[i])
-            return dt / (query_embedding_norm * self.answers_embedding_norm[i])
-
-        def _extract_top_k_sentences(doc_text, query_text, k):
-            sentences = doc_text.split(". ")
-            vectorizer = TfidfVectorizer().fit_transform([query_text] + sentences)
-            query_vec = vectorizer[0]  # First vector is the query
-            sentence_vecs = vectorizer[1:]  # Remaining are sentences
-
-            # Compute cosine similarity
-            similarities = (sentence_vecs * query_vec.T).toarray().flatten()
-            top_indices = similarities.argsort()[-k:][::-1]
-
-            return " ".join([sentences[i] for i in top_indices])
+        snapshot = self.corpus.snapshot
+        answers = snapshot.live_documents
 
         query_text = str(query)
-        query_embedding = self.retriever.encode(query_text)
-        query_embedding_norm = np.linalg.norm(query_embedding)
+        query_embedding = self._encode_queries([query_text])[0]
 
-        used_doc_indices = set()
+        used_doc_indices = []
 
-        for _ in range(self.no_query_expansion):
-            similarities = [
-                _compute_similarity(i) for i in range(len(self.answers_embeddings))
-            ]
-            sorted_indices = np.argsort(similarities)[::-1]
+        for _ in range(min(self.no_query_expansion, len(answers))):
+            similarities = self._compute_similarities(snapshot, query_embedding)
+            # the similarities change with every expanded query, so a masked argmax finds the next unused document
+            similarities[used_doc_indices] = -np.inf
+            idx = int(np.argmax(similarities))
 
-            for idx in sorted_indices:
-                if idx not in used_doc_indices:
-                    break
-
-            used_doc_indices.add(idx)
-            top_doc_text = self.answers[idx]
+            used_doc_indices.append(idx)
+            top_doc_text = answers[idx]
 
             if isinstance(top_doc_text, DocumentBase):
                 top_doc_text = top_doc_text.body
 
-            top_doc_summary = _extract_top_k_sentences(
-                top_doc_text, query_text, self.top_k_sentences
+            top_doc_summary = self._get_sentence_vectors(top_doc_text).get_top_k_sentences(
+                query_text, self.top_k_sentences
             )
             query_text = query_text + " " + top_doc_summary
 
-            query_embedding = self.retriever.encode(query_text)
-            query_embedding_norm = np.linalg.norm(query_embedding)
+            query_embedding = self._encode_queries([query_text])[0]
+
+        similarities = self._compute_similarities(snapshot, query_embedding)
+
+        for doc in rank_lazily(similarities):
+            yield answers[doc]
+
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """Retrieve documents for several queries at once.
+
+        The queries are encoded in a single batch and compared with all documents in a single matrix
+        product. With query expansion, the queries are refined and searched one at a time.
+        Documents with equal similarities are ranked in the order in which they were indexed.
+
+        Parameters
+        ----------
+        queries: iterable of QueryBase
+            The user queries.
+        k: int or None
+            The number of top documents retrieved for each query. If None, all documents are retrieved.
+        """
+        if self.no_query_expansion > 0:
+            return super().search_batch(queries, k)
+
+        query_texts = [str(query) for query in queries]
+        if not query_texts:
+            return []
+
+        query_embeddings = self._encode_queries(query_texts)
 
-        similarities = [
-            _compute_similarity(i) for i in range(len(self.answers_embeddings))
-        ]
-        sorted_similarities = np.array(similarities).argsort()[::-1]
+        snapshot = self.corpus.snapshot
+        similarities = self._compute_similarities(snapshot, query_embeddings)
 
-        for doc in sorted_similarities:
-            yield self.answers[doc]
+        return [rank_documents(query_similarities, snapshot.live_documents, k) for query_similarities in similarities]
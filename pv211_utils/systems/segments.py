@@ -0,0 +1,448 @@
+from threading import Lock, RLock, Thread
+from typing import Callable, Generic, Iterable, List, Mapping, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+from scipy.sparse import csr_matrix, hstack
+
+from ..entities import DocumentBase
+
+
+SegmentT = TypeVar('SegmentT')
+
+# number of segments that triggers a background compaction
+MAX_SEGMENTS = 8
+
+# fraction of removed documents that triggers a background compaction
+MAX_REMOVED_FRACTION = 0.2
+
+
+class CorpusSnapshot(Generic[SegmentT]):
+    """
+    An immutable view of the segments and documents of a segmented corpus.
+
+    Every document has a position. The positions of the documents of the i-th segment follow the positions
+    of the documents of the previous segments. Removed documents keep their positions until the next
+    compaction, so that the segments do not need to change, and they are marked with tombstones.
+
+    Parameters
+    ----------
+    segments: sequence of segments
+        The segments of the corpus.
+    segment_sizes: sequence of int
+        The number of documents in each segment, including removed documents.
+    documents: list of DocumentBase
+        The documents at their positions. Only the first sum(segment_sizes) documents belong to the snapshot.
+    removed: np.ndarray
+        The tombstones: a boolean mask of the removed positions.
+
+    Attributes
+    ----------
+    segments: tuple of segments
+        The segments of the corpus.
+    offsets: np.ndarray
+        The position of the first document of each segment, followed by the number of positions.
+    removed: np.ndarray
+        The tombstones: a boolean mask of the removed positions.
+    live_positions: np.ndarray
+        The positions of the documents that have not been removed in ascending order.
+
+    """
+
+    def __init__(self, segments: Sequence[SegmentT], segment_sizes: Sequence[int], documents: List[DocumentBase],
+                 removed: np.ndarray):
+        self.segments = tuple(segments)
+        self.offsets = np.concatenate([[0], np.cumsum(segment_sizes, dtype=np.int64)])
+        self.removed = removed
+        self.live_positions = np.flatnonzero(~removed)
+        self._documents = documents
+        self._live_documents: Optional[List[DocumentBase]] = None
+
+    @property
+    def num_documents(self) -> int:
+        """The number of documents that have not been removed."""
+        return len(self.live_positions)
+
+    @property
+    def num_removed(self) -> int:
+        """The number of removed documents that still occupy positions."""
+        return len(self.removed) - len(self.live_positions)
+
+    @property
+    def live_documents(self) -> List[DocumentBase]:
+        """The documents that have not been removed in the order of their positions."""
+        if self._live_documents is None:
+            self._live_documents = [self._documents[position] for position in self.live_positions.tolist()]
+        return self._live_documents
+
+    def get_document(self, position: int) -> DocumentBase:
+        """The document at a position."""
+        return self._documents[position]
+
+    def get_live_masks(self) -> List[np.ndarray]:
+        """Boolean masks of the documents of each segment that have not been removed."""
+        return [~self.removed[start:end] for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def select_live(self, segment_scores: Sequence[np.ndarray]) -> np.ndarray:
+        """Concatenate the scores of the segments along the last axis and keep the documents that have not been removed.
+
+        Parameters
+        ----------
+        segment_scores: sequence of np.ndarray
+            Scores of the positions of each segment in the last axis.
+
+        Returns
+        -------
+        np.ndarray
+            Scores of the documents that have not been removed in the order of their positions.
+
+        """
+        scores = segment_scores[0] if len(segment_scores) == 1 else np.concatenate(segment_scores, axis=-1)
+        if self.num_removed > 0:
+            scores = scores[..., self.live_positions]
+        return scores
+
+    def select_live_sparse(self, segment_scores: Sequence[csr_matrix]) -> csr_matrix:
+        """Concatenate the sparse scores of the segments along the columns and keep the documents that have not
+        been removed.
+
+        Parameters
+        ----------
+        segment_scores: sequence of csr_matrix
+            Sparse scores of the positions of each segment in the columns.
+
+        Returns
+        -------
+        csr_matrix
+            Sparse scores of the documents that have not been removed in the order of their positions.
+
+        """
+        scores = segment_scores[0] if len(segment_scores) == 1 else hstack(segment_scores, format='csr')
+        if self.num_removed > 0:
+            scores = scores[:, self.live_positions]
+        return scores
+
+    def merge_top_k(self, segment_top_k: Sequence[Tuple[np.ndarray, np.ndarray]],
+                    k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge the top documents of the segments into the top k documents that have not been removed.
+
+        Parameters
+        ----------
+        segment_top_k: sequence of (np.ndarray, np.ndarray)
+            The positions within each segment and the scores of the top documents of each segment.
+        k: int
+            The number of top documents.
+
+        Returns
+        -------
+        np.ndarray
+            The indices of the top k documents in :attr:`live_documents` in descending order of their scores.
+            Ties are broken by ascending position.
+        np.ndarray
+            The scores of the top k documents.
+
+        """
+        positions = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            offset + segment_positions for offset, (segment_positions, _) in zip(self.offsets, segment_top_k)])
+        scores = np.concatenate([np.zeros(0)] + [segment_scores for _, segment_scores in segment_top_k])
+        live = ~self.removed[positions]
+        positions, scores = positions[live], scores[live]
+        top = np.lexsort((positions, -scores))[:k]
+        return np.searchsorted(self.live_positions, positions[top]), scores[top]
+
+
+class SegmentedCorpus(Generic[SegmentT]):
+    """
+    A corpus of documents that can grow and shrink without indexing the existing documents again.
+
+    The documents are indexed in segments. Added documents are indexed into a new delta segment and
+    removed documents are marked with tombstones, so that the existing segments never change.
+    Once there are too many segments or removed documents, a background thread compacts the corpus:
+    it merges all segments into a single segment without the removed documents. With a maximum segment
+    size, the documents are indexed and merged into consecutive segments of at most that many documents,
+    so that no segment needs to be built in memory at once for a corpus of any size.
+
+    Writers are serialized with a lock, while readers take the current :attr:`snapshot` and never wait.
+
+    Parameters
+    ----------
+    documents: dict of (str, DocumentBase)
+        The initial documents keyed by their identifiers.
+    build_segment: callable
+        Indexes a list of documents into a segment.
+    merge_segments: callable
+        Merges a sequence of segments into a single segment that only contains the documents selected
+        by a boolean mask for each segment.
+    max_segments: int
+        The number of segments that triggers a background compaction.
+    max_removed_fraction: float
+        The fraction of removed documents that triggers a background compaction.
+    max_segment_size: int or None
+        The maximum number of documents in a segment. If None, the segments are unbounded.
+    exclusive_compaction: bool
+        Whether the writer lock is held while the segments are merged. This is needed when merging
+        segments modifies state shared with writers and readers, such as an external vector database.
+
+    Attributes
+    ----------
+    snapshot: CorpusSnapshot
+        The current state of the corpus.
+    lock: RLock
+        The lock held by writers.
+
+    """
+
+    def __init__(self, documents: Mapping[str, DocumentBase],
+                 build_segment: Callable[[List[DocumentBase]], SegmentT],
+                 merge_segments: Callable[[Sequence[SegmentT], Sequence[np.ndarray]], SegmentT],
+                 max_segments: int = MAX_SEGMENTS, max_removed_fraction: float = MAX_REMOVED_FRACTION,
+                 max_segment_size: Optional[int] = None, exclusive_compaction: bool = False):
+        self.build_segment = build_segment
+        self.merge_segments = merge_segments
+        self.max_segments = max_segments
+        self.max_removed_fraction = max_removed_fraction
+        self.max_segment_size = max_segment_size
+        self.exclusive_compaction = exclusive_compaction
+        self.lock = RLock()
+        self._compaction_lock = Lock()
+        self._compaction_thread: Optional[Thread] = None
+
+        self._documents = list(documents.values())
+        self._positions = {document_id: position for position, document_id in enumerate(documents)}
+        self._document_ids = list(documents)
+        segments, segment_sizes = self._build_segments(self._documents)
+        self.snapshot = CorpusSnapshot(segments, segment_sizes, self._documents,
+                                       np.zeros(len(self._documents), dtype=bool))
+
+    def _build_segments(self, documents: List[DocumentBase]) -> Tuple[List[SegmentT], List[int]]:
+        segment_size = max(len(documents), 1) if self.max_segment_size is None else self.max_segment_size
+        segment_documents = [documents[start:start + segment_size]
+                             for start in range(0, max(len(documents), 1), segment_size)]
+        segments = [self.build_segment(documents_of_segment) for documents_of_segment in segment_documents]
+        return segments, [len(documents_of_segment) for documents_of_segment in segment_documents]
+
+    def __len__(self) -> int:
+        return self.snapshot.num_documents
+
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self._positions
+
+    def add(self, documents: Mapping[str, DocumentBase]):
+        """Index documents into new segments.
+
+        Documents with the identifiers of existing documents replace the existing documents.
+
+        Parameters
+        ----------
+        documents: dict of (str, DocumentBase)
+            The added documents keyed by their identifiers.
+
+        """
+        if not documents:
+            return
+
+        with self.lock:
+            segments, segment_sizes = self._build_segments(list(documents.values()))
+            snapshot = self.snapshot
+            removed = np.concatenate([snapshot.removed, np.zeros(len(documents), dtype=bool)])
+            replaced_positions = [self._positions[document_id] for document_id in documents
+                                  if document_id in self._positions]
+            removed[replaced_positions] = True
+            for document_id, document in documents.items():
+                self._positions[document_id] = len(self._documents)
+                self._documents.append(document)
+                self._document_ids.append(document_id)
+            self.snapshot = CorpusSnapshot(snapshot.segments + tuple(segments),
+                                           np.diff(snapshot.offsets).tolist() + segment_sizes,
+                                           self._documents, removed)
+        self._compact_in_background()
+
+    def remove(self, document_ids: Iterable[str]):
+        """Mark documents as removed.
+
+        Parameters
+        ----------
+        document_ids: iterable of str
+            The identifiers of the removed documents.
+
+        Raises
+        ------
+        KeyError
+            If a document is not in the corpus. No documents are removed in that case.
+
+        """
+        with self.lock:
+            document_ids = list(document_ids)
+            for document_id in document_ids:
+                if document_id not in self._positions:
+                    raise KeyError(document_id)
+            snapshot = self.snapshot
+            removed = snapshot.removed.copy()
+            removed[[self._positions.pop(document_id) for document_id in document_ids]] = True
+            self.snapshot = CorpusSnapshot(snapshot.segments, np.diff(snapshot.offsets).tolist(), self._documents,
+                                           removed)
+        self._compact_in_background()
+
+    def needs_compaction(self) -> bool:
+        """Whether there are too many segments or removed documents."""
+        snapshot = self.snapshot
+        max_segments = self.max_segments
+        if self.max_segment_size is not None:
+            max_segments += len(snapshot.removed) // self.max_segment_size
+        return (len(snapshot.segments) > max_segments
+                or snapshot.num_removed > self.max_removed_fraction * len(snapshot.removed))
+
+    def compact(self):
+        """Merge all segments into a single segment without the removed documents.
+
+        With a maximum segment size, consecutive segments are merged into segments of at most that many
+        documents instead, and segments that neither fit together nor contain removed documents are kept.
+
+        The documents added and removed while the segments are being merged are kept in new segments
+        and tombstones on top of the merged segment.
+
+        """
+        with self._compaction_lock:
+            if self.exclusive_compaction:
+                with self.lock:
+                    self._compact()
+            else:
+                self._compact()
+
+    def _compact(self):
+        with self.lock:
+            snapshot = self.snapshot
+        masks = snapshot.get_live_masks()
+        groups = self._group_segments(masks)
+        if all(len(group) == 1 and masks[group[0]].all() for group in groups):
+            return
+
+        segments, segment_sizes = [], []
+        for group in groups:
+            if len(group) == 1 and masks[group[0]].all():
+                segments.append(snapshot.segments[group[0]])
+            else:
+                segments.append(self.merge_segments([snapshot.segments[number] for number in group],
+                                                    [masks[number] for number in group]))
+            segment_sizes.append(int(sum(masks[number].sum() for number in group)))
+
+        with self.lock:
+            current_snapshot = self.snapshot
+            kept_positions = snapshot.live_positions
+            num_merged_positions = len(snapshot.removed)
+            self._documents = [self._documents[position] for position in kept_positions.tolist()] + \
+                self._documents[num_merged_positions:]
+            self._document_ids = [self._document_ids[position] for position in kept_positions.tolist()] + \
+                self._document_ids[num_merged_positions:]
+            removed = np.concatenate([current_snapshot.removed[kept_positions],
+                                      current_snapshot.removed[num_merged_positions:]])
+            self._positions = {document_id: position for position, document_id in enumerate(self._document_ids)
+                               if not removed[position]}
+            num_merged_segments = len(snapshot.segments)
+            self.snapshot = CorpusSnapshot(
+                tuple(segments) + current_snapshot.segments[num_merged_segments:],
+                segment_sizes + np.diff(current_snapshot.offsets)[num_merged_segments:].tolist(),
+                self._documents, removed)
+
+    def _group_segments(self, masks: Sequence[np.ndarray]) -> List[List[int]]:
+        # greedily group consecutive segments whose remaining documents fit into a single segment
+        groups: List[List[int]] = []
+        group_size = 0
+        for number, mask in enumerate(masks):
+            segment_size = int(mask.sum())
+            if groups and (self.max_segment_size is None or group_size + segment_size <= self.max_segment_size):
+                groups[-1].append(number)
+                group_size += segment_size
+            else:
+                groups.append([number])
+                group_size = segment_size
+        return groups
+
+    def _compact_in_background(self):
+        if not self.needs_compaction():
+            return
+        with self.lock:
+            if self._compaction_thread is None or not self._compaction_thread.is_alive():
+                self._compaction_thread = Thread(target=self.compact, daemon=True)
+                self._compaction_thread.start()
+
+    def wait_for_compaction(self):
+        """Wait until a running background compaction finishes."""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+
+
+class SegmentedIndex:
+    """
+    Scores of the documents of a corpus snapshot combined from the indexes of its segments.
+
+    Parameters
+    ----------
+    snapshot: CorpusSnapshot
+        A snapshot of a segmented corpus.
+    segment_indexes: sequence of indexes
+        An index of each segment with the get_scores and get_batch_scores methods, and optionally the
+        get_sparse_batch_scores method.
+
+    Attributes
+    ----------
+    snapshot: CorpusSnapshot
+        A snapshot of a segmented corpus.
+    segment_indexes: list of indexes
+        An index of each segment.
+
+    """
+
+    def __init__(self, snapshot: CorpusSnapshot, segment_indexes: Sequence):
+        self.snapshot = snapshot
+        self.segment_indexes = list(segment_indexes)
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """The scores of all documents for a query.
+
+        Parameters
+        ----------
+        query: list of str
+            A tokenized query.
+
+        Returns
+        -------
+        np.ndarray
+            The score of each document in :attr:`CorpusSnapshot.live_documents`.
+
+        """
+        return self.snapshot.select_live([index.get_scores(query) for index in self.segment_indexes])
+
+    def get_batch_scores(self, queries: List[List[str]]) -> np.ndarray:
+        """The scores of all documents for several queries.
+
+        Parameters
+        ----------
+        queries: list of list of str
+            Tokenized queries.
+
+        Returns
+        -------
+        np.ndarray
+            A matrix with the score of each document in :attr:`CorpusSnapshot.live_documents` for each query.
+
+        """
+        return self.snapshot.select_live([index.get_batch_scores(queries) for index in self.segment_indexes])
+
+    def get_sparse_batch_scores(self, queries: List[List[str]]) -> csr_matrix:
+        """The nonzero scores of documents for several queries.
+
+        Parameters
+        ----------
+        queries: list of list of str
+            Tokenized queries.
+
+        Returns
+        -------
+        csr_matrix
+            A sparse matrix with the score of each document in :attr:`CorpusSnapshot.live_documents` for each
+            query. The missing scores are zero.
+
+        """
+        return self.snapshot.select_live_sparse([index.get_sparse_batch_scores(queries)
+                                                 for index in self.segment_indexes])
@@ -0,0 +1,106 @@
+from collections import Counter
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+# the tokenizer of sklearn's TfidfVectorizer with the default parameters
+ANALYZER = TfidfVectorizer().build_analyzer()
+
+
+class SentenceVectors:
+    """
+    The sentences of a document and their term frequencies, which select the sentences most similar to queries.
+
+    The similarities are the cosine similarities of TF-IDF vectors computed by sklearn's TfidfVectorizer with
+    the default parameters fitted to the query and the sentences. The term frequencies and the document
+    frequencies of the sentences are computed only once, so that only the query is tokenized for each query.
+
+    Parameters
+    ----------
+    text: str
+        The text of the document. Sentences are separated by a full stop followed by a space.
+
+    Attributes
+    ----------
+    sentences: list of str
+        The sentences of the document.
+    vocabulary: dict of (str, int)
+        A mapping from the terms of the sentences to the columns of the term frequencies.
+    term_frequencies: csr_matrix
+        A sentence-by-term matrix of the term frequencies.
+    document_frequencies: np.ndarray
+        The number of sentences that contain each term.
+
+    """
+
+    def __init__(self, text: str):
+        self.sentences = text.split(". ")
+        self.vocabulary = {}
+        indptr, indices, data = [0], [], []
+        for sentence in self.sentences:
+            for term, count in Counter(ANALYZER(sentence)).items():
+                indices.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
+        self.term_frequencies = csr_matrix((np.array(data, dtype=np.float64), indices, indptr),
+                                           shape=(len(self.sentences), len(self.vocabulary)))
+        self.document_frequencies = np.bincount(indices, minlength=len(self.vocabulary))
+
+    def get_similarities(self, query_text: str) -> np.ndarray:
+        """The cosine similarities of the sentences and a query.
+
+        Parameters
+        ----------
+        query_text: str
+            The text of the query.
+
+        Returns
+        -------
+        np.ndarray
+            The cosine similarity of each sentence and the query.
+
+        """
+        query_counts = Counter(ANALYZER(query_text))
+        query_terms = np.array([self.vocabulary[term] for term in query_counts if term in self.vocabulary],
+                               dtype=np.int64)
+        query_term_counts = np.array([count for term, count in query_counts.items() if term in self.vocabulary])
+        unknown_term_counts = np.array([count for term, count in query_counts.items() if term not in self.vocabulary])
+
+        # the vectorizer is fitted to the query and the sentences, so the query counts in the document frequencies
+        num_texts = len(self.sentences) + 1
+        document_frequencies = self.document_frequencies + 1.0
+        document_frequencies[query_terms] += 1
+        idfs = np.log((1 + num_texts) / document_frequencies) + 1
+        unknown_term_idf = np.log((1 + num_texts) / 2) + 1
+
+        weights = self.term_frequencies.multiply(idfs).tocsr()
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+
+        query_weights = np.zeros(len(self.vocabulary))
+        query_weights[query_terms] = query_term_counts * idfs[query_terms]
+        query_norm = np.sqrt(np.sum(query_weights ** 2) + np.sum((unknown_term_counts * unknown_term_idf) ** 2))
+        query_norm = query_norm if query_norm > 0 else 1.0
+
+        return weights.dot(query_weights) / norms / query_norm
+
+    def get_top_k_sentences(self, query_text: str, k: int) -> str:
+        """The sentences most similar to a query.
+
+        Parameters
+        ----------
+        query_text: str
+            The text of the query.
+        k: int
+            The number of sentences.
+
+        Returns
+        -------
+        str
+            The k sentences most similar to the query, joined by spaces in descending order of the similarity.
+
+        """
+        top_indices = self.get_similarities(query_text).argsort()[-k:][::-1]
+        return " ".join([self.sentences[i] for i in top_indices])
@@ -1,61 +1,158 @@
-from multiprocessing import get_context
-from typing import Iterable, List, OrderedDict, Tuple, Union
+from threading import Lock
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, OrderedDict, Sequence, Union
 
-from gensim.corpora import Dictionary
+import numpy as np
+from gensim.corpora import Dictionary, HashDictionary
 from gensim.models import TfidfModel
-from gensim.similarities import SparseMatrixSimilarity
-from tqdm import tqdm
 
 from ..entities import DocumentBase, QueryBase
 from ..irsystem import IRSystemBase
 from ..preprocessing import DocPreprocessingBase
+from ..storage.shards import ShardStore
+from .compatibility import to_gensim_dictionary, warn_deprecated
+from .cosine_index import SegmentedCosineIndex
+from .index_builder import START_METHOD, build_inverted_index
+from .inverted_index import HashingVocabulary, InvertedIndex, Vocabulary
+from .ranking import rank_sparse_documents, rank_sparse_lazily
+from .segments import SegmentedCorpus
 
 
 class TfidfSystem(IRSystemBase):
     """
     A system that returns documents ordered by decreasing cosine similarity.
 
+    Documents can be added and removed with :meth:`add_documents` and :meth:`remove_documents`
+    without indexing the other documents again. The inverse document frequencies follow the added
+    and removed documents.
+
+    The system keeps no state shared between searches, so it can serve concurrent queries from a thread pool
+    and several systems with different preprocessing can be used side by side.
+
+    Parameters
+    ----------
+    documents: OrderedDict
+        Input documents
+    preprocessing: DocPreprocessingBase
+        Type of preprocessing
+    num_workers: int or None
+        The number of processes that tokenize the indexed documents. If None, all CPUs are used.
+        If 1, the documents are tokenized in the current process.
+    shard_size: int or None
+        If not None, the index is split into shards of at most shard_size documents that are kept on disk
+        and memory-mapped, so that corpora larger than the memory can be indexed and searched. The memory
+        used by the index and by a search is then bounded by a shard and the posting lists of the query terms.
+        If None, the index is kept in memory.
+    shard_directory: str, Path, or None
+        The directory of the shards. If None, the default temporary directory is used.
+    num_buckets: int or None
+        If not None, the terms are hashed to num_buckets rows instead of being collected into a vocabulary,
+        so that the memory of the vocabulary is fixed and the documents are indexed in a single pass
+        without a global mapping of terms. Terms that share a row are indistinguishable.
+        If None, a vocabulary of all terms is collected.
+    start_method: str
+        The start method of the processes that tokenize the indexed documents. The default is 'fork' where it
+        is available, so that the processes inherit the preprocessing. The 'spawn' and 'forkserver' start
+        methods require a picklable preprocessing, but are safe while other threads run, such as the background
+        thread that compacts the corpus after documents are added and removed.
+
     Attributes
     ----------
-    dictionary: Dictionary
-        The dictionary of the system.
-    tfidf_model: TfidfModel
-        The TF-IDF model of the system.
-    index: MatrixSimilarity
+    vocabulary: dict of (str, int) or HashingVocabulary
+        The vocabulary of the system.
+    corpus: SegmentedCorpus
+        The indexed documents.
+    shard_store: ShardStore or None
+        The shards of the index on disk.
+    index: SegmentedCosineIndex
         The indexed TF-IDF documents.
+    dictionary: Dictionary or HashDictionary
+        Deprecated, use vocabulary. A gensim dictionary with the terms of the vocabulary.
+    tfidf_model: TfidfModel
+        Deprecated, use index. A gensim TF-IDF model with the inverse document frequencies of the index.
     index_to_document: dict of (int, Document)
-        A mapping from indexed document numbers to documents.
+        Deprecated, use ``index.snapshot.live_documents``. A mapping from indexed document numbers to documents.
 
     """
-    DICTIONARY: Dictionary
-    TFIDF_MODEL: TfidfModel
-    preprocessing: DocPreprocessingBase
 
-    def __init__(self, documents: OrderedDict[str, DocumentBase], preprocessing: DocPreprocessingBase):
-        self.__class__.preprocessing = preprocessing
+    def __init__(self, documents: OrderedDict[str, DocumentBase], preprocessing: DocPreprocessingBase,
+                 num_workers: Optional[int] = None, shard_size: Optional[int] = None,
+                 shard_directory: Optional[Union[str, Path]] = None, num_buckets: Optional[int] = None,
+                 start_method: str = START_METHOD):
+        self.preprocessing = preprocessing
+        self.num_workers = num_workers
+        self.start_method = start_method
+        self.vocabulary: Vocabulary = {} if num_buckets is None else HashingVocabulary(num_buckets)
+        self.shard_store = None if shard_size is None else ShardStore(shard_directory)
+        self._index_lock = Lock()
+        self.corpus = SegmentedCorpus(documents, self._build_inverted_index, self._merge_inverted_indexes,
+                                      max_segment_size=shard_size)
+        self._index = SegmentedCosineIndex(self.corpus.snapshot, 'tfidf', self.shard_store)
+
+    def _build_inverted_index(self, documents: List[DocumentBase]) -> InvertedIndex:
+        inverted_index = build_inverted_index(documents, self.preprocessing, self.vocabulary,
+                                              num_workers=self.num_workers, start_method=self.start_method,
+                                              desc='Building the TF-IDF index')
+        return inverted_index if self.shard_store is None else inverted_index.store(self.shard_store)
+
+    def _merge_inverted_indexes(self, inverted_indexes: Sequence[InvertedIndex],
+                                masks: Sequence[np.ndarray]) -> InvertedIndex:
+        inverted_index = InvertedIndex.merge(inverted_indexes, masks)
+        return inverted_index if self.shard_store is None else inverted_index.store(self.shard_store)
+
+    @property
+    def index(self) -> SegmentedCosineIndex:
+        """The indexed TF-IDF documents, following the documents added and removed from the corpus."""
+        index = self._index
+        if index.snapshot is not self.corpus.snapshot:
+            # concurrent searches wait for a single rebuild of the weights instead of each rebuilding them
+            with self._index_lock:
+                if self._index.snapshot is not self.corpus.snapshot:
+                    self._index = self._index.with_snapshot(self.corpus.snapshot)
+                index = self._index
+        return index
+
+    @property
+    def dictionary(self) -> Union[Dictionary, HashDictionary]:
+        """Deprecated, use :attr:`vocabulary`. A gensim dictionary with the terms of the vocabulary."""
+        warn_deprecated('dictionary', 'vocabulary')
+        return to_gensim_dictionary(self.vocabulary, self.index.statistics)
+
+    @property
+    def tfidf_model(self) -> TfidfModel:
+        """Deprecated, use :attr:`index`. A gensim TF-IDF model with the inverse document frequencies of the index."""
+        warn_deprecated('tfidf_model', 'index')
+        return TfidfModel(dictionary=to_gensim_dictionary(self.vocabulary, self.index.statistics))
+
+    @property
+    def index_to_document(self) -> Dict[int, DocumentBase]:
+        """Deprecated, use ``index.snapshot.live_documents``. A mapping from document numbers to documents."""
+        warn_deprecated('index_to_document', 'index.snapshot.live_documents')
+        return dict(enumerate(self.index.snapshot.live_documents))
+
+    def add_documents(self, documents: OrderedDict[str, DocumentBase]):
+        """Index new documents without indexing the existing documents again.
+
+        Documents with the identifiers of indexed documents replace the indexed documents.
 
-        with get_context('fork').Pool(None) as pool:
-            document_bodies = pool.imap(self.__class__._document_to_tokens, documents.values())
-            document_bodies = tqdm(document_bodies, desc='Building the dictionary', total=len(documents))
-            self.dictionary = Dictionary(document_bodies)
-            self.__class__.DICTIONARY = self.dictionary
+        Parameters
+        ----------
+        documents : OrderedDict
+            Added documents.
 
-        with get_context('fork').Pool(None) as pool:
-            document_vectors = pool.imap(self.__class__._document_to_bag_of_words, documents.values())
-            document_vectors = tqdm(document_vectors, desc='Building the TF-IDF model', total=len(documents))
-            self.tfidf_model = TfidfModel(document_vectors)
-            self.__class__.TFIDF_MODEL = self.tfidf_model
+        """
+        self.corpus.add(documents)
 
-        with get_context('fork').Pool(None) as pool:
-            document_vectors = pool.imap(self.__class__._document_to_tfidf_vector, documents.values())
-            document_vectors = tqdm(document_vectors, desc='Building the TF-IDF index', total=len(documents))
-            self.index = SparseMatrixSimilarity(document_vectors, num_docs=len(
-                documents), num_terms=len(self.dictionary))
+    def remove_documents(self, document_ids: Iterable[str]):
+        """Remove indexed documents.
 
-        del self.__class__.DICTIONARY
-        del self.__class__.TFIDF_MODEL
+        Parameters
+        ----------
+        document_ids : iterable of str
+            Identifiers of removed documents.
 
-        self.index_to_document = dict(enumerate(documents.values()))
+        """
+        self.corpus.remove(document_ids)
 
     def search(self, query: QueryBase) -> Iterable[DocumentBase]:
         """The ranked retrieval results for a query.
@@ -71,27 +168,38 @@ class TfidfSystem(IRSystemBase):
             The ranked retrieval results for a query.
 
         """
-        self.__class__.DICTIONARY = self.dictionary
-        self.__class__.TFIDF_MODEL = self.tfidf_model
-
-        query_vector = self.__class__._document_to_tfidf_vector(query)
-        similarities = enumerate(self.index[query_vector])
-        similarities = sorted(similarities, key=lambda item: item[1], reverse=True)
-        for document_number, _ in similarities:
-            document = self.index_to_document[document_number]
+        index = self.index
+        similarities = index.get_sparse_batch_scores([self.preprocessing(str(query))])
+        documents = index.snapshot.live_documents
+
+        for document_number in rank_sparse_lazily(similarities.indices, similarities.data, len(documents)):
+            document = documents[document_number]
             yield document
 
-        del self.__class__.DICTIONARY
-        del self.__class__.TFIDF_MODEL
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        """The ranked retrieval results for several queries.
+
+        All queries are compared with the indexed documents in a single sparse matrix product, which only
+        scores the documents that share terms with the queries.
 
-    @classmethod
-    def _document_to_tokens(cls, document: Union[QueryBase, DocumentBase]) -> List[str]:
-        return cls.preprocessing(str(document))
+        Parameters
+        ----------
+        queries : iterable of QueryBase
+            Queries.
+        k : int or None
+            The number of top documents retrieved for each query. If None, all documents are retrieved.
 
-    @classmethod
-    def _document_to_bag_of_words(cls, document: Union[QueryBase, DocumentBase]) -> List[Tuple[int, int]]:
-        return cls.DICTIONARY.doc2bow(cls._document_to_tokens(document))
+        Returns
+        -------
+        list of iterable of Document
+            The ranked retrieval results for each query.
 
-    @classmethod
-    def _document_to_tfidf_vector(cls, document: Union[QueryBase, DocumentBase]) -> List[Tuple[int, float]]:
-        return cls.TFIDF_MODEL[cls._document_to_bag_of_words(document)]
+        """
+        index = self.index
+        similarities = index.get_sparse_batch_scores([self.preprocessing(str(query)) for query in queries])
+        documents = index.snapshot.live_documents
+
+        return [
+            rank_sparse_documents(similarities.indices[start:end], similarities.data[start:end], documents, k)
+            for start, end in zip(similarities.indptr[:-1], similarities.indptr[1:])
+        ]
@@ -0,0 +1,85 @@
+from argparse import ArgumentParser
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from pv211_utils.systems.bm25_index import BM25Index
+from pv211_utils.systems.inverted_index import InvertedIndex
+from pv211_utils.systems.ranking import rank_lazily
+
+
+def build_index(num_documents: int, num_terms: int, rng: np.random.Generator) -> Tuple[BM25Index, np.ndarray]:
+    term_probabilities = 1 / np.arange(1, num_terms + 1) ** 1.07
+    term_probabilities /= term_probabilities.sum()
+    document_lengths = rng.integers(10, 80, size=num_documents)
+    terms = rng.choice(num_terms, size=document_lengths.sum(), p=term_probabilities)
+    documents = np.repeat(np.arange(num_documents), document_lengths)
+    term_frequencies = csr_matrix((np.ones(len(terms), dtype=np.int32), (terms, documents)),
+                                  shape=(num_terms, num_documents))
+    term_frequencies.sum_duplicates()
+    term_frequencies.sort_indices()
+    vocabulary = {str(term): term for term in range(num_terms)}
+    inverted_index = InvertedIndex.from_term_frequencies(term_frequencies, document_lengths, vocabulary)
+    return BM25Index(inverted_index), term_probabilities
+
+
+def get_exhaustive_top_k(bm25: BM25Index, query: List[str], k: int) -> np.ndarray:
+    return np.fromiter(islice(rank_lazily(bm25.get_scores(query), k), k), dtype=np.int64, count=k)
+
+
+def sample_queries(bm25: BM25Index, term_probabilities: np.ndarray, num_queries: int,
+                   rng: np.random.Generator) -> Dict[str, List[List[str]]]:
+    num_terms = len(term_probabilities)
+    document_frequencies = bm25.inverted_index.document_frequencies
+    mid_frequency_terms = np.flatnonzero((document_frequencies > 200) & (document_frequencies < 5000))
+    return {
+        'zipf': [[str(term) for term in rng.choice(num_terms, size=rng.integers(2, 6), p=term_probabilities)]
+                 for _ in range(num_queries)],
+        'mixed': [[str(rng.integers(0, 20))] + [str(term)
+                                                for term in rng.choice(mid_frequency_terms, size=rng.integers(1, 4))]
+                  for _ in range(num_queries)],
+        'mid': [[str(term) for term in rng.choice(mid_frequency_terms, size=rng.integers(2, 5))]
+                for _ in range(num_queries)],
+    }
+
+
+def median_time(get_top_k: Callable[[List[str]], object], query: List[str], repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        get_top_k(query)
+        times.append(perf_counter() - start)
+    return float(np.median(times))
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Compare the speed of BM25Index.get_top_k with dynamic pruning and with '
+                                        'exhaustive scoring on a synthetic corpus with Zipfian term frequencies.')
+    parser.add_argument('--num-documents', type=int, default=300000)
+    parser.add_argument('--num-terms', type=int, default=50000)
+    parser.add_argument('--num-queries', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=11)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    bm25, term_probabilities = build_index(args.num_documents, args.num_terms, rng)
+    for name, queries in sample_queries(bm25, term_probabilities, args.num_queries, rng).items():
+        pruned_times, exhaustive_times = [], []
+        for query in queries:
+            positions, _ = bm25.get_top_k(query, args.k)
+            assert np.array_equal(positions, get_exhaustive_top_k(bm25, query, args.k))
+            pruned_times.append(median_time(lambda query: bm25.get_top_k(query, args.k), query, args.repeats))
+            exhaustive_times.append(median_time(lambda query: get_exhaustive_top_k(bm25, query, args.k), query,
+                                                args.repeats))
+        pruned_times, exhaustive_times = np.array(pruned_times), np.array(exhaustive_times)
+        print('{:6s} pruned {:7.1f} ms, exhaustive {:7.1f} ms, speed-up {:.2f}x, worst query {:.2f}x'.format(
+            name, pruned_times.sum() * 1e3, exhaustive_times.sum() * 1e3,
+            exhaustive_times.sum() / pruned_times.sum(), (exhaustive_times / pruned_times).min()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Dict, Optional
+
+import torch
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from pv211_utils.cranfield.entities import CranfieldDocumentBase, CranfieldQueryBase
+from pv211_utils.cranfield.loader import load_documents, load_judgements, load_queries
+from pv211_utils.databases.faiss_vector_db import FaissVectorDB
+from pv211_utils.evaluation_metrics import normalized_discounted_cumulative_gain
+from pv211_utils.systems import RankerSystem
+
+
+class Query(CranfieldQueryBase):
+    def __str__(self) -> str:
+        return self.body
+
+
+class Document(CranfieldDocumentBase):
+    def __str__(self) -> str:
+        return '{} {}'.format(self.title, self.body)
+
+
+def benchmark(retriever: SentenceTransformer, reranker: CrossEncoder, quantize: bool, num_threads: Optional[int],
+              k: int) -> Dict[str, float]:
+    queries = load_queries(Query)
+    documents = load_documents(Document)
+    judgements = load_judgements(queries, documents)
+
+    start = perf_counter()
+    system = RankerSystem(retriever, reranker, FaissVectorDB(), documents, quantize=quantize,
+                          num_threads=num_threads)
+    indexing_time = perf_counter() - start
+
+    start = perf_counter()
+    ndcg = normalized_discounted_cumulative_gain(system, queries, judgements, k, num_processes=1)
+    search_time = perf_counter() - start
+
+    return {'indexing_time': indexing_time, 'search_time': search_time, 'ndcg': ndcg}
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Compare the speed and the nDCG of RankerSystem on Cranfield with float32 '
+                                        'models and with models whose linear layers are quantized to int8.')
+    parser.add_argument('--retriever', default='sentence-transformers/all-mpnet-base-v2')
+    parser.add_argument('--reranker', default='cross-encoder/ms-marco-MiniLM-L-6-v2')
+    parser.add_argument('--num-threads', type=int, default=None)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    retriever = SentenceTransformer(args.retriever, device='cpu')
+    reranker = CrossEncoder(args.reranker, device='cpu')
+    print('Intra-op threads: {}'.format(args.num_threads or torch.get_num_threads()))
+
+    results = {name: benchmark(retriever, reranker, quantize, args.num_threads, args.k)
+               for name, quantize in [('float32', False), ('int8', True)]}
+    for name, result in results.items():
+        print('{:8s} indexing {:8.2f} s, search {:8.2f} s, nDCG@{} {:.4f}'.format(
+            name, result['indexing_time'], result['search_time'], args.k, result['ndcg']))
+
+    baseline, quantized = results['float32'], results['int8']
+    print('Speed-up: indexing {:.2f}x, search {:.2f}x, nDCG@{} delta {:+.4f}'.format(
+        baseline['indexing_time'] / quantized['indexing_time'], baseline['search_time'] / quantized['search_time'],
+        args.k, quantized['ndcg'] - baseline['ndcg']))
+
+
+if __name__ == '__main__':
+    main()
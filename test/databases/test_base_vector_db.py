@@ -0,0 +1,28 @@
+import unittest
+
+import numpy as np
+
+from pv211_utils.databases.base_vector_db import BaseVectorDB
+
+
+class ListVectorDB(BaseVectorDB):
+    def __init__(self):
+        self.embeddings = []
+
+    def add(self, embeddings):
+        self.embeddings.extend(embeddings)
+
+    def search(self, query_embedding, top_k):
+        scores = np.array([embedding @ query_embedding for embedding in self.embeddings])
+        return list(np.argsort(-scores, kind='stable')[:top_k])
+
+
+class TestBaseVectorDB(unittest.TestCase):
+    def test_search_batch(self):
+        vector_db = ListVectorDB()
+        vector_db.add(np.eye(3, dtype=np.float32))
+        query_embeddings = np.array([[0.0, 1.0, 0.5], [1.0, 0.0, 0.0]], dtype=np.float32)
+        scores, positions = vector_db.search_batch(query_embeddings, 5)
+        np.testing.assert_array_equal([[1, 2, 0, -1, -1], [0, 1, 2, -1, -1]], positions)
+        self.assertTrue(np.isnan(scores[:, :3]).all())
+        self.assertTrue(np.isneginf(scores[:, 3:]).all())
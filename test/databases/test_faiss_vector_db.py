@@ -0,0 +1,162 @@
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from pv211_utils.databases.faiss_vector_db import FaissVectorDB
+
+
+def get_embeddings(num_embeddings, seed):
+    rng = np.random.default_rng(seed)
+    centroids = np.random.default_rng(0).standard_normal((20, 32))
+    embeddings = centroids[rng.integers(0, 20, num_embeddings)] + 0.5 * rng.standard_normal((num_embeddings, 32))
+    embeddings = embeddings.astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class TestFaissVectorDB(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = get_embeddings(2000, 1)
+        self.query_embeddings = get_embeddings(20, 2)
+
+    def get_recall(self, vector_db, embeddings):
+        expected_vector_db = FaissVectorDB()
+        expected_vector_db.add(embeddings)
+        recall = 0.0
+        for query_embedding in self.query_embeddings:
+            expected_positions = expected_vector_db.search(query_embedding, 10)
+            positions = vector_db.search(query_embedding, 10)
+            self.assertEqual(10, len(positions))
+            recall += len(set(expected_positions) & set(positions)) / 10
+        return recall / len(self.query_embeddings)
+
+    def test_index_types(self):
+        for index_type in ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8'):
+            with self.subTest(index_type=index_type):
+                vector_db = FaissVectorDB(index_type=index_type, nprobe=4)
+                vector_db.add(self.embeddings[:1500])
+                vector_db.add(self.embeddings[1500:])
+                self.assertGreaterEqual(self.get_recall(vector_db, self.embeddings), 0.8)
+
+    def test_search_parameters(self):
+        vector_db = FaissVectorDB(index_type='ivf_flat', num_lists=32, nprobe=1)
+        vector_db.add(self.embeddings)
+        self.assertLess(self.get_recall(vector_db, self.embeddings), 1.0)
+        vector_db.set_search_parameters(nprobe=32)
+        self.assertEqual(1.0, self.get_recall(vector_db, self.embeddings))
+
+        vector_db = FaissVectorDB(index_type='hnsw')
+        vector_db.add(self.embeddings)
+        vector_db.set_search_parameters(ef_search=2000)
+        self.assertEqual(1.0, self.get_recall(vector_db, self.embeddings))
+
+    def test_remove(self):
+        removed_positions = [0, 1499, 1500, 1999]
+        remaining_embeddings = np.delete(self.embeddings, removed_positions, axis=0)
+        for index_type in ('flat', 'ivf_flat', 'sq8'):
+            with self.subTest(index_type=index_type):
+                vector_db = FaissVectorDB(index_type=index_type, nprobe=64)
+                vector_db.add(self.embeddings[:1500])
+                vector_db.add(self.embeddings[1500:])
+                self.assertTrue(vector_db.supports_removal)
+                vector_db.remove(removed_positions)
+                self.assertEqual(1.0, self.get_recall(vector_db, remaining_embeddings))
+
+        # the float32 embeddings of compressed embeddings are removed from their shards
+        vector_db = FaissVectorDB('float16')
+        vector_db.add(self.embeddings[:1500])
+        vector_db.add(self.embeddings[1500:])
+        kept_shard = vector_db.embeddings[1]
+        vector_db.remove([0, 1499])
+        self.assertIs(kept_shard, vector_db.embeddings[1])
+        vector_db.remove(range(1498, 1998))
+        self.assertEqual([1498], [len(embeddings) for embeddings in vector_db.embeddings])
+        np.testing.assert_array_equal(self.embeddings[1:1499], vector_db.embeddings[0])
+
+        vector_db = FaissVectorDB(index_type='hnsw')
+        vector_db.add(self.embeddings)
+        self.assertFalse(vector_db.supports_removal)
+        with self.assertRaises(NotImplementedError):
+            vector_db.remove(removed_positions)
+
+    def test_invalid_index_types(self):
+        with self.assertRaises(ValueError):
+            FaissVectorDB(index_type='lsh')
+        with self.assertRaises(ValueError):
+            FaissVectorDB(compression='int8', index_type='ivf_pq')
+
+    def test_search_batch(self):
+        exact_scores = self.query_embeddings @ self.embeddings.T
+        for compression in (None, 'int8'):
+            with self.subTest(compression=compression):
+                vector_db = FaissVectorDB(compression)
+                vector_db.add(self.embeddings)
+                scores, positions = vector_db.search_batch(self.query_embeddings, 10)
+                self.assertEqual((20, 10), scores.shape)
+                self.assertEqual((20, 10), positions.shape)
+                np.testing.assert_allclose(np.sort(exact_scores, axis=1)[:, ::-1][:, :10], scores, rtol=1e-5)
+                for query_embedding, query_positions in zip(self.query_embeddings, positions):
+                    self.assertEqual(vector_db.search(query_embedding, 10), query_positions.tolist())
+
+        vector_db = FaissVectorDB()
+        vector_db.add(self.embeddings[:5])
+        scores, positions = vector_db.search_batch(self.query_embeddings, 10)
+        np.testing.assert_array_equal(np.full((20, 5), -1), positions[:, 5:])
+        np.testing.assert_array_equal(np.full((20, 5), -np.inf), scores[:, 5:])
+        self.assertEqual(5, len(vector_db.search(self.query_embeddings[0], 10)))
+
+    def test_ids(self):
+        for index_type in ('flat', 'ivf_flat'):
+            with self.subTest(index_type=index_type):
+                vector_db = FaissVectorDB(index_type=index_type, nprobe=64)
+                self.assertEqual(0, len(vector_db))
+                vector_db.add(self.embeddings[:1000], ids=np.arange(1000) * 2 + 10000)
+                vector_db.add(self.embeddings[1000:1500])
+                vector_db.add(self.embeddings[1500:])
+                self.assertEqual(2000, len(vector_db))
+                np.testing.assert_array_equal([0, 1000, 1500, -1], vector_db.get_positions([10000, 11999, 12499, 7]))
+
+                with self.assertRaises(ValueError):
+                    vector_db.add(self.embeddings[:1], ids=[11999])
+                with self.assertRaises(KeyError):
+                    vector_db.remove_ids([7])
+
+                vector_db.remove_ids([10000, 11999])
+                vector_db.remove([1497])
+                self.assertEqual(1997, len(vector_db))
+                np.testing.assert_array_equal([-1, -1, 999, 1497],
+                                              vector_db.get_positions([10000, 11999, 12000, 12499]))
+                remaining_embeddings = np.delete(self.embeddings, [0, 1000, 1499], axis=0)
+                self.assertEqual(1.0, self.get_recall(vector_db, remaining_embeddings))
+
+    def test_save_and_load(self):
+        for index_type, compression in [('flat', None), ('ivf_flat', None), ('hnsw', None), ('flat', 'pca'),
+                                        ('flat', 'int8')]:
+            for mmap in (True, False):
+                with self.subTest(index_type=index_type, compression=compression, mmap=mmap), \
+                        TemporaryDirectory() as directory:
+                    vector_db = FaissVectorDB(compression, index_type=index_type, nprobe=64, ef_search=128)
+                    vector_db.add(self.embeddings[:1500])
+                    vector_db.save(directory)
+
+                    loaded_vector_db = FaissVectorDB.load(directory, mmap=mmap)
+                    self.assertEqual(1500, len(loaded_vector_db))
+                    self.assertEqual(64, loaded_vector_db.nprobe)
+                    self.assertEqual(128, loaded_vector_db.ef_search)
+                    for expected, actual in zip(vector_db.search_batch(self.query_embeddings, 10),
+                                                loaded_vector_db.search_batch(self.query_embeddings, 10)):
+                        np.testing.assert_array_equal(expected, actual)
+
+                    # a memory-mapped index is read into memory before it changes
+                    for changed_vector_db in (vector_db, loaded_vector_db):
+                        changed_vector_db.add(self.embeddings[1500:])
+                        if changed_vector_db.supports_removal:
+                            changed_vector_db.remove_ids([0])
+                    self.assertEqual(len(vector_db), len(loaded_vector_db))
+                    for expected, actual in zip(vector_db.search_batch(self.query_embeddings, 10),
+                                                loaded_vector_db.search_batch(self.query_embeddings, 10)):
+                        np.testing.assert_array_equal(expected, actual)
+
+                    # the saved database is replaced while it is memory-mapped
+                    loaded_vector_db.save(directory)
+                    self.assertEqual(len(vector_db), len(FaissVectorDB.load(directory)))
@@ -0,0 +1,104 @@
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from pv211_utils.databases.numpy_vector_db import NumpyVectorDB
+
+
+def get_top_k(embeddings, query_embeddings, top_k):
+    scores = query_embeddings @ embeddings.T
+    positions = np.broadcast_to(np.arange(len(embeddings)), scores.shape)
+    order = np.lexsort((positions, -scores), axis=1)[:, :top_k]
+    return np.take_along_axis(scores, order, axis=1), order
+
+
+class TestNumpyVectorDB(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.standard_normal((2000, 16)).astype(np.float32)
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        self.embeddings[[100, 1500]] = self.embeddings[7]
+        self.query_embeddings = rng.standard_normal((20, 16)).astype(np.float32)
+        self.query_embeddings[0] = self.embeddings[7]
+
+    def test_search_batch(self):
+        for dtype in ('float32', 'float16'):
+            with self.subTest(dtype=dtype):
+                vector_db = NumpyVectorDB(dtype, block_size=300)
+                vector_db.add(self.embeddings[:1000])
+                vector_db.add(self.embeddings[1000:])
+                self.assertEqual(2000, len(vector_db))
+
+                stored_embeddings = self.embeddings.astype(dtype).astype(np.float32)
+                expected_scores, expected_positions = get_top_k(stored_embeddings, self.query_embeddings, 10)
+                scores, positions = vector_db.search_batch(self.query_embeddings, 10)
+                np.testing.assert_array_equal(expected_positions, positions)
+                np.testing.assert_allclose(expected_scores, scores, rtol=1e-5)
+                self.assertEqual([7, 100, 1500], positions[0, :3].tolist())
+                self.assertEqual(positions[1].tolist(), vector_db.search(self.query_embeddings[1], 10))
+
+    def test_fewer_embeddings_than_top_k(self):
+        vector_db = NumpyVectorDB(block_size=3)
+        scores, positions = vector_db.search_batch(self.query_embeddings, 10)
+        np.testing.assert_array_equal(np.full((20, 10), -1), positions)
+        vector_db.add(self.embeddings[:5])
+        scores, positions = vector_db.search_batch(self.query_embeddings, 10)
+        np.testing.assert_array_equal(np.full((20, 5), -1), positions[:, 5:])
+        np.testing.assert_array_equal(np.full((20, 5), -np.inf), scores[:, 5:])
+        self.assertEqual(5, len(vector_db.search(self.query_embeddings[0], 10)))
+        _, expected_positions = get_top_k(self.embeddings[:5], self.query_embeddings, 5)
+        np.testing.assert_array_equal(expected_positions, positions[:, :5])
+
+    def test_zero_top_k(self):
+        vector_db = NumpyVectorDB(block_size=300)
+        vector_db.add(self.embeddings)
+        scores, positions = vector_db.search_batch(self.query_embeddings, 0)
+        self.assertEqual((20, 0), scores.shape)
+        self.assertEqual((20, 0), positions.shape)
+        self.assertEqual([], vector_db.search(self.query_embeddings[0], 0))
+        with self.assertRaises(ValueError):
+            vector_db.search_batch(self.query_embeddings, -1)
+
+    def test_select_top_k(self):
+        scores = np.array([[0.5, 0.2, 0.9]], dtype=np.float32)
+        positions = np.array([[0, 1, 2]])
+        top_scores, top_positions = NumpyVectorDB._select_top_k(scores, positions, 0)
+        self.assertEqual((1, 0), top_positions.shape)
+        top_scores, top_positions = NumpyVectorDB._select_top_k(scores, positions, 5)
+        self.assertEqual([2, 0, 1, -1, -1], top_positions[0].tolist())
+        np.testing.assert_array_equal(np.array([0.9, 0.5, 0.2, -np.inf, -np.inf], dtype=np.float32), top_scores[0])
+
+    def test_remove(self):
+        vector_db = NumpyVectorDB(block_size=300)
+        vector_db.add(self.embeddings[:1000])
+        vector_db.add(self.embeddings[1000:1001])
+        vector_db.add(self.embeddings[1001:])
+        vector_db.remove([7, 999, 1000])
+        self.assertEqual(1997, len(vector_db))
+        self.assertEqual(2, len(vector_db.matrices))
+
+        remaining_embeddings = np.delete(self.embeddings, [7, 999, 1000], axis=0)
+        _, expected_positions = get_top_k(remaining_embeddings, self.query_embeddings, 10)
+        np.testing.assert_array_equal(expected_positions, vector_db.search_batch(self.query_embeddings, 10)[1])
+
+    def test_save_and_load(self):
+        vector_db = NumpyVectorDB('float16', block_size=300)
+        vector_db.add(self.embeddings[:1000])
+        vector_db.add(self.embeddings[1000:])
+        expected = vector_db.search_batch(self.query_embeddings, 10)
+        for mmap in (True, False):
+            with self.subTest(mmap=mmap), TemporaryDirectory() as directory:
+                vector_db.save(directory)
+                loaded_vector_db = NumpyVectorDB.load(directory, mmap=mmap)
+                self.assertEqual('float16', loaded_vector_db.dtype)
+                self.assertEqual(300, loaded_vector_db.block_size)
+                self.assertEqual(2000, len(loaded_vector_db))
+                for expected_array, array in zip(expected, loaded_vector_db.search_batch(self.query_embeddings, 10)):
+                    np.testing.assert_array_equal(expected_array, array)
+
+                loaded_vector_db.remove([0])
+                loaded_vector_db.add(self.embeddings[:1])
+                self.assertEqual(2000, len(loaded_vector_db))
+                loaded_vector_db.save(directory)
+                self.assertEqual(2000, len(NumpyVectorDB.load(directory)))
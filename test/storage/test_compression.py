@@ -0,0 +1,128 @@
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from pv211_utils.databases.faiss_vector_db import FaissVectorDB
+from pv211_utils.storage.compression import (CompressedEmbeddings, EmbeddingCompressor, get_compression_report,
+                                             rank_rescored_first)
+from pv211_utils.storage.shards import ShardStore
+
+
+def get_embeddings(num_embeddings, seed):
+    embeddings = np.random.default_rng(seed).standard_normal((num_embeddings, 32)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class TestEmbeddingCompressor(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = get_embeddings(500, 0)
+        self.query_embeddings = get_embeddings(20, 1)
+        self.scores = self.query_embeddings @ self.embeddings.T
+
+    def test_scores_approximate_dot_products(self):
+        for compression, dtype, tolerance in [('float16', np.float16, 1e-3), ('int8', np.uint8, 0.05)]:
+            compressor = EmbeddingCompressor(compression).fit(self.embeddings)
+            codes = compressor.compress(self.embeddings)
+            self.assertEqual(dtype, codes.dtype)
+            self.assertEqual(self.embeddings.shape, codes.shape)
+            np.testing.assert_allclose(self.scores, compressor.get_scores(codes, self.query_embeddings),
+                                       atol=tolerance)
+            np.testing.assert_allclose(self.scores[0], compressor.get_scores(codes, self.query_embeddings[0]),
+                                       atol=tolerance)
+
+    def test_pca_with_all_components_is_exact(self):
+        compressor = EmbeddingCompressor('pca', 32).fit(self.embeddings)
+        codes = compressor.compress(self.embeddings)
+        self.assertEqual((500, 32), codes.shape)
+        np.testing.assert_allclose(self.scores, compressor.get_scores(codes, self.query_embeddings), atol=1e-5)
+
+        compressor = EmbeddingCompressor('pca').fit(self.embeddings)
+        self.assertEqual(8, compressor.num_components)
+        self.assertEqual((500, 8), compressor.compress(self.embeddings).shape)
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            EmbeddingCompressor('int4')
+
+
+class TestCompressedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.embeddings = get_embeddings(500, 0)
+        self.query_embeddings = get_embeddings(20, 1)
+        self.scores = self.query_embeddings @ self.embeddings.T
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_rescored_scores_are_exact(self):
+        compressor = EmbeddingCompressor('pca', 4).fit(self.embeddings)
+        stored_embeddings = ShardStore(self.directory.name).store_array(self.embeddings)
+        compressed_embeddings = CompressedEmbeddings(compressor, compressor.compress(self.embeddings),
+                                                     stored_embeddings)
+        self.assertEqual(500, len(compressed_embeddings))
+
+        scores, rescored = compressed_embeddings.get_scores(self.query_embeddings, 50)
+        self.assertEqual(self.scores.shape, scores.shape)
+        np.testing.assert_array_equal(np.full(20, 50), rescored.sum(axis=1))
+        np.testing.assert_allclose(self.scores[rescored], scores[rescored], atol=1e-6)
+
+        query_scores, query_rescored = compressed_embeddings.get_scores(self.query_embeddings[0], 50)
+        np.testing.assert_array_equal(rescored[0], query_rescored)
+        np.testing.assert_allclose(scores[0][query_rescored], query_scores[query_rescored], atol=1e-6)
+
+    def test_rescored_are_ranked_first(self):
+        scores = np.array([[0.9, 0.5, 0.4, 0.1], [0.2, 0.3, 0.8, 0.1]])
+        rescored = np.array([[False, True, True, False], [True, True, False, False]])
+        ranked_scores = rank_rescored_first(scores, rescored)
+        np.testing.assert_array_equal([[1, 2, 0, 3], [1, 0, 2, 3]], np.argsort(-ranked_scores, kind='stable'))
+        np.testing.assert_array_equal(scores[rescored], ranked_scores[rescored])
+        np.testing.assert_array_equal(scores, rank_rescored_first(scores, np.zeros(scores.shape, dtype=bool)))
+
+    def test_compression_report(self):
+        report = get_compression_report(self.embeddings, self.query_embeddings, 10,
+                                        ['float16', 'int8', ('pca', 4)])
+        self.assertEqual(['float32', 'float16', 'int8', 'pca4'], [row['compression'] for row in report])
+        self.assertEqual([128, 64, 32, 16], [row['bytes_per_embedding'] for row in report])
+        self.assertEqual([1.0, 0.5, 0.25, 0.125], [row['memory'] for row in report])
+        for row in report:
+            self.assertGreaterEqual(row['rescored_recall'], row['recall'])
+        self.assertEqual(1.0, report[1]['rescored_recall'])
+        self.assertEqual(1.0, report[2]['rescored_recall'])
+
+
+class TestCompressedFaissVectorDB(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.embeddings = get_embeddings(500, 0)
+        self.query_embeddings = get_embeddings(20, 1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def search(self, vector_db):
+        return [vector_db.search(query_embedding, 10) for query_embedding in self.query_embeddings]
+
+    def test_same_results_as_uncompressed(self):
+        expected_vector_db = FaissVectorDB()
+        expected_vector_db.add(self.embeddings)
+        for compression in ('float16', 'int8'):
+            vector_db = FaissVectorDB(compression, shard_directory=self.directory.name)
+            vector_db.add(self.embeddings[:300])
+            vector_db.add(self.embeddings[300:])
+            self.assertEqual(self.search(expected_vector_db), self.search(vector_db))
+
+        vector_db = FaissVectorDB('pca', 32, shard_directory=self.directory.name)
+        vector_db.add(self.embeddings)
+        self.assertEqual(self.search(expected_vector_db), self.search(vector_db))
+
+    def test_remove(self):
+        vector_db = FaissVectorDB('int8', shard_directory=self.directory.name)
+        vector_db.add(self.embeddings[:300])
+        vector_db.add(self.embeddings[300:])
+        vector_db.remove([0, 299, 300])
+
+        expected_vector_db = FaissVectorDB()
+        expected_vector_db.add(np.delete(self.embeddings, [0, 299, 300], axis=0))
+        self.assertEqual(self.search(expected_vector_db), self.search(vector_db))
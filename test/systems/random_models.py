@@ -0,0 +1,24 @@
+from pathlib import Path
+import re
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+
+
+def save_random_bert(directory: str, hidden_size: int, **config):
+    """Save a small randomly initialized BERT with a single label that does not have to be downloaded.
+
+    The vocabulary contains the words of the test documents and queries, so that they are not unknown tokens.
+    The model can be loaded both as a CrossEncoder and as a SentenceTransformer.
+    """
+    texts = [str(document) for document in DOCUMENTS.values()] + [str(case["query"]) for case in TRIVIAL_TEST_CASES]
+    words = sorted({word for text in texts for word in re.findall(r'\w+|[^\w\s]', text.lower())})
+    vocabulary = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words
+    (Path(directory) / 'vocab.txt').write_text('\n'.join(vocabulary))
+    BertTokenizerFast.from_pretrained(directory).save_pretrained(directory)
+    torch.manual_seed(42)
+    config = BertConfig(vocab_size=len(vocabulary), hidden_size=hidden_size, num_hidden_layers=1,
+                        num_attention_heads=2, intermediate_size=2 * hidden_size, num_labels=1, **config)
+    BertForSequenceClassification(config).save_pretrained(directory)
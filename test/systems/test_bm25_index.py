@@ -0,0 +1,138 @@
+import unittest
+from contextlib import nullcontext
+from unittest.mock import patch
+
+import numpy as np
+from rank_bm25 import BM25L, BM25Okapi, BM25Plus
+from scipy.sparse import csr_matrix
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+
+from pv211_utils.systems.bm25 import BM25PlusSystem
+from pv211_utils.systems.bm25_index import BM25Index
+from pv211_utils.systems.inverted_index import InvertedIndex
+from pv211_utils.preprocessing.text_preprocessing import DocPreprocessing
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.preprocessing = DocPreprocessing()
+        self.corpus = [self.preprocessing(str(document)) for document in DOCUMENTS.values()]
+        self.queries = [self.preprocessing(str(case["query"])) for case in TRIVIAL_TEST_CASES]
+        self.queries.append(["bee", "bee", "beekeeping", "unknown"])
+        self.inverted_index = InvertedIndex(self.corpus)
+
+    def test_scores_match_rank_bm25(self):
+        reference_models = {
+            'plus': BM25Plus(self.corpus, k1=1.25, b=0.75, delta=1),
+            'okapi': BM25Okapi(self.corpus, k1=1.25, b=0.75),
+            'l': BM25L(self.corpus, k1=1.25, b=0.75, delta=1),
+        }
+        for variant, reference_model in reference_models.items():
+            bm25 = BM25Index(self.inverted_index, variant, k1=1.25, b=0.75, d=1)
+            for query in self.queries:
+                with self.subTest(variant=variant, query=query):
+                    np.testing.assert_allclose(reference_model.get_scores(query), bm25.get_scores(query))
+
+    def test_native_engine_ranking(self):
+        reference_system = BM25PlusSystem(DOCUMENTS, self.preprocessing)
+        native_system = BM25PlusSystem(DOCUMENTS, self.preprocessing, engine='native')
+        for case in TRIVIAL_TEST_CASES:
+            with self.subTest(test=case["test_name"]):
+                query = self.preprocessing(str(case["query"]))
+                np.testing.assert_allclose(reference_system.bm25.get_scores(query),
+                                           native_system.bm25.get_scores(query), rtol=1e-12, atol=1e-12)
+                reference_results = [document.text for document in reference_system.search(case["query"])]
+                native_results = [document.text for document in native_system.search(case["query"])]
+                self.assertEqual(reference_results, native_results)
+
+    def test_search_batch(self):
+        system = BM25PlusSystem(DOCUMENTS, self.preprocessing, engine='native')
+        queries = [case["query"] for case in TRIVIAL_TEST_CASES]
+        for k in (None, 3):
+            for query, results in zip(queries, system.search_batch(queries, k)):
+                with self.subTest(k=k, query=str(query)):
+                    expected_results = [document.text for document in system.search(query)][:k]
+                    self.assertEqual(expected_results, [document.text for document in results])
+
+    def test_with_parameters(self):
+        for engine in ('rank_bm25', 'native'):
+            system = BM25PlusSystem(DOCUMENTS, self.preprocessing, engine=engine)
+            for k1, b, d in ((0.9, 0.4, 0.5), (2.0, 1.0, 1.5)):
+                with self.subTest(engine=engine, k1=k1, b=b, d=d):
+                    expected_system = BM25PlusSystem(DOCUMENTS, self.preprocessing, k1=k1, b=b, d=d, engine=engine)
+                    swept_system = system.with_parameters(k1=k1, b=b, d=d)
+                    for query in self.queries:
+                        np.testing.assert_allclose(expected_system.bm25.get_scores(query),
+                                                   swept_system.bm25.get_scores(query))
+        native_system = BM25PlusSystem(DOCUMENTS, self.preprocessing, engine='native')
+        okapi_system = native_system.with_parameters(variant='okapi')
+        np.testing.assert_allclose(BM25Okapi(self.corpus, k1=1.25, b=0.75).get_scores(self.queries[0]),
+                                   okapi_system.bm25.get_scores(self.queries[0]))
+        with self.assertRaises(ValueError):
+            BM25PlusSystem(DOCUMENTS, self.preprocessing).with_parameters(variant='okapi')
+
+    def test_top_k_matches_exhaustive_ranking(self):
+        rng = np.random.default_rng(42)
+        term_probabilities = 1 / np.arange(1, 501)
+        term_probabilities /= term_probabilities.sum()
+        corpus = [[str(term) for term in rng.choice(500, size=rng.integers(1, 30), p=term_probabilities)]
+                  for _ in range(5000)]
+        queries = [[str(term) for term in rng.choice(500, size=rng.integers(1, 5))] for _ in range(30)]
+        queries.extend([[], ["unknown"], ["0", "0", "499"]])
+        inverted_index = InvertedIndex(corpus)
+        for variant in ('plus', 'okapi', 'l'):
+            bm25 = BM25Index(inverted_index, variant, block_size=64)
+            for query in queries:
+                scores = bm25.get_scores(query)
+                exhaustive_ranking = np.lexsort((np.arange(len(scores)), -scores))
+                for k in (1, 10, 100, 6000):
+                    for pruning in (False, True):
+                        with self.subTest(variant=variant, query=query, k=k, pruning=pruning), \
+                                self._force_pruning(pruning):
+                            positions, top_scores = bm25.get_top_k(query, k)
+                            np.testing.assert_array_equal(exhaustive_ranking[:k], positions)
+                            np.testing.assert_array_equal(scores[exhaustive_ranking[:k]], top_scores)
+
+    @staticmethod
+    def _force_pruning(pruning: bool):
+        if not pruning:
+            return nullcontext()
+        costs = {'PRUNING_OVERHEAD_COST': 0, 'PRUNING_LOOKUP_COST': 0}
+        return patch.multiple('pv211_utils.systems.bm25_index', **costs)
+
+    def test_top_k_cost_model(self):
+        rng = np.random.default_rng(42)
+        num_documents, num_terms = 200000, 5000
+        term_probabilities = 1 / np.arange(1, num_terms + 1)
+        term_probabilities /= term_probabilities.sum()
+        document_lengths = rng.integers(5, 30, size=num_documents)
+        terms = rng.choice(num_terms, size=document_lengths.sum(), p=term_probabilities)
+        documents = np.repeat(np.arange(num_documents), document_lengths)
+        term_frequencies = csr_matrix((np.ones(len(terms), dtype=np.int32), (terms, documents)),
+                                      shape=(num_terms, num_documents))
+        term_frequencies.sum_duplicates()
+        term_frequencies.sort_indices()
+        vocabulary = {str(term): term for term in range(num_terms)}
+        bm25 = BM25Index(InvertedIndex.from_term_frequencies(term_frequencies, document_lengths, vocabulary))
+
+        # the posting lists of frequent terms are scored exhaustively and those of rare terms are pruned
+        for query, exhaustive in ((["0", "1", "2"], True), (["0", "3000", "4000"], False), (["4000"], False)):
+            with self.subTest(query=query), patch.object(bm25, '_get_exhaustive_top_k',
+                                                         wraps=bm25._get_exhaustive_top_k) as exhaustive_top_k:
+                positions, _ = bm25.get_top_k(query, 10)
+                self.assertEqual(exhaustive, exhaustive_top_k.called)
+                scores = bm25.get_scores(query)
+                np.testing.assert_array_equal(np.lexsort((np.arange(num_documents), -scores))[:10], positions)
+
+    def test_pruned_search(self):
+        exhaustive_system = BM25PlusSystem(DOCUMENTS, self.preprocessing, engine='native')
+        pruned_system = BM25PlusSystem(DOCUMENTS, self.preprocessing, engine='native', k=3)
+        queries = [case["query"] for case in TRIVIAL_TEST_CASES]
+        for query, results in zip(queries, pruned_system.search_batch(queries, 2)):
+            with self.subTest(query=str(query)):
+                expected_results = [document.text for document in exhaustive_system.search(query)]
+                self.assertEqual(expected_results[:3], [document.text for document in pruned_system.search(query)])
+                self.assertEqual(expected_results[:2], [document.text for document in results])
+        with self.assertRaises(ValueError):
+            BM25PlusSystem(DOCUMENTS, self.preprocessing, k=3)
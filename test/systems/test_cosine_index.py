@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+from gensim.corpora import Dictionary
+from gensim.models import TfidfModel
+from gensim.similarities import SparseMatrixSimilarity
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+
+from pv211_utils.systems.cosine_index import CosineIndex
+from pv211_utils.systems.inverted_index import HashingVocabulary, InvertedIndex
+from pv211_utils.preprocessing.text_preprocessing import DocPreprocessing
+
+
+class TestCosineIndex(unittest.TestCase):
+    def setUp(self):
+        preprocessing = DocPreprocessing()
+        self.corpus = [preprocessing(str(document)) for document in DOCUMENTS.values()]
+        self.queries = [preprocessing(str(case["query"])) for case in TRIVIAL_TEST_CASES]
+        self.queries.extend([["bee", "bee", "beekeeping", "unknown"], []])
+        self.inverted_index = InvertedIndex(self.corpus)
+
+    def test_scores_match_gensim(self):
+        corpus, queries = self.corpus, self.queries
+        dictionary = Dictionary(corpus)
+        bags_of_words = [dictionary.doc2bow(document) for document in corpus]
+        tfidf_model = TfidfModel(bags_of_words)
+        tfidf_vectors = tfidf_model[bags_of_words]
+        reference_indexes = {
+            'bow': (SparseMatrixSimilarity(bags_of_words, num_terms=len(dictionary)), lambda vector: vector),
+            'tfidf': (SparseMatrixSimilarity(tfidf_vectors, num_terms=len(dictionary)), tfidf_model.__getitem__),
+        }
+        for weighting, (reference_index, transform) in reference_indexes.items():
+            index = CosineIndex(self.inverted_index, weighting)
+            for query in queries:
+                with self.subTest(weighting=weighting, query=query):
+                    expected_scores = reference_index[transform(dictionary.doc2bow(query))]
+                    np.testing.assert_allclose(expected_scores, index.get_scores(query), atol=1e-6)
+            np.testing.assert_allclose([reference_index[transform(dictionary.doc2bow(query))] for query in queries],
+                                       index.get_batch_scores(queries), atol=1e-6)
+
+    def test_sparse_scores(self):
+        for weighting in ('bow', 'tfidf'):
+            index = CosineIndex(self.inverted_index, weighting)
+            sparse_scores = index.get_sparse_batch_scores(self.queries)
+            self.assertEqual((len(self.queries), len(self.corpus)), sparse_scores.shape)
+            for query, query_sparse_scores in zip(self.queries, sparse_scores):
+                with self.subTest(weighting=weighting, query=query):
+                    np.testing.assert_array_equal(index.get_scores(query), query_sparse_scores.toarray().ravel())
+
+    def test_hashing_vocabulary(self):
+        hashed_inverted_index = InvertedIndex(self.corpus, HashingVocabulary())
+        for weighting in ('bow', 'tfidf'):
+            index = CosineIndex(self.inverted_index, weighting)
+            hashed_index = CosineIndex(hashed_inverted_index, weighting)
+            with self.subTest(weighting=weighting):
+                np.testing.assert_allclose(index.get_batch_scores(self.queries),
+                                           hashed_index.get_batch_scores(self.queries), atol=1e-6)
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from test.systems.data_ir_testset import DOCUMENTS
+
+from pv211_utils.systems.embeddings import EmbeddingStore, QueryEmbeddingCache, get_model_name, normalize_embeddings
+
+
+class TestNormalizeEmbeddings(unittest.TestCase):
+    def test_unit_length(self):
+        embeddings = np.array([[3.0, 4.0], [0.0, 0.0], [1.0, 0.0]])
+        normalized_embeddings = normalize_embeddings(embeddings)
+        self.assertEqual(np.float32, normalized_embeddings.dtype)
+        self.assertTrue(normalized_embeddings.flags.c_contiguous)
+        np.testing.assert_allclose([[0.6, 0.8], [0.0, 0.0], [1.0, 0.0]], normalized_embeddings)
+        np.testing.assert_allclose([0.6, 0.8], normalize_embeddings(embeddings[0]))
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.documents = list(DOCUMENTS.values())
+        self.encoded_texts = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def encode(self, texts):
+        self.encoded_texts.extend(texts)
+        return np.array([[len(text), text.count(' '), 1.0] for text in texts])
+
+    def test_reuse(self):
+        store = EmbeddingStore(self.directory.name)
+        embeddings = store.get_embeddings('model', self.documents, self.encode)
+        self.assertEqual(np.float32, embeddings.dtype)
+        np.testing.assert_array_equal(self.encode([str(document) for document in self.documents]), embeddings)
+
+        self.encoded_texts.clear()
+        reordered_documents = self.documents[::-1]
+        np.testing.assert_array_equal(embeddings[::-1], store.get_embeddings('model', reordered_documents,
+                                                                             self.encode))
+        self.assertEqual([], self.encoded_texts)
+
+    def test_no_documents(self):
+        store = EmbeddingStore(self.directory.name)
+        embeddings = store.get_embeddings('model', [], self.encode)
+        self.assertEqual((0, 0), embeddings.shape)
+        self.assertEqual(np.float32, embeddings.dtype)
+        store.get_embeddings('model', self.documents, self.encode)
+        self.assertEqual((0, 3), store.get_embeddings('model', [], self.encode).shape)
+        self.assertEqual([str(document) for document in self.documents], self.encoded_texts)
+
+    def test_only_new_documents_are_encoded(self):
+        EmbeddingStore(self.directory.name).get_embeddings('model', self.documents[:2], self.encode)
+        self.encoded_texts.clear()
+        changed_document = type(self.documents[0])(self.documents[0].text + ' Bees buzz.')
+
+        # a new instance sees the embeddings stored by the previous one
+        store = EmbeddingStore(self.directory.name)
+        documents = [changed_document] + self.documents
+        embeddings = store.get_embeddings('model', documents, self.encode)
+        self.assertEqual([str(document) for document in [changed_document] + self.documents[2:]], self.encoded_texts)
+        np.testing.assert_array_equal(self.encode([str(document) for document in documents]), embeddings)
+
+        # the embeddings of different models are kept apart
+        self.encoded_texts.clear()
+        store.get_embeddings('other model', self.documents[:1], self.encode)
+        self.assertEqual([str(self.documents[0])], self.encoded_texts)
+
+    def test_get_model_name(self):
+        with self.assertRaises(ValueError):
+            get_model_name(object())
+
+
+class TestQueryEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.encoded_texts = []
+
+    def encode(self, texts):
+        self.encoded_texts.extend(texts)
+        return np.array([[len(text), text.count(' ')] for text in texts])
+
+    def test_hits_and_misses(self):
+        cache = QueryEmbeddingCache(max_size=3)
+        embeddings = cache.get_embeddings('model', ['a', 'b c', 'a'], self.encode)
+        np.testing.assert_array_equal([[1, 0], [3, 1], [1, 0]], embeddings)
+        self.assertEqual(['a', 'b c'], self.encoded_texts)
+        self.assertEqual((0, 3), (cache.hits, cache.misses))
+
+        np.testing.assert_array_equal([[3, 1]], cache.get_embeddings('model', ['b c'], self.encode))
+        cache.get_embeddings('other model', ['a'], self.encode)
+        self.assertEqual(['a', 'b c', 'a'], self.encoded_texts)
+        self.assertEqual((1, 4), (cache.hits, cache.misses))
+
+        # the least recently used embedding of 'a' by 'model' is evicted
+        cache.get_embeddings('model', ['d'], self.encode)
+        self.assertEqual(3, len(cache))
+        cache.get_embeddings('model', ['b c', 'a'], self.encode)
+        self.assertEqual(['a', 'b c', 'a', 'd', 'a'], self.encoded_texts)
+
+    def test_threads(self):
+        cache = QueryEmbeddingCache(max_size=50)
+        texts = [' ' * (number % 100) for number in range(2000)]
+        with ThreadPoolExecutor(4) as executor:
+            embeddings = list(executor.map(lambda text: cache.get_embeddings('model', [text], self.encode)[0], texts))
+        np.testing.assert_array_equal(self.encode(texts), embeddings)
+        self.assertEqual(50, len(cache))
+        self.assertEqual(len(texts), cache.hits + cache.misses)
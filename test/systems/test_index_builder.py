@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from test.systems.data_ir_testset import DOCUMENTS
+
+from pv211_utils.systems.index_builder import build_inverted_index
+from pv211_utils.systems.inverted_index import HashingVocabulary, InvertedIndex
+from pv211_utils.preprocessing.text_preprocessing import DocPreprocessing
+
+
+class TestBuildInvertedIndex(unittest.TestCase):
+    def setUp(self):
+        self.preprocessing = DocPreprocessing()
+        self.documents = list(DOCUMENTS.values())
+
+    def _assert_same_index(self, expected_index, inverted_index):
+        if isinstance(expected_index.vocabulary, dict):
+            self.assertEqual(expected_index.vocabulary, inverted_index.vocabulary)
+        self.assertEqual(expected_index.term_frequencies.shape, inverted_index.term_frequencies.shape)
+        np.testing.assert_array_equal(expected_index.term_frequencies.indptr, inverted_index.term_frequencies.indptr)
+        np.testing.assert_array_equal(expected_index.term_frequencies.indices, inverted_index.term_frequencies.indices)
+        np.testing.assert_array_equal(expected_index.term_frequencies.data, inverted_index.term_frequencies.data)
+        np.testing.assert_array_equal(expected_index.document_lengths, inverted_index.document_lengths)
+        np.testing.assert_array_equal(expected_index.document_frequencies, inverted_index.document_frequencies)
+
+    def test_matches_inverted_index(self):
+        expected_index = InvertedIndex(self.preprocessing(str(document)) for document in self.documents)
+        for num_workers, memory_budget, chunk_size in ((1, 2**20, 256), (2, 2**20, 4), (3, 1, 3), (1, 100, 5)):
+            with self.subTest(num_workers=num_workers, memory_budget=memory_budget, chunk_size=chunk_size):
+                inverted_index = build_inverted_index(self.documents, self.preprocessing, num_workers=num_workers,
+                                                      memory_budget=memory_budget, chunk_size=chunk_size)
+                self._assert_same_index(expected_index, inverted_index)
+
+    def test_shared_vocabulary(self):
+        vocabulary = {}
+        expected_vocabulary = {}
+        for documents in (self.documents[:10], self.documents[10:]):
+            expected_index = InvertedIndex((self.preprocessing(str(document)) for document in documents),
+                                           expected_vocabulary)
+            inverted_index = build_inverted_index(documents, self.preprocessing, vocabulary, num_workers=2,
+                                                  memory_budget=1, chunk_size=4)
+            self._assert_same_index(expected_index, inverted_index)
+
+    def test_hashing_vocabulary(self):
+        expected_index = InvertedIndex((self.preprocessing(str(document)) for document in self.documents),
+                                       HashingVocabulary(7))
+        self.assertEqual(7, expected_index.num_terms)
+        self.assertEqual(expected_index.document_lengths.sum(), expected_index.term_frequencies.sum())
+        inverted_index = build_inverted_index(self.documents, self.preprocessing, HashingVocabulary(7), num_workers=2,
+                                              memory_budget=1, chunk_size=4)
+        self._assert_same_index(expected_index, inverted_index)
+
+        single_bucket_index = InvertedIndex((self.preprocessing(str(document)) for document in self.documents),
+                                            HashingVocabulary(1))
+        np.testing.assert_array_equal(single_bucket_index.document_lengths,
+                                      single_bucket_index.term_frequencies.toarray().ravel())
+
+    def test_empty(self):
+        inverted_index = build_inverted_index([], self.preprocessing)
+        self.assertEqual(0, inverted_index.num_documents)
+        self.assertEqual(0, inverted_index.num_terms)
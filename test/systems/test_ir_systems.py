@@ -19,6 +19,7 @@ from pv211_utils.systems.retriever import RetrieverSystem
 from pv211_utils.systems.tfidf import TfidfSystem
 from pv211_utils.preprocessing.text_preprocessing import DocPreprocessing
 from pv211_utils.databases.faiss_vector_db import FaissVectorDB
+from pv211_utils.databases.numpy_vector_db import NumpyVectorDB
 
 
 class TestIRSystems(unittest.TestCase):
@@ -34,7 +35,10 @@ class TestIRSystems(unittest.TestCase):
             TfidfSystem(DOCUMENTS, doc_preprocessing),
             RankerSystem(retriever_model, reranker_model, faiss, DOCUMENTS),
             RerankerSystem(retriever_model, reranker_model, DOCUMENTS),
-            RetrieverSystem(retriever_model, DOCUMENTS)
+            RetrieverSystem(retriever_model, DOCUMENTS),
+            RankerSystem(retriever_model, reranker_model, FaissVectorDB(compression='int8'), DOCUMENTS),
+            RankerSystem(retriever_model, reranker_model, NumpyVectorDB(), DOCUMENTS),
+            RetrieverSystem(retriever_model, DOCUMENTS, compression='int8'),
         ]
 
         self.doc_text_to_id_map = {doc.text: doc_id for doc_id, doc in DOCUMENTS.items()}
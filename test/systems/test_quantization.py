@@ -0,0 +1,57 @@
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+import torch
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+from test.systems.random_models import save_random_bert
+
+from pv211_utils.systems.embeddings import get_model_name
+from pv211_utils.systems.quantization import QUANTIZED_MODEL_SUFFIX, is_quantized, quantize_model
+from pv211_utils.systems.reranker import RerankerSystem
+
+
+class TestQuantizeModel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = TemporaryDirectory()
+        cls.document_texts = [str(document) for document in DOCUMENTS.values()]
+        cls.query_texts = [str(case["query"]) for case in TRIVIAL_TEST_CASES]
+        save_random_bert(cls.directory.name, hidden_size=32)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_quantized_copy(self):
+        retriever = SentenceTransformer(self.directory.name, device='cpu')
+        quantized_retriever = quantize_model(retriever)
+        self.assertFalse(is_quantized(retriever))
+        self.assertTrue(is_quantized(quantized_retriever))
+        self.assertEqual(get_model_name(retriever) + QUANTIZED_MODEL_SUFFIX, get_model_name(quantized_retriever))
+
+        embeddings = retriever.encode(self.document_texts)
+        quantized_embeddings = quantized_retriever.encode(self.document_texts)
+        self.assertEqual(embeddings.shape, quantized_embeddings.shape)
+        cosines = np.sum(embeddings * quantized_embeddings, axis=1) / np.linalg.norm(embeddings, axis=1) / \
+            np.linalg.norm(quantized_embeddings, axis=1)
+        self.assertGreater(cosines.min(), 0.99)
+
+    def test_quantized_system(self):
+        retriever = SentenceTransformer(self.directory.name, device='cpu')
+        reranker = CrossEncoder(self.directory.name, device='cpu')
+        num_threads = torch.get_num_threads()
+        system = RerankerSystem(retriever, reranker, DOCUMENTS, quantize=True, num_threads=1)
+        self.assertEqual(1, torch.get_num_threads())
+        torch.set_num_threads(num_threads)
+        self.assertTrue(is_quantized(system.retriever))
+        self.assertTrue(is_quantized(system.reranker))
+        self.assertFalse(is_quantized(reranker))
+
+        pairs = [(query_text, document_text) for query_text in self.query_texts
+                 for document_text in self.document_texts]
+        np.testing.assert_allclose(reranker.predict(pairs), system._predict(pairs), atol=0.05)
+        for case in TRIVIAL_TEST_CASES:
+            self.assertEqual(len(DOCUMENTS), len(list(system.search(case["query"]))))
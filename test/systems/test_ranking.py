@@ -0,0 +1,43 @@
+import unittest
+from itertools import islice
+
+import numpy as np
+
+from pv211_utils.systems.ranking import rank_lazily, rank_sparse_lazily
+
+
+class TestRankLazily(unittest.TestCase):
+    def test_full_ranking(self):
+        scores = np.random.default_rng(42).integers(0, 20, size=1000).astype(float)
+        expected_ranking = np.lexsort((np.arange(len(scores)), -scores)).tolist()
+        for block_size in (1, 3, 10, 100, 2000):
+            with self.subTest(block_size=block_size):
+                self.assertEqual(expected_ranking, list(rank_lazily(scores, block_size)))
+
+    def test_top_k(self):
+        scores = np.array([0.1, 0.5, 0.3, 0.5, 0.9])
+        self.assertEqual([4, 1, 3], list(islice(rank_lazily(scores, 2), 3)))
+
+    def test_nan_scores(self):
+        scores = np.array([0.1, np.nan, 0.5, -np.inf, np.nan, 0.3])
+        for block_size in (1, 2, 100):
+            with self.subTest(block_size=block_size):
+                self.assertEqual([2, 5, 0, 1, 3, 4], list(rank_lazily(scores, block_size)))
+
+    def test_empty(self):
+        self.assertEqual([], list(rank_lazily(np.array([]))))
+
+
+class TestRankSparseLazily(unittest.TestCase):
+    def test_matches_dense_ranking(self):
+        rng = np.random.default_rng(42)
+        scores = rng.integers(0, 5, size=1000) * rng.integers(0, 2, size=1000).astype(float)
+        positions = rng.permutation(np.flatnonzero((scores > 0) | (rng.random(1000) < 0.1)))
+        expected_ranking = list(rank_lazily(scores))
+        for block_size in (1, 10, 2000):
+            with self.subTest(block_size=block_size):
+                ranking = list(rank_sparse_lazily(positions, scores[positions], len(scores), block_size))
+                self.assertEqual(expected_ranking, ranking)
+
+    def test_empty(self):
+        self.assertEqual([0, 1, 2], list(rank_sparse_lazily(np.array([], dtype=int), np.array([]), 3)))
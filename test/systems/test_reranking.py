@@ -0,0 +1,160 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+import os
+from tempfile import TemporaryDirectory
+from threading import Event
+import unittest
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+from test.systems.random_models import save_random_bert
+
+from pv211_utils.systems.reranking import PretokenizedCrossEncoder, RerankScheduler, ScoreCache
+
+
+class TestScoreCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.predicted_pairs = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def predict(self, pairs):
+        self.predicted_pairs.extend(pairs)
+        return np.array([len(query_text) + 0.5 * len(document_text) for query_text, document_text in pairs])
+
+    def test_only_new_pairs_are_scored(self):
+        pairs = [('bees', 'honey'), ('bees', 'wax'), ('cats', 'honey')]
+        cache = ScoreCache(self.directory.name)
+        scores = cache.get_scores('model', pairs[:2], self.predict)
+        self.assertEqual(np.float32, scores.dtype)
+        np.testing.assert_array_equal([6.5, 5.5], scores)
+        self.assertEqual(pairs[:2], self.predicted_pairs)
+
+        # a new instance sees the scores stored by the previous one
+        expected_scores = self.predict(pairs + pairs[:1])
+        self.predicted_pairs.clear()
+        cache = ScoreCache(self.directory.name)
+        np.testing.assert_array_equal(expected_scores, cache.get_scores('model', pairs + pairs[:1], self.predict))
+        self.assertEqual(pairs[2:], self.predicted_pairs)
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+        # the scores of different models are kept apart
+        self.predicted_pairs.clear()
+        cache.get_scores('other model', pairs[:1], self.predict)
+        self.assertEqual(pairs[:1], self.predicted_pairs)
+        np.testing.assert_array_equal([], cache.get_scores('model', [], self.predict))
+
+
+class TestRerankScheduler(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def predict(self, pairs):
+        self.batches.append(pairs)
+        return np.array([len(query_text) + 0.5 * len(document_text) for query_text, document_text in pairs])
+
+    def test_batches_by_length(self):
+        scheduler = RerankScheduler(self.predict, batch_size=2)
+        pairs = [('a', 'bb'), ('a', 'bbbbbb'), ('a', 'b'), ('a', 'bbbbb')]
+        np.testing.assert_array_equal([2.0, 4.0, 1.5, 3.5], scheduler.get_scores(pairs))
+        self.assertEqual([[('a', 'bbbbbb'), ('a', 'bbbbb')], [('a', 'bb'), ('a', 'b')]], self.batches)
+        np.testing.assert_array_equal([], scheduler.get_scores([]))
+
+    def test_concurrent_queries(self):
+        scheduler = RerankScheduler(self.predict, batch_size=64, max_delay=0.05)
+        queries = [str(number) for number in range(40)]
+        with ThreadPoolExecutor(8) as executor:
+            scores = list(executor.map(lambda query: scheduler.get_scores([(query, 'bees'), (query, 'honey')]),
+                                       queries))
+        for query, query_scores in zip(queries, scores):
+            np.testing.assert_array_equal([len(query) + 2.0, len(query) + 2.5], query_scores)
+        self.assertLess(len(self.batches), len(queries))
+        self.assertTrue(all(len(batch) <= 64 for batch in self.batches))
+
+    def test_single_worker(self):
+        scheduler = RerankScheduler(self.predict, max_delay=0.01)
+        scheduler.get_scores([('a', 'bb')])
+        worker = scheduler._worker
+        scheduler.get_scores([('a', 'b')])
+        self.assertIs(worker, scheduler._worker)
+        self.assertTrue(worker.is_alive())
+
+        # a single caller without a delay is scored in its own thread
+        scheduler = RerankScheduler(self.predict)
+        np.testing.assert_array_equal([2.0], scheduler.get_scores([('a', 'bb')]))
+        self.assertIsNone(scheduler._worker)
+
+    def test_fork(self):
+        parent_pid, started, release = os.getpid(), Event(), Event()
+
+        def predict(pairs):
+            if os.getpid() == parent_pid:
+                started.set()
+                release.wait()
+            return self.predict(pairs)
+
+        scheduler = RerankScheduler(predict, max_delay=0.01)
+        context = get_context('fork')
+        results = context.Queue()
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(scheduler.get_scores, [('bees', 'honey')])
+            started.wait()
+            # the child is forked while the worker of the parent is scoring
+            process = context.Process(target=lambda: results.put(scheduler.get_scores([('a', 'bb')]).tolist()))
+            process.start()
+            try:
+                self.assertEqual([2.0], results.get(timeout=10))
+            finally:
+                release.set()
+                process.join(10)
+                process.kill()
+            np.testing.assert_array_equal([6.5], future.result())
+
+    def test_errors(self):
+        def predict(pairs):
+            raise RuntimeError('out of memory')
+
+        with self.assertRaises(RuntimeError):
+            RerankScheduler(predict).get_scores([('bees', 'honey')])
+
+
+class TestPretokenizedCrossEncoder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = TemporaryDirectory()
+        cls.document_texts = [str(document) for document in DOCUMENTS.values()]
+        cls.query_texts = [str(case["query"]) for case in TRIVIAL_TEST_CASES]
+        save_random_bert(cls.directory.name, hidden_size=16, initializer_range=0.5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_scores_match_cross_encoder(self):
+        pairs = [(query_text, document_text) for query_text in self.query_texts + ['bees ' * 20]
+                 for document_text in self.document_texts]
+        for max_length in (128, 16, None):
+            with self.subTest(max_length=max_length):
+                reranker = CrossEncoder(self.directory.name, max_length=max_length)
+                # a cross-encoder without a maximum length truncates to the maximum length of its tokenizer
+                reranker.max_seq_length = max_length
+                reranker.tokenizer.model_max_length = 24
+                pretokenized_reranker = PretokenizedCrossEncoder(reranker, max_cached_tokens=20)
+                np.testing.assert_allclose(reranker.predict(pairs, batch_size=4),
+                                           pretokenized_reranker.predict(pairs, batch_size=4), atol=1e-5)
+                self.assertIsNotNone(pretokenized_reranker._template)
+                self.assertLessEqual(pretokenized_reranker._num_cached_tokens, 20)
+
+    def test_changed_max_length(self):
+        pairs = [(query_text, document_text) for query_text in self.query_texts
+                 for document_text in self.document_texts]
+        reranker = CrossEncoder(self.directory.name, max_length=16)
+        pretokenized_reranker = PretokenizedCrossEncoder(reranker)
+        for max_length in (16, 64, 16):
+            with self.subTest(max_length=max_length):
+                reranker.max_seq_length = max_length
+                np.testing.assert_allclose(reranker.predict(pairs), pretokenized_reranker.predict(pairs), atol=1e-5)
@@ -0,0 +1,148 @@
+import unittest
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+
+from pv211_utils.systems.bm25 import BM25PlusSystem
+from pv211_utils.systems.bow import BoWSystem
+from pv211_utils.systems.segments import SegmentedCorpus
+from pv211_utils.systems.tfidf import TfidfSystem
+from pv211_utils.preprocessing.text_preprocessing import DocPreprocessing
+
+
+class TestSegmentedCorpus(unittest.TestCase):
+    def setUp(self):
+        self.corpus = SegmentedCorpus(OrderedDict([('a', 'A'), ('b', 'B'), ('c', 'C')]),
+                                      build_segment=list, merge_segments=self._merge_segments, max_segments=100,
+                                      max_removed_fraction=1.0)
+
+    @staticmethod
+    def _merge_segments(segments, masks):
+        return [document for segment, mask in zip(segments, masks) for document, live in zip(segment, mask) if live]
+
+    def test_add_and_remove(self):
+        self.corpus.add(OrderedDict([('d', 'D'), ('b', 'B2')]))
+        self.corpus.remove(['a'])
+        snapshot = self.corpus.snapshot
+        self.assertEqual(['C', 'D', 'B2'], snapshot.live_documents)
+        self.assertEqual(2, len(snapshot.segments))
+        self.assertEqual(2, snapshot.num_removed)
+        self.assertEqual(3, len(self.corpus))
+        self.assertNotIn('a', self.corpus)
+        with self.assertRaises(KeyError):
+            self.corpus.remove(['c', 'a'])
+        self.assertIn('c', self.corpus)
+
+    def test_compact(self):
+        self.corpus.add(OrderedDict([('d', 'D'), ('b', 'B2')]))
+        self.corpus.remove(['a'])
+        self.corpus.compact()
+        snapshot = self.corpus.snapshot
+        self.assertEqual((['C', 'D', 'B2'],), snapshot.segments)
+        self.assertEqual(['C', 'D', 'B2'], snapshot.live_documents)
+        self.assertEqual(0, snapshot.num_removed)
+        self.corpus.remove(['d'])
+        self.assertEqual(['C', 'B2'], self.corpus.snapshot.live_documents)
+
+    def test_background_compaction(self):
+        corpus = SegmentedCorpus(OrderedDict([('a', 'A')]), build_segment=list, merge_segments=self._merge_segments,
+                                 max_segments=2)
+        for document_id in 'bcd':
+            corpus.add(OrderedDict([(document_id, document_id.upper())]))
+        corpus.wait_for_compaction()
+        self.assertLessEqual(len(corpus.snapshot.segments), 2)
+        self.assertEqual(['A', 'B', 'C', 'D'], corpus.snapshot.live_documents)
+
+    def test_max_segment_size(self):
+        corpus = SegmentedCorpus(OrderedDict((document_id, document_id.upper()) for document_id in 'abcde'),
+                                 build_segment=list, merge_segments=self._merge_segments, max_segment_size=2)
+        self.assertEqual((['A', 'B'], ['C', 'D'], ['E']), corpus.snapshot.segments)
+        corpus.add(OrderedDict([('f', 'F')]))
+        corpus.remove(['c'])
+        corpus.compact()
+        self.assertEqual((['A', 'B'], ['D', 'E'], ['F']), corpus.snapshot.segments)
+        self.assertEqual(['A', 'B', 'D', 'E', 'F'], corpus.snapshot.live_documents)
+
+    def test_merge_top_k(self):
+        self.corpus.add(OrderedDict([('d', 'D')]))
+        self.corpus.remove(['b'])
+        positions, scores = self.corpus.snapshot.merge_top_k(
+            [(np.array([1, 0]), np.array([3.0, 1.0])), (np.array([0]), np.array([2.0]))], 2)
+        self.assertEqual(['D', 'A'], [self.corpus.snapshot.live_documents[position] for position in positions])
+        np.testing.assert_array_equal([2.0, 1.0], scores)
+
+
+class TestIncrementalSystems(unittest.TestCase):
+    def setUp(self):
+        self.preprocessing = DocPreprocessing()
+        document_ids = list(DOCUMENTS)
+        self.initial_documents = OrderedDict((key, DOCUMENTS[key]) for key in document_ids[:20])
+        self.added_documents = OrderedDict((key, DOCUMENTS[key]) for key in document_ids[20:])
+        self.removed_document_ids = document_ids[3:9]
+        self.live_documents = OrderedDict((key, document) for key, document in DOCUMENTS.items()
+                                          if key not in self.removed_document_ids)
+        self.queries = [case["query"] for case in TRIVIAL_TEST_CASES]
+
+    def _assert_same_results(self, expected_system, system):
+        for query in self.queries:
+            with self.subTest(query=str(query)):
+                expected_results = [document.text for document in expected_system.search(query)]
+                self.assertEqual(expected_results, [document.text for document in system.search(query)])
+        for expected_results, results in zip(expected_system.search_batch(self.queries, 3),
+                                             system.search_batch(self.queries, 3)):
+            self.assertEqual([document.text for document in expected_results],
+                             [document.text for document in results])
+
+    def test_add_and_remove_documents(self):
+        system_factories = {
+            'bm25': lambda documents: BM25PlusSystem(documents, self.preprocessing, engine='native'),
+            'pruned bm25': lambda documents: BM25PlusSystem(documents, self.preprocessing, engine='native', k=5),
+            'bow': lambda documents: BoWSystem(documents, self.preprocessing),
+            'tfidf': lambda documents: TfidfSystem(documents, self.preprocessing),
+        }
+        for name, system_factory in system_factories.items():
+            with self.subTest(system=name):
+                expected_system = system_factory(self.live_documents)
+                system = system_factory(self.initial_documents)
+                system.add_documents(self.added_documents)
+                system.remove_documents(self.removed_document_ids)
+                self._assert_same_results(expected_system, system)
+                system.corpus.compact()
+                self.assertEqual(1, len(system.corpus.snapshot.segments))
+                self._assert_same_results(expected_system, system)
+
+    def test_sharded_systems(self):
+        for system_type in (BoWSystem, TfidfSystem):
+            with self.subTest(system=system_type.__name__), TemporaryDirectory() as shard_directory:
+                expected_system = system_type(self.live_documents, self.preprocessing)
+                system = system_type(self.initial_documents, self.preprocessing, shard_size=7,
+                                     shard_directory=shard_directory)
+                self.assertEqual(3, len(system.corpus.snapshot.segments))
+                system.add_documents(self.added_documents)
+                system.remove_documents(self.removed_document_ids)
+                self._assert_same_results(expected_system, system)
+                system.corpus.compact()
+                self.assertTrue(all(segment.num_documents <= 7 for segment in system.corpus.snapshot.segments))
+                self._assert_same_results(expected_system, system)
+
+    def test_index_reuses_segments(self):
+        for system_type in (BoWSystem, TfidfSystem):
+            with self.subTest(system=system_type.__name__):
+                system = system_type(self.initial_documents, self.preprocessing, shard_size=7)
+                segment_indexes = system.index.segment_indexes
+                system.add_documents(self.added_documents)
+                system.remove_documents(self.removed_document_ids)
+                new_segment_indexes = system.index.segment_indexes
+                self.assertLess(len(segment_indexes), len(new_segment_indexes))
+                for segment_index, new_segment_index in zip(segment_indexes, new_segment_indexes):
+                    self.assertIs(segment_index.term_frequencies, new_segment_index.term_frequencies)
+                    # the lengths of the document vectors only follow the inverse document frequencies
+                    self.assertEqual(system_type is BoWSystem, segment_index.norms is new_segment_index.norms)
+
+    def test_rank_bm25_engine(self):
+        system = BM25PlusSystem(DOCUMENTS, self.preprocessing)
+        with self.assertRaises(ValueError):
+            system.add_documents(self.added_documents)
@@ -0,0 +1,25 @@
+import unittest
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+
+from pv211_utils.systems.sentences import SentenceVectors
+
+
+class TestSentenceVectors(unittest.TestCase):
+    def test_similarities_match_sklearn(self):
+        text = '. '.join(str(document) for document in DOCUMENTS.values())
+        sentence_vectors = SentenceVectors(text)
+        query_texts = [str(case["query"]) for case in TRIVIAL_TEST_CASES] + ['bees bees honey unknown', '']
+        for query_text in query_texts:
+            with self.subTest(query=query_text):
+                vectors = TfidfVectorizer().fit_transform([query_text] + text.split('. '))
+                expected_similarities = (vectors[1:] * vectors[0].T).toarray().flatten()
+                np.testing.assert_allclose(expected_similarities, sentence_vectors.get_similarities(query_text),
+                                           atol=1e-12)
+
+    def test_top_k_sentences(self):
+        sentence_vectors = SentenceVectors('Bees make honey. Cats sleep. Honey bees dance')
+        self.assertEqual('Honey bees dance Bees make honey', sentence_vectors.get_top_k_sentences('honey bees', 2))
@@ -0,0 +1,82 @@
+import unittest
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest.mock import patch
+
+import numpy as np
+from gensim.similarities import SparseMatrixSimilarity
+
+from test.systems.data_ir_testset import DOCUMENTS, TRIVIAL_TEST_CASES
+
+from pv211_utils.systems.index_builder import build_inverted_index
+from pv211_utils.systems.tfidf import TfidfSystem
+from pv211_utils.preprocessing.text_preprocessing import DocPreprocessing, LowerDocPreprocessing
+
+
+class TestTfidfSystem(unittest.TestCase):
+    def setUp(self):
+        self.queries = [case["query"] for case in TRIVIAL_TEST_CASES]
+
+    def test_concurrent_searches(self):
+        system = TfidfSystem(DOCUMENTS, DocPreprocessing())
+        expected_results = [[document.text for document in system.search(query)] for query in self.queries]
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda query: [document.text for document in system.search(query)],
+                                        self.queries * 4))
+        self.assertEqual(expected_results * 4, results)
+
+    def test_interleaved_systems(self):
+        systems = [TfidfSystem(DOCUMENTS, DocPreprocessing()), TfidfSystem(DOCUMENTS, LowerDocPreprocessing())]
+        expected_results = [[[document.text for document in system.search(query)] for query in self.queries]
+                            for system in systems]
+        searches = [[system.search(query) for query in self.queries] for system in systems]
+        results = [[[] for _ in self.queries] for _ in systems]
+        for _ in range(len(DOCUMENTS)):
+            for system_number, system_searches in enumerate(searches):
+                for query_number, search in enumerate(system_searches):
+                    results[system_number][query_number].append(next(search).text)
+        self.assertEqual(expected_results, results)
+
+    def test_start_method(self):
+        system = TfidfSystem(DOCUMENTS, DocPreprocessing(), num_workers=1)
+        # small chunks, so that the documents are tokenized by the spawned worker processes
+        with patch('pv211_utils.systems.tfidf.build_inverted_index',
+                   side_effect=partial(build_inverted_index, chunk_size=2)) as mock_build_inverted_index:
+            spawned_system = TfidfSystem(DOCUMENTS, DocPreprocessing(), num_workers=2, start_method='spawn')
+        self.assertEqual('spawn', mock_build_inverted_index.call_args.kwargs['start_method'])
+        for query in self.queries:
+            with self.subTest(query=str(query)):
+                self.assertEqual([document.text for document in system.search(query)],
+                                 [document.text for document in spawned_system.search(query)])
+
+    def test_hashing_vocabulary(self):
+        system = TfidfSystem(DOCUMENTS, DocPreprocessing())
+        hashing_system = TfidfSystem(DOCUMENTS, DocPreprocessing(), num_buckets=2**20)
+        for query in self.queries:
+            with self.subTest(query=str(query)):
+                self.assertEqual([document.text for document in system.search(query)][:3],
+                                 [document.text for document in hashing_system.search(query)][:3])
+
+    def test_deprecated_attributes(self):
+        preprocessing = DocPreprocessing()
+        for num_buckets in (None, 2**20):
+            with self.subTest(num_buckets=num_buckets):
+                system = TfidfSystem(DOCUMENTS, preprocessing, num_buckets=num_buckets)
+                # assertWarns would import the lazy modules of transformers while resetting their warning registries
+                with warnings.catch_warnings(record=True) as caught_warnings:
+                    warnings.simplefilter('always')
+                    dictionary, tfidf_model = system.dictionary, system.tfidf_model
+                    index_to_document = system.index_to_document
+                self.assertEqual([DeprecationWarning] * 3, [warning.category for warning in caught_warnings])
+                self.assertEqual(list(DOCUMENTS.values()), [index_to_document[number]
+                                                            for number in range(len(DOCUMENTS))])
+
+                # the gensim models reproduce the similarities of the system
+                index = SparseMatrixSimilarity(
+                    [tfidf_model[dictionary.doc2bow(preprocessing(str(document)))] for document in DOCUMENTS.values()],
+                    num_features=len(system.vocabulary))
+                for query in self.queries:
+                    similarities = index[tfidf_model[dictionary.doc2bow(preprocessing(str(query)))]]
+                    np.testing.assert_allclose(similarities, system.index.get_scores(preprocessing(str(query))),
+                                               atol=1e-6)
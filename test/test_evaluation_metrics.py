@@ -1,5 +1,5 @@
 import unittest
-from typing import Any, Iterable, Dict, List
+from typing import Any, Iterable, Dict, List, Optional
 from collections import OrderedDict
 
 from pv211_utils.evaluation_metrics import (mean_average_precision,
@@ -37,6 +37,17 @@ class System(IRSystemBase):
             yield DOCUMENTS[doc_id]
 
 
+class BatchedSystem(System):
+    def search_batch(self, queries: Iterable[QueryBase], k: Optional[int] = None) -> List[Iterable[DocumentBase]]:
+        return [[DOCUMENTS[doc_id] for doc_id in self.doc_order[query.query_id][:k]] for query in queries]
+
+
+class BadSystem(BatchedSystem):
+    def search(self, query: QueryBase) -> Iterable[DocumentBase]:
+        for doc_id in reversed(self.doc_order[query.query_id]):
+            yield DOCUMENTS[doc_id]
+
+
 class TestEvaluationMetrics(unittest.TestCase):
     def setUp(self) -> None:
         self.system_perfect = System({1: [1, 2, 3, 4], 2: [4, 3, 2, 1]})
@@ -143,3 +154,11 @@ class TestEvaluationMetrics(unittest.TestCase):
 
         self.assertAlmostEqual(0.75, map_1)
         self.assertAlmostEqual(0.708333333, map_2)
+
+    def test_overridden_search(self):
+        system = BadSystem({1: [1, 2, 3, 4], 2: [4, 3, 2, 1]})
+        for num_processes in (1, 2):
+            with self.subTest(num_processes=num_processes):
+                self.assertEqual(0, mean_precision(system, QUERIES, JUDGEMENTS, 2, num_processes))
+                self.assertEqual(1, mean_precision(BatchedSystem(system.doc_order), QUERIES, JUDGEMENTS, 2,
+                                                   num_processes))